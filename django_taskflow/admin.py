@@ -9,6 +9,9 @@ from .models import (Workflow, WorkflowAdmin,
                      Operation, OperationAdmin,
                      OperatorTask, OperatorTaskAdmin,
                      Step, StepAdmin,
+                     ArchivedTicket, ArchivedTicketAdmin,
+                     TicketTrace, TicketTraceAdmin,
+                     ScriptRun, ScriptRunAdmin,
                      )
 
 
@@ -20,3 +23,6 @@ admin.site.register(Link, LinkAdmin)
 admin.site.register(Operation, OperationAdmin)
 admin.site.register(OperatorTask, OperatorTaskAdmin)
 admin.site.register(Step, StepAdmin)
+admin.site.register(ArchivedTicket, ArchivedTicketAdmin)
+admin.site.register(TicketTrace, TicketTraceAdmin)
+admin.site.register(ScriptRun, ScriptRunAdmin)
@@ -1,6 +1,31 @@
 from django.apps import AppConfig
+from django.utils.module_loading import import_string
 
 
 class DjangoTaskflowConfig(AppConfig):
     name = 'django_taskflow'
     verbose_name = "TaskFlow"
+
+    def ready(self):
+        from .conf import taskflow_setting
+        from .graph import connect_signals
+        from .metrics import metrics_collector
+        from .notify import publish_runnable
+        from .registry import operation_registry
+        from .signals import ticket_runnable
+        from . import checks
+
+        connect_signals()
+        ticket_runnable.connect(publish_runnable, dispatch_uid="taskflow_publish_runnable")
+
+        operation_registry.load_declarations()
+        operation_registry.warm()
+
+        wakeup_handler = taskflow_setting('WAKEUP_HANDLER')
+        if wakeup_handler:
+            ticket_runnable.connect(import_string(wakeup_handler),
+                                    dispatch_uid="taskflow_wakeup_handler")
+
+        collector = metrics_collector()
+        if collector is not None:
+            collector.connect()
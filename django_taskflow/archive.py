@@ -0,0 +1,134 @@
+"""Archival of the history of finished tickets
+
+Tickets that finished or were terminated before a cutoff are removed from the
+live tables in chunks, in order of primary key. Each chunk is its own short
+transaction, so the live tables are never locked for long and an interrupted
+run loses at most the chunk in progress. Unless only deleting, the steps, tasks
+and operator tasks of each ticket are first copied into a single ArchivedTicket
+row.
+"""
+
+
+from django.db import transaction
+
+from .models import Ticket, Step, Task, OperatorTask, ArchivedTicket, TaskStatus
+
+
+ARCHIVABLE_STATUSES = [TaskStatus.FINISHED,
+                       TaskStatus.TERMINATED,
+                       ]
+
+
+def archivable_tickets(cutoff):
+    """Tickets that finished or were terminated before the cutoff"""
+    return Ticket.objects.filter(status__in=ARCHIVABLE_STATUSES,
+                                 current_task__creation__lt=cutoff)
+
+
+def _timestamp(value):
+    return value.isoformat() if value is not None else None
+
+
+def ticket_histories(ticket_ids):
+    """Return the history of each ticket as a list of steps, oldest first"""
+
+    steps = {}
+    histories = {ticket_id: [] for ticket_id in ticket_ids}
+    for step in Step.objects.filter(ticket__in=ticket_ids).select_related('element').order_by('creation', 'pk').iterator():
+        steps[step.pk] = {'element': step.element.slug_name,
+                          'creation': _timestamp(step.creation),
+                          'tasks': [],
+                          'operator_tasks': [],
+                          }
+        histories[step.ticket_id].append(steps[step.pk])
+
+    tasks = {}
+    for task in Task.objects.filter(step__ticket__in=ticket_ids).order_by('pk').iterator():
+        # Decode delta-encoded states against the tasks already loaded
+        if task.state_base_id in tasks:
+            task.state_base = tasks[task.state_base_id]
+        tasks[task.pk] = task
+
+    for task in sorted(tasks.values(), key=lambda t: (t.creation, t.pk)):
+        steps[task.step_id]['tasks'].append({'status': task.status,
+                                             'creation': _timestamp(task.creation),
+                                             'creator': task.creator_id,
+                                             'state': task.state,
+                                             })
+
+    for op_task in OperatorTask.objects.filter(step__ticket__in=ticket_ids).order_by('created', 'pk').iterator():
+        steps[op_task.step_id]['operator_tasks'].append({'operator': op_task.operator_id,
+                                                         'created': _timestamp(op_task.created),
+                                                         'completed': _timestamp(op_task.completed),
+                                                         })
+    return histories
+
+
+def archive_chunk(cutoff, after_id=0, chunk_size=100, delete_only=False, ticket_ids=None):
+    """Archive, or just delete, the next chunk of tickets with a primary key above after_id.
+
+    Tickets locked by another transaction are skipped rather than waited for. With
+    ticket_ids, only those tickets are considered. Returns (removed, skipped): the ids of
+    the tickets removed and of those skipped, each in order; both are empty once there
+    are no tickets left.
+    """
+    candidates = archivable_tickets(cutoff).filter(pk__gt=after_id)
+    if ticket_ids is not None:
+        candidates = candidates.filter(pk__in=ticket_ids)
+
+    with transaction.atomic():
+        candidate_ids = list(candidates.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not candidate_ids:
+            return [], []
+        tickets = list(archivable_tickets(cutoff)
+                       .filter(pk__in=candidate_ids)
+                       .select_related('current_task')
+                       .select_for_update(skip_locked=True, of=('self',))
+                       .order_by('pk'))
+
+        removed = [ticket.pk for ticket in tickets]
+        if tickets and not delete_only:
+            histories = ticket_histories(removed)
+            ArchivedTicket.objects.bulk_create([ArchivedTicket(ticket_id=ticket.pk,
+                                                               workflow_id=ticket.workflow_id,
+                                                               creation=ticket.creation,
+                                                               creator_id=ticket.creator_id,
+                                                               finished=ticket.current_task.creation,
+                                                               status=ticket.status,
+                                                               history=histories[ticket.pk])
+                                                for ticket in tickets])
+
+        Ticket.objects.filter(pk__in=removed).delete()
+
+    removed_ids = set(removed)
+    return removed, [pk for pk in candidate_ids if pk not in removed_ids]
+
+
+def archive_tickets(cutoff, after_id=0, chunk_size=100, delete_only=False, skipped=None):
+    """Archive every ticket finished before the cutoff, yielding the ids removed by each chunk.
+
+    Tickets that are locked when their chunk is archived are tried again once the other
+    chunks are done. If a skipped list is given, the ids of the tickets still locked then
+    are appended to it.
+    """
+    locked = []
+    while True:
+        removed, chunk_skipped = archive_chunk(cutoff, after_id, chunk_size, delete_only)
+        if not removed and not chunk_skipped:
+            break
+        locked.extend(chunk_skipped)
+        if skipped is not None:
+            skipped.extend(chunk_skipped)
+        if removed:
+            yield removed
+        after_id = max(removed + chunk_skipped)
+
+    for start in range(0, len(locked), chunk_size):
+        retry = locked[start:start + chunk_size]
+        removed, still_locked = archive_chunk(cutoff, 0, chunk_size, delete_only, ticket_ids=retry)
+        if skipped is not None:
+            for ticket_id in retry:
+                if ticket_id not in still_locked:
+                    skipped.remove(ticket_id)
+        if removed:
+            yield removed
@@ -0,0 +1,220 @@
+"""Throughput and latency benchmarks for the workflow engine
+
+Each scenario runs a number of new tickets of one workflow to quiescence, with
+either Ticket.run_workflow for each ticket ('single') or Ticket.run_workflow_many
+for all of them ('bulk'), and measures
+
+* tickets_per_second, including creation of the tickets
+* step_p50_ms and step_p99_ms, the time taken to produce each new task ('single' only)
+* queries_per_step, the number of database queries for each new task
+* peak_memory_kb, the peak memory allocated while running, from a second run
+
+The example workflows are used as they are. The synthetic 'wide' and 'deep'
+workflows are created for the run, and everything created is deleted afterwards.
+"""
+
+
+import contextlib
+import os
+import platform
+import time
+import tracemalloc
+
+import django
+from django.db import connection
+from django.db.models.signals import post_save
+
+from .models import Workflow, Operation, Element, Link, Ticket, Task
+
+
+ENGINES = ('single', 'bulk')
+
+# Whether a larger value of each metric is better
+METRICS = {'tickets_per_second': True,
+           'step_p50_ms': False,
+           'step_p99_ms': False,
+           'queries_per_step': False,
+           'peak_memory_kb': False,
+           }
+
+DEEP_DEPTH = 20
+WIDE_WIDTH = 50
+
+
+def benchmark_script(element_parameters, source_data):
+    """Script used by the synthetic workflows, recording how far the ticket has got"""
+    state = dict(source_data or {})
+    state['steps'] = state.get('steps', 0) + 1
+    return state
+
+
+def _synthetic_workflow(slug, elements, links):
+    """Create a workflow of Script elements after an initial element. links are (source, target, slug) indexes."""
+    workflow = Workflow.objects.create(name=slug, slug=slug, description="Benchmark workflow")
+    init = Operation.objects.get(slug='__init')
+    script = Operation.objects.get(slug='script')
+
+    created = [Element.objects.create(workflow=workflow, operation=init, op_params={},
+                                      slug_name='start', is_initial=True)]
+    for i in range(1, elements):
+        created.append(Element.objects.create(workflow=workflow, operation=script,
+                                              op_params={'script_name': 'django_taskflow.benchmark.benchmark_script'},
+                                              slug_name=f"script-{i}"))
+    Link.objects.bulk_create([Link(source=created[source], target=created[target], slug_name=slug_name)
+                              for source, target, slug_name in links])
+    return workflow
+
+
+def deep_workflow(depth=DEEP_DEPTH):
+    """A chain of depth scripts"""
+    return _synthetic_workflow(f"benchmark-deep-{depth}", depth + 1,
+                               [(i, i + 1, 'next') for i in range(depth)])
+
+
+def wide_workflow(width=WIDE_WIDTH):
+    """Two scripts in turn, each element with width links to choose the next one from"""
+    links = []
+    for source, target in [(0, 1), (1, 2)]:
+        links.append((source, target, 'next'))
+        links.extend((source, branch, f"branch-{branch}") for branch in range(3, width + 2))
+    return _synthetic_workflow(f"benchmark-wide-{width}", width + 2, links)
+
+
+SCENARIOS = {'simple-steps': lambda: Workflow.objects.get(slug='simple-steps'),
+             'multistep': lambda: Workflow.objects.get(slug='multistep'),
+             'deep': deep_workflow,
+             'wide': wide_workflow,
+             }
+
+
+class QueryCounter:
+    """Count the queries run on a connection"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class StepTimer:
+    """Record the time taken to produce each new task"""
+
+    def __init__(self):
+        self.latencies = []
+        self.mark()
+
+    def mark(self):
+        self.last = time.perf_counter()
+
+    def __call__(self, sender, instance, created, **kwargs):
+        if created:
+            moment = time.perf_counter()
+            self.latencies.append(moment - self.last)
+            self.last = moment
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _run_tickets(workflow, engine, count, context, timer=None):
+    if engine == 'single':
+        tickets = []
+        for _ in range(count):
+            if timer is not None:
+                timer.mark()
+            ticket = workflow.create_ticket(context)
+            ticket.run_workflow(context)
+            tickets.append(ticket)
+    else:
+        tickets = [workflow.create_ticket(context) for _ in range(count)]
+        Ticket.run_workflow_many(tickets, context)
+    return tickets
+
+
+def run_scenario(workflow, engine, count, user):
+    """Run count new tickets of a workflow and return the measurements"""
+    context = {'user': user,
+               }
+    created = []
+    try:
+        counter = QueryCounter()
+        timer = StepTimer()
+        post_save.connect(timer, sender=Task)
+        try:
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                created.extend(_run_tickets(workflow, engine, count, context, timer))
+                elapsed = time.perf_counter() - start
+        finally:
+            post_save.disconnect(timer, sender=Task)
+
+        tracemalloc.start()
+        try:
+            created.extend(_run_tickets(workflow, engine, count, context))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        steps = Task.objects.filter(step__ticket__in=created[:count]).count()
+    finally:
+        Ticket.objects.filter(pk__in=[t.pk for t in created]).delete()
+
+    latencies = timer.latencies if engine == 'single' else []
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    return {'tickets': count,
+            'steps': steps,
+            'seconds': elapsed,
+            'tickets_per_second': count / elapsed if elapsed else None,
+            'step_p50_ms': p50 * 1000 if p50 is not None else None,
+            'step_p99_ms': p99 * 1000 if p99 is not None else None,
+            'queries_per_step': counter.count / steps if steps else None,
+            'peak_memory_kb': peak / 1024,
+            }
+
+
+def run_benchmarks(user, scenarios=None, engines=ENGINES, count=100, quiet=True):
+    """Run each scenario with each engine, returning the results in a form suitable for json"""
+    results = {'environment': {'python': platform.python_version(),
+                               'django': django.get_version(),
+                               'database': connection.vendor,
+                               },
+               'scenarios': {},
+               }
+
+    for name in scenarios or SCENARIOS:
+        workflow = SCENARIOS[name]()
+        synthetic = workflow.slug.startswith('benchmark-')
+        try:
+            for engine in engines:
+                with open(os.devnull, 'w') as devnull:
+                    # Operations may print as they go
+                    with contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+                        results['scenarios'][f"{name}/{engine}"] = run_scenario(workflow, engine, count, user)
+        finally:
+            if synthetic:
+                workflow.delete()
+    return results
+
+
+def compare_results(results, baseline, threshold=0.2):
+    """Return a description of each metric that is worse than the baseline by more than the threshold"""
+    regressions = []
+    for scenario, measured in results['scenarios'].items():
+        expected = baseline.get('scenarios', {}).get(scenario)
+        if expected is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            value, reference = measured.get(metric), expected.get(metric)
+            if value is None or not reference:
+                continue
+            change = (value - reference) / reference
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{scenario} {metric}: {value:.3f} against {reference:.3f} ({change:+.0%})")
+    return regressions
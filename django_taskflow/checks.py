@@ -0,0 +1,18 @@
+"""System checks for django_taskflow"""
+
+
+from django.core.checks import Error, register
+
+from .base_operations import _OPERATIONS
+from .registry import operation_registry
+
+
+@register()
+def check_operations(app_configs, **kwargs):
+    """Report any declared or built-in operation that cannot be resolved"""
+    failures = operation_registry.warm([op['function'] for op in _OPERATIONS])
+    return [Error(f"Cannot resolve operation {name}: {e}",
+                  hint="Check TASKFLOW_OPERATIONS and any installed operation entry points",
+                  obj=name,
+                  id='django_taskflow.E001')
+            for name, e in failures.items()]
@@ -0,0 +1,65 @@
+"""Settings for django_taskflow
+
+Each setting is read from the Django settings module with a TASKFLOW_ prefix,
+falling back to the default given here.
+"""
+
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Mapping of operation name to dotted path of a function or OpBase subclass
+    'OPERATIONS': {},
+    # Entry point group scanned for further operation declarations
+    'OPERATION_ENTRY_POINT_GROUP': 'django_taskflow.operations',
+    # Maximum number of rows written by a single bulk insert or update
+    'BULK_BATCH_SIZE': 1000,
+    # Largest number of tasks passed together to the operate_batch method of an operation
+    'OPERATION_BATCH_SIZE': 500,
+    # Number of tickets locked and advanced in each transaction by Ticket.advance_many
+    'TICKETS_PER_TRANSACTION': 50,
+    # Number of processes for Script operations run with the 'process' executor; None for one per CPU
+    'PROCESS_POOL_SIZE': None,
+    # Seconds after which a script run claimed by a worker that stopped renewing its claim
+    # is taken over by another worker
+    'PROCESS_CLAIM_TIMEOUT': 300,
+    # Dotted path of a receiver for the ticket_runnable signal, such as django_taskflow.worker.enqueue_ticket
+    'WAKEUP_HANDLER': None,
+    # Dotted path of the class used to notify workers of runnable tickets, for example
+    # django_taskflow.notify.PostgresBackend or django_taskflow.notify.InMemoryBackend
+    'NOTIFY_BACKEND': None,
+    # Channel used by the PostgreSQL LISTEN/NOTIFY backend
+    'NOTIFY_CHANNEL': 'taskflow_runnable',
+    # How task state is stored: 'full' for a copy in every task, or 'delta' for JSON patches
+    'STATE_STORAGE': 'full',
+    # With delta storage, the longest chain of patches before a full snapshot is written
+    'STATE_SNAPSHOT_INTERVAL': 10,
+    # Dotted path of the class receiving engine measurements, such as
+    # django_taskflow.metrics.PrometheusCollector; None to not measure
+    'METRICS_COLLECTOR': None,
+    # Bearer token that scrapers can present to the metrics view instead of logging in as
+    # a user with the view_ticket permission; None to only allow such users
+    'METRICS_TOKEN': None,
+    # Fraction of tickets whose steps are kept, with their states, in the trace buffer
+    'TRACE_SAMPLE_RATE': 0.0,
+    # Number of events held by the trace buffer
+    'TRACE_BUFFER_SIZE': 1000,
+    # Seconds for which a compiled workflow graph is used before it is checked against the database
+    'GRAPH_CHECK_INTERVAL': 1.0,
+    # Number of results of pure operations kept in each process
+    'MEMO_SIZE': 1024,
+    # Seconds for which a memoised result is kept; None to keep it until evicted
+    'MEMO_TTL': None,
+    # Name of a Django cache in which memoised results are also shared between processes
+    'MEMO_CACHE': None,
+    # Slugs of workflows run in memory, saving only the tasks at checkpoints
+    'CHECKPOINT_WORKFLOWS': (),
+    # Whether a run saving only checkpoints also writes the steps taken as a TicketTrace
+    'CHECKPOINT_TRACE': False,
+}
+
+
+def taskflow_setting(name):
+    """Return the value of TASKFLOW_<name>, or its default"""
+    return getattr(settings, f"TASKFLOW_{name}", DEFAULTS[name])
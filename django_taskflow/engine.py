@@ -0,0 +1,495 @@
+"""Batch execution of workflows over many tickets
+
+A batch run advances each ticket exactly as Ticket.run_workflow would, but runs
+the operations in memory and writes the resulting steps, tasks and ticket
+updates with a handful of bulk statements instead of one statement per row.
+Operations with an operate_batch method are given all the tickets waiting at an
+element in one call.
+"""
+
+
+import asyncio
+import copy
+import logging
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+
+from django.db import connection, transaction, IntegrityError
+from django.utils.timezone import now
+
+from .conf import taskflow_setting
+from .graph import compiled_workflow, cached_workflow, acompiled_workflow
+from .instrumentation import measured
+from .jsonpatch import make_patch
+from .models import Ticket, Step, Task, Element, TicketTrace, RUNNABLE_STATUSES
+from .signals import persistence_measured, send_ticket_runnable
+
+
+logger = logging.getLogger(__name__)
+
+# Tasks always written by a run saving only checkpoints: those waiting on something
+# outside the engine, and errors
+CHECKPOINT_STATUSES = [Task.Status.WAITING,
+                       Task.Status.ERROR,
+                       ]
+
+
+@contextmanager
+def advancing(tickets):
+    """Mark tickets as being advanced by the engine, so that the tasks saved for them are not announced"""
+    previous = [ticket.advancing for ticket in tickets]
+    for ticket in tickets:
+        ticket.advancing = True
+    try:
+        yield
+    finally:
+        for ticket, value in zip(tickets, previous):
+            ticket.advancing = value
+
+
+class BatchRun:
+    """Run many tickets to quiescence in memory and persist the results in bulk.
+
+    With max_steps, each ticket is advanced by at most that many steps.
+
+    With checkpoints, the tasks a ticket passes through on the way are not written. Only
+    its last task is, together with any task left WAITING or in ERROR, or at an element
+    whose op_params set 'checkpoint', and the steps those tasks belong to. If
+    TASKFLOW_CHECKPOINT_TRACE is set, the whole run of each ticket is written as a single
+    TicketTrace.
+
+    operations_started is set once the first operation is called, after which a failed run
+    cannot be repeated without calling the operations that had already run again.
+    """
+
+    def __init__(self, context, max_steps=None, checkpoints=False):
+        self.max_steps = max_steps
+        self.checkpoints = checkpoints
+        self.traces = {} if checkpoints and taskflow_setting('CHECKPOINT_TRACE') else None
+        self.deferred_steps = []
+        self.context = dict(context,
+                            deferred_steps=self.deferred_steps)
+        self.new_tasks = []
+        self.updated_tasks = []
+        self._recorded = {}
+        self.operations_started = False
+
+    def run(self, tickets):
+        tickets = list(tickets)
+        if not tickets:
+            return []
+
+        with advancing(tickets), transaction.atomic():
+            pending = self.pending_tasks(tickets)
+            last_tasks = self.run_tickets(tickets, pending)
+            self.flush(tickets, last_tasks)
+
+        return [self.persisted(task) for task in last_tasks]
+
+    async def arun(self, tickets):
+        """Version of run for use within an event loop.
+
+        Operations are awaited, so that the runs of many tickets can wait on external
+        systems at once. The tickets are loaded in one call, and the steps, tasks and
+        ticket updates of the run are written in another, in a transaction of their own,
+        so that a run that fails leaves its tickets as they were. Operations with
+        operate_batch are given one task at a time.
+        """
+        tickets = list(tickets)
+        if not tickets:
+            return []
+
+        with advancing(tickets):
+            pending = await sync_to_async(self.pending_tasks, thread_sensitive=True)(tickets)
+            last_tasks = await self.arun_tickets(tickets, pending)
+            await sync_to_async(self.atomic_flush, thread_sensitive=True)(tickets, last_tasks)
+
+        return [self.persisted(task) for task in last_tasks]
+
+    def pending_tasks(self, tickets):
+        """Find the task and element to process next for each ticket, using one query per kind of ticket"""
+
+        # Refresh the current task pointers, in case the ticket instances are stale
+        fresh = Ticket.objects.select_related('current_task__step').in_bulk([t.pk for t in tickets])
+        current_tasks = {}
+        for ticket in tickets:
+            ticket.current_task = fresh[ticket.pk].current_task
+            ticket.status = fresh[ticket.pk].status
+            if ticket.current_task is not None:
+                current_tasks[ticket.current_task_id] = ticket.current_task
+
+        new_tickets = [t for t in tickets if t.current_task_id is None]
+        initial_elements = {}
+        for ticket in new_tickets:
+            element = compiled_workflow(ticket.workflow_id).initial
+            if element is None:
+                raise Element.DoesNotExist(f"No initial element for workflow {ticket.workflow_id}")
+            initial_elements[ticket.pk] = element
+
+        initial_steps = {}
+        for step in Step.objects.filter(ticket__in=new_tickets,
+                                        element__in=set(initial_elements.values())).order_by('pk'):
+            if step.element_id == initial_elements[step.ticket_id].pk:
+                initial_steps.setdefault(step.ticket_id, step)
+
+        pending = {}
+        for ticket in tickets:
+            if ticket.current_task_id is None:
+                element = initial_elements[ticket.pk]
+                step = initial_steps.get(ticket.pk)
+                if step is None:
+                    step = Step.start(ticket, element, self.context)
+                step.ticket = ticket
+                pre_task = Task(step=step,
+                                state=copy.deepcopy(self.context.get('initial_arguments', {})),
+                                creator=self.context['user'])
+            else:
+                pre_task = current_tasks[ticket.current_task_id]
+                pre_task.step.ticket = ticket
+                element = compiled_workflow(ticket.workflow_id).element(pre_task.step.element_id)
+            pending[ticket.pk] = (pre_task, element)
+        return pending
+
+    def run_tickets(self, tickets, pending):
+        """Advance every ticket a step at a time until none makes progress.
+
+        At each step the tasks waiting at an element whose operation supports batches are
+        passed to it together, TASKFLOW_OPERATION_BATCH_SIZE at a time; other tasks are
+        processed one by one. Returns the last task of each ticket.
+        """
+        batch_size = taskflow_setting('OPERATION_BATCH_SIZE')
+        last_tasks = {ticket.pk: None for ticket in tickets}
+        current = {ticket.pk: pending[ticket.pk] for ticket in tickets}
+        steps = 0
+        while current and (self.max_steps is None or steps < self.max_steps):
+            steps += 1
+
+            groups = {}
+            for ticket_id, (task, element) in current.items():
+                func = compiled_workflow(element.workflow_id).operation_callable(element.pk)
+                supports_batch = getattr(func, 'supports_batch', None)
+                batched = supports_batch is not None and supports_batch(task, element)
+                groups.setdefault(element.pk if batched else None, []).append(ticket_id)
+
+            self.operations_started = True
+            new_tasks = {}
+            for element_id, ticket_ids in groups.items():
+                if element_id is None:
+                    for ticket_id in ticket_ids:
+                        task, element = current[ticket_id]
+                        new_tasks[ticket_id] = element.process_task(task, self.context)
+                    continue
+                element = current[ticket_ids[0]][1]
+                for start in range(0, len(ticket_ids), batch_size):
+                    chunk = ticket_ids[start:start + batch_size]
+                    results = element.process_batch([current[ticket_id][0] for ticket_id in chunk], self.context)
+                    new_tasks.update(zip(chunk, results))
+
+            advanced = {}
+            for ticket_id, (task, element) in current.items():
+                new_task = new_tasks[ticket_id]
+                if new_task is None:
+                    continue
+                self.record(new_task, task)
+                last_tasks[ticket_id] = new_task
+                graph = compiled_workflow(element.workflow_id)
+                advanced[ticket_id] = (new_task, graph.element(new_task.step.element_id))
+            current = advanced
+
+        return [last_tasks[ticket.pk] for ticket in tickets]
+
+    async def arun_tickets(self, tickets, pending):
+        """Advance every ticket concurrently until none makes progress. Returns the last task of each ticket."""
+
+        async def advance(task, element):
+            last_task = None
+            steps = 0
+            while self.max_steps is None or steps < self.max_steps:
+                steps += 1
+                self.operations_started = True
+                new_task = await element.aprocess_task(task, self.context)
+                if new_task is None:
+                    break
+                self.record(new_task, task)
+                last_task = new_task
+                graph = await acompiled_workflow(element.workflow_id)
+                task, element = new_task, graph.element(new_task.step.element_id)
+            return last_task
+
+        return list(await asyncio.gather(*[advance(*pending[ticket.pk]) for ticket in tickets]))
+
+    def record(self, task, incoming_task):
+        """Queue a task for persistence, as it would be saved at this point by run_workflow"""
+
+        if self.traces is not None:
+            self.trace(task, incoming_task)
+
+        if id(task) in self._recorded:
+            # The operation modified and returned the task it was given
+            obj, index = self._recorded[id(task)]
+            self.new_tasks[index] = self.snapshot(task, self.new_tasks[index]._state_source)
+        elif task.pk is not None:
+            self.updated_tasks.append(task)
+        else:
+            self._recorded[id(task)] = (task, len(self.new_tasks))
+            self.new_tasks.append(self.snapshot(task, self.persisted(getattr(task, '_state_source', None))))
+
+    def trace(self, task, incoming_task):
+        ticket_id = task.step.ticket.pk
+        if ticket_id not in self.traces:
+            self.traces[ticket_id] = ([], copy.deepcopy(incoming_task.state))
+        steps, previous = self.traces[ticket_id]
+        steps.append({'element': self.element(task).slug_name,
+                      'status': task.status,
+                      'patch': copy.deepcopy(make_patch(previous, task.state)),
+                      })
+        self.traces[ticket_id] = (steps, copy.deepcopy(task.state))
+
+    @staticmethod
+    def element(task):
+        return cached_workflow(task.step.ticket.workflow_id).element(task.step.element_id)
+
+    def is_checkpoint(self, task):
+        return (task.status in CHECKPOINT_STATUSES
+                or bool((self.element(task).op_params or {}).get('checkpoint')))
+
+    def checkpoint_tasks(self, last_tasks):
+        """Return the new tasks that are checkpoints, dropping the steps left without tasks"""
+        last = {id(self.persisted(task)) for task in last_tasks if task is not None}
+        kept = [task for task in self.new_tasks if id(task) in last or self.is_checkpoint(task)]
+        kept_ids = {id(task) for task in kept}
+
+        for task in kept:
+            # Delta states are encoded against the nearest task that is written
+            source = task._state_source
+            while source is not None and source.pk is None and id(source) not in kept_ids:
+                source = source._state_source
+            task._state_source = source
+
+        steps = {id(task.step) for task in kept}
+        self.deferred_steps[:] = [step for step in self.deferred_steps if id(step) in steps]
+        return kept
+
+    @staticmethod
+    def snapshot(task, source):
+        """Copy a task so that later in-memory changes do not alter what is written"""
+        snapshot = Task(step=task.step,
+                        state=copy.deepcopy(task.state),
+                        creator_id=task.creator_id,
+                        status=task.status)
+        snapshot._state_source = source
+        return snapshot
+
+    def persisted(self, task):
+        if task is None:
+            return None
+        recorded = self._recorded.get(id(task))
+        if recorded is not None:
+            return self.new_tasks[recorded[1]]
+        return task
+
+    def atomic_flush(self, tickets, last_tasks):
+        with transaction.atomic():
+            self.flush(tickets, last_tasks)
+
+    def flush(self, tickets, last_tasks):
+        can_bulk = connection.features.can_return_rows_from_bulk_insert
+        batch_size = taskflow_setting('BULK_BATCH_SIZE')
+
+        new_tasks = self.checkpoint_tasks(last_tasks) if self.checkpoints else self.new_tasks
+
+        steps = [s for s in self.deferred_steps if s.pk is None]
+        if can_bulk:
+            Step.objects.bulk_create(steps, batch_size=batch_size)
+        else:
+            for step in steps:
+                step.save()
+
+        for task in new_tasks:
+            # Assigning the step, not step_id, keeps the cached step and its ticket
+            task.step = task.step
+        if can_bulk:
+            with measured(persistence_measured, Task, task=None, count=len(new_tasks)):
+                self.bulk_create_tasks(new_tasks, batch_size)
+        else:
+            for task in new_tasks:
+                task.save()
+
+        for task in self.updated_tasks:
+            task.save()
+
+        checked = now()
+        for ticket, last_task in zip(tickets, last_tasks):
+            last_task = self.persisted(last_task)
+            if last_task is not None:
+                ticket.current_task = last_task
+                ticket.status = last_task.status
+            ticket.last_check = checked
+            ticket.last_checkor = self.context['user']
+
+        Ticket.objects.bulk_update(tickets, ['current_task', 'status', 'last_check', 'last_checkor'],
+                                   batch_size=batch_size)
+
+        if self.traces:
+            TicketTrace.objects.bulk_create([TicketTrace(ticket_id=ticket_id,
+                                                         steps=steps)
+                                             for ticket_id, (steps, state) in self.traces.items()],
+                                            batch_size=batch_size)
+
+    def bulk_create_tasks(self, tasks, batch_size):
+        if taskflow_setting('STATE_STORAGE') != 'delta':
+            for task in tasks:
+                task.encode_state(True)
+            Task.objects.bulk_create(tasks, batch_size=batch_size)
+            return
+
+        # A task stored as a delta needs the primary key of its base, so tasks are
+        # inserted in waves, each after the tasks they were cloned from
+        pending = tasks
+        while pending:
+            wave = [t for t in pending if t._state_source is None or t._state_source.pk is not None]
+            pending = [t for t in pending if t._state_source is not None and t._state_source.pk is None]
+            for task in wave:
+                task.encode_state(True)
+            Task.objects.bulk_create(wave, batch_size=batch_size)
+
+
+def create_tickets(items, context, run=False, keys=None):
+    """Create a ticket for each (workflow, state) pair, with bulk inserts.
+
+    Each ticket gets a step at the initial element of its workflow and a new task there
+    holding the state. With run, the initial element then processes the new tasks in a
+    batch run. keys gives an idempotency key, or None, for each item; an item whose key
+    the user has already used gets the ticket created with it, and nothing new. Returns
+    the tickets, in the order of the items.
+    """
+    items = list(items)
+    keys = list(keys) if keys is not None else [None] * len(items)
+    if not items:
+        return []
+
+    try:
+        return _create_tickets(items, keys, context, run)
+    except IntegrityError:
+        if not any(key is not None for key in keys):
+            raise
+        # A concurrent request used some of the same keys; their tickets are found this time
+        return _create_tickets(items, keys, context, run)
+
+
+def _create_tickets(items, keys, context, run):
+    can_bulk = connection.features.can_return_rows_from_bulk_insert
+    batch_size = taskflow_setting('BULK_BATCH_SIZE')
+
+    def insert(model, objs):
+        if can_bulk:
+            model.objects.bulk_create(objs, batch_size=batch_size)
+        else:
+            for obj in objs:
+                obj.save()
+
+    initial_elements = {}
+    for workflow, state in items:
+        if workflow.pk not in initial_elements:
+            initial_elements[workflow.pk] = compiled_workflow(workflow.pk).initial
+            if initial_elements[workflow.pk] is None:
+                raise Element.DoesNotExist(f"No initial element for workflow {workflow}")
+
+    with transaction.atomic():
+        used = {key for key in keys if key is not None}
+        keyed = {}
+        if used:
+            keyed = {ticket.idempotency_key: ticket
+                     for ticket in Ticket.objects.filter(creator=context['user'],
+                                                         idempotency_key__in=used)}
+
+        tickets = []
+        new_items = []
+        for (workflow, state), key in zip(items, keys):
+            ticket = keyed.get(key) if key is not None else None
+            if ticket is None:
+                ticket = Ticket(workflow=workflow,
+                                creator=context['user'],
+                                idempotency_key=key)
+                new_items.append((ticket, state))
+                if key is not None:
+                    keyed[key] = ticket
+            tickets.append(ticket)
+
+        new_tickets = [ticket for ticket, state in new_items]
+        if not new_tickets:
+            return tickets
+
+        with advancing(new_tickets):
+            insert(Ticket, new_tickets)
+
+            steps = [Step(ticket=ticket,
+                          element=initial_elements[ticket.workflow_id])
+                     for ticket in new_tickets]
+            insert(Step, steps)
+
+            tasks = [Task(step=step,
+                          state=copy.deepcopy(state),
+                          creator=context['user'])
+                     for step, (ticket, state) in zip(steps, new_items)]
+            for task in tasks:
+                task.encode_state(True)
+            with measured(persistence_measured, Task, task=None, count=len(tasks)):
+                insert(Task, tasks)
+
+            for ticket, task in zip(new_tickets, tasks):
+                ticket.current_task = task
+                ticket.status = task.status
+            Ticket.objects.bulk_update(new_tickets, ['current_task', 'status'],
+                                       batch_size=batch_size)
+
+            if run:
+                BatchRun(context, max_steps=1).run(new_tickets)
+
+        # Announced once each, however the rows were written
+        for ticket in new_tickets:
+            if ticket.status in RUNNABLE_STATUSES:
+                send_ticket_runnable(Ticket, ticket.pk)
+
+    return tickets
+
+
+def advance_tickets(tickets, context, single_step=False, per_transaction=None,
+                    nowait=False, skip_locked=False, failures=None):
+    """Lock each ticket with SELECT ... FOR UPDATE and run its workflow.
+
+    The tickets, or their primary keys, are taken in groups of per_transaction (default
+    TASKFLOW_TICKETS_PER_TRANSACTION), each locked and advanced in a single transaction,
+    in order of primary key so that concurrent callers cannot deadlock. A ticket locked
+    by another caller is waited for, or with nowait raises DatabaseError, or with
+    skip_locked is left alone. With single_step, each ticket only takes one step.
+
+    Each ticket is advanced in a savepoint, so that a ticket that fails is rolled back
+    and logged without affecting the others in its group. If a failures list is given,
+    (ticket id, exception) is appended to it for each.
+
+    Returns the last task of each ticket, in the order given; None for a ticket that made
+    no progress, failed or was skipped.
+    """
+    ticket_ids = [ticket.pk if isinstance(ticket, Ticket) else ticket for ticket in tickets]
+    per_transaction = per_transaction or taskflow_setting('TICKETS_PER_TRANSACTION')
+
+    last_tasks = {}
+    for start in range(0, len(ticket_ids), per_transaction):
+        with transaction.atomic():
+            locked = (Ticket.objects.filter(pk__in=ticket_ids[start:start + per_transaction])
+                      .select_for_update(nowait=nowait, skip_locked=skip_locked, of=('self',))
+                      .order_by('pk'))
+            for ticket in locked:
+                try:
+                    with transaction.atomic():
+                        if single_step:
+                            last_tasks[ticket.pk] = ticket.advance_step(context)
+                        else:
+                            last_tasks[ticket.pk] = ticket.run_workflow(context)
+                except Exception as e:
+                    logger.warning("Advancing %s failed", ticket, exc_info=e)
+                    if failures is not None:
+                        failures.append((ticket.pk, e))
+    return [last_tasks.get(ticket_id) for ticket_id in ticket_ids]
@@ -0,0 +1,92 @@
+"""Structured event stream for the steps taken by the engine
+
+One event is produced for each step: the ticket, the element, the status of the
+task processed and of the new task, and the time taken. Events are logged at
+INFO level to the django_taskflow.events logger, with the event as the
+``taskflow_event`` attribute of the record for structured handlers, and are only
+built when that level is enabled.
+
+Independently of logging, a fraction TASKFLOW_TRACE_SAMPLE_RATE of tickets is
+traced: every event of a sampled ticket, with a copy of the new state, is kept
+in an in-memory ring buffer of the last TASKFLOW_TRACE_BUFFER_SIZE events.
+Sampling is by ticket id, so every process traces the same tickets.
+"""
+
+
+import copy
+import logging
+import threading
+import time
+from collections import deque
+
+from .conf import taskflow_setting
+
+
+logger = logging.getLogger('django_taskflow.events')
+
+
+class TraceBuffer:
+    """Ring buffer of the most recent events of sampled tickets"""
+
+    def __init__(self, size=None):
+        self._size = size
+        self._events = None
+        self._lock = threading.Lock()
+
+    def append(self, event):
+        with self._lock:
+            if self._events is None:
+                self._events = deque(maxlen=self._size or taskflow_setting('TRACE_BUFFER_SIZE'))
+            self._events.append(event)
+
+    def events(self, ticket_id=None):
+        """Return the buffered events, oldest first, optionally only those of one ticket"""
+        with self._lock:
+            events = list(self._events or ())
+        if ticket_id is not None:
+            events = [event for event in events if event['ticket'] == ticket_id]
+        return events
+
+    def clear(self):
+        with self._lock:
+            self._events = None
+
+
+trace_buffer = TraceBuffer()
+
+
+def sampled(ticket_id):
+    """Whether the steps of a ticket are traced"""
+    rate = taskflow_setting('TRACE_SAMPLE_RATE')
+    if not rate or ticket_id is None:
+        return False
+    # Multiplicative hash, so that consecutive ids are spread over the range
+    return (ticket_id * 2654435761) % 4294967296 < rate * 4294967296
+
+
+def start(task):
+    """Return the start time of a step on a task, or None if the step produces no event"""
+    if logger.isEnabledFor(logging.INFO) or sampled(task.step.ticket_id):
+        return time.perf_counter()
+    return None
+
+
+def step(started, task, element, status, new_task):
+    """Produce the event for a step that started at started"""
+    event = {'ticket': task.step.ticket_id,
+             'workflow': element.workflow_id,
+             'element': element.slug_name,
+             'from_status': task.Status(status).label,
+             'to_status': task.Status(new_task.status).label if new_task is not None else None,
+             'duration': time.perf_counter() - started,
+             }
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Ticket %(ticket)s at %(element)s: %(from_status)s to %(to_status)s in %(duration).6fs",
+                    event, extra={'taskflow_event': event})
+
+    if sampled(event['ticket']):
+        trace_buffer.append(dict(event,
+                                 time=time.time(),
+                                 state=copy.deepcopy(new_task.state) if new_task is not None else None))
+    return event
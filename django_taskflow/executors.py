@@ -0,0 +1,188 @@
+"""Out-of-process execution of Script operations
+
+A Script element with ``op_params['executor'] = 'process'`` runs its script in a
+process pool. Reaching the element records a ScriptRun, from whichever process
+the ticket is advanced in, and leaves the task waiting at the element. Workers
+claim the runs, submit them to their process pool, and record each result as a
+new COMPLETED (or ERROR) task when it is collected, leaving the engine free to
+advance other tickets in the meantime.
+
+A worker renews its claim on the runs it holds in its pool, and releases them
+when it stops, so the runs of a worker that stops are taken over by another
+straight away, and those of one that crashes once their claims time out.
+"""
+
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from .conf import taskflow_setting
+from .registry import operation_registry
+
+
+_pool = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def _initialise_process():
+    import django
+    django.setup()
+
+
+def run_script(script_name, element_parameters, source_data):
+    """Run a script in a pool process"""
+    func = operation_registry.resolve(script_name)
+    return func(element_parameters=element_parameters,
+                source_data=source_data)
+
+
+def pool_size():
+    return taskflow_setting('PROCESS_POOL_SIZE') or os.cpu_count() or 1
+
+
+def process_pool():
+    """Return the process pool, starting it if needed"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=pool_size(),
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_initialise_process)
+        return _pool
+
+
+def submit_script(step, script_name, op_params, state, user):
+    """Record a script to be run by a worker for the task waiting at a step"""
+
+    from .models import ScriptRun
+
+    step.ensure_saved()
+    return ScriptRun.objects.create(step=step,
+                                    script_name=script_name,
+                                    op_params=op_params,
+                                    state=state,
+                                    creator=user)
+
+
+def claim_runs():
+    """Claim script runs, up to twice the size of the pool in all, and start them in the pool.
+
+    Runs that nobody has claimed are taken first, then those whose claim has timed out.
+    The claims of the runs already in the pool are renewed. Must be called inside a
+    transaction. Returns the number of runs started.
+    """
+
+    from .models import ScriptRun
+
+    claimed = now()
+    with _lock:
+        held = list(_pending)
+    if held:
+        ScriptRun.objects.filter(pk__in=held).update(claimed=claimed)
+
+    limit = 2 * pool_size() - len(held)
+    if limit <= 0:
+        return 0
+
+    expired = claimed - timedelta(seconds=taskflow_setting('PROCESS_CLAIM_TIMEOUT'))
+    runs = list(ScriptRun.objects.filter(Q(claimed__isnull=True) | Q(claimed__lt=expired))
+                .exclude(pk__in=held)
+                .select_for_update(skip_locked=True)
+                .order_by(F('claimed').asc(nulls_first=True), 'pk')[:limit])
+    if not runs:
+        return 0
+
+    ScriptRun.objects.filter(pk__in=[run.pk for run in runs]).update(claimed=claimed)
+    for run in runs:
+        future = process_pool().submit(run_script, run.script_name, run.op_params, run.state)
+        with _lock:
+            _pending[run.pk] = future
+    return len(runs)
+
+
+def pending_count():
+    return len(_pending)
+
+
+def wait_for_results(timeout=None):
+    """Block until at least one pending script has finished, or the timeout expires"""
+    futures = list(_pending.values())
+    if futures:
+        wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+
+def collect_results():
+    """Record the result of every finished script as a new task. Returns the new tasks.
+
+    Must be called inside a transaction.
+    """
+
+    from .models import Task, Workflow, ScriptRun
+
+    with _lock:
+        done = [(run_id, future) for run_id, future in _pending.items() if future.done()]
+        for run_id, future in done:
+            del _pending[run_id]
+
+    new_tasks = []
+    for run_id, future in done:
+        # Another worker may have taken the run over and recorded its result already
+        run = ScriptRun.objects.select_for_update().select_related('creator').filter(pk=run_id).first()
+        if run is None:
+            continue
+        run.delete()
+
+        # Only progress the task if its ticket is still waiting on this step
+        waiting = Task.objects.filter(step=run.step_id,
+                                      status=Task.Status.WAITING,
+                                      ticket_current__status=Task.Status.WAITING).first()
+        if waiting is None:
+            continue
+
+        new_task = waiting.clone_task(Workflow.user_context(run.creator))
+        try:
+            new_task.state = future.result()
+            new_task.status = Task.Status.COMPLETED
+        except Exception as e:
+            new_task.state = {'state': run.state,
+                              'error': str(e)}
+            new_task.status = Task.Status.ERROR
+        new_task.save()
+        new_tasks.append(new_task)
+
+    return new_tasks
+
+
+def shutdown(wait_for_pending=True):
+    """Stop the process pool.
+
+    The results of the scripts that have finished, or with wait_for_pending of every
+    pending script, are recorded first. The claims of the runs still pending are then
+    released, so that another worker takes them over without waiting for the timeout.
+    """
+
+    from .models import ScriptRun
+
+    global _pool
+    if wait_for_pending:
+        wait(list(_pending.values()))
+    if _pending:
+        with transaction.atomic():
+            collect_results()
+            with _lock:
+                held = list(_pending)
+                _pending.clear()
+            ScriptRun.objects.filter(pk__in=held).update(claimed=None)
+
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait_for_pending, cancel_futures=not wait_for_pending)
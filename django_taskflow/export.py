@@ -0,0 +1,82 @@
+"""Export of ticket histories as newline delimited JSON
+
+Tickets are read in order of primary key through a server-side cursor, and the
+steps, tasks and operator tasks of each chunk of tickets are loaded together, so
+memory use depends on the chunk size rather than on the size of the export. Each
+ticket is written as one JSON line, and an interrupted export is resumed from the
+id of the last ticket written.
+"""
+
+
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from .archive import ticket_histories
+from .models import Ticket
+
+
+def parse_moment(value):
+    """Parse an ISO 8601 date or date and time, returning None if it is invalid"""
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is not None:
+                moment = datetime.datetime.combine(day, datetime.time())
+    except ValueError:
+        return None
+    if moment is not None and is_naive(moment):
+        moment = make_aware(moment)
+    return moment
+
+
+def export_queryset(workflow=None, status=None, since=None, until=None, after_id=0):
+    """Tickets to export, optionally of one workflow slug and status, created within [since, until)"""
+    tickets = Ticket.objects.filter(pk__gt=after_id).select_related('workflow')
+    if workflow is not None:
+        tickets = tickets.filter(workflow__slug=workflow)
+    if status is not None:
+        tickets = tickets.filter(status=status)
+    if since is not None:
+        tickets = tickets.filter(creation__gte=since)
+    if until is not None:
+        tickets = tickets.filter(creation__lt=until)
+    return tickets.order_by('pk')
+
+
+def _records(tickets):
+    histories = ticket_histories([ticket.pk for ticket in tickets])
+    for ticket in tickets:
+        yield {'id': ticket.pk,
+               'workflow': ticket.workflow.slug,
+               'creation': ticket.creation,
+               'creator': ticket.creator_id,
+               'status': ticket.status,
+               'steps': histories[ticket.pk],
+               }
+
+
+def export_tickets(chunk_size=500, **filters):
+    """Yield the history of each ticket selected by the filters, in order of id"""
+    chunk = []
+    for ticket in export_queryset(**filters).iterator(chunk_size=chunk_size):
+        chunk.append(ticket)
+        if len(chunk) >= chunk_size:
+            yield from _records(chunk)
+            chunk = []
+    if chunk:
+        yield from _records(chunk)
+
+
+def ndjson_line(record):
+    return json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def ndjson(records):
+    """Encode each record as a line of JSON"""
+    for record in records:
+        yield ndjson_line(record)
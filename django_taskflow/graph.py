@@ -0,0 +1,206 @@
+"""Compiled, in-memory representation of workflow graphs
+
+Workflow definitions change rarely but are consulted on every step of every
+ticket. Each workflow is compiled once into an immutable structure and shared
+by the engine until one of the definition models is saved or deleted.
+
+Saving or deleting a definition model discards the compiled graph in the process
+that made the change, and stamps the workflow in the database with the time of
+the change. Other processes compare the stamp of each graph they hold with the
+database at most every TASKFLOW_GRAPH_CHECK_INTERVAL seconds, so a change made
+elsewhere is picked up within that time.
+"""
+
+
+import threading
+import time
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
+
+from django.db.models.signals import post_save, post_delete
+from django.utils.timezone import now
+
+from .conf import taskflow_setting
+from .registry import operation_registry
+
+
+class CompiledWorkflow:
+    """Immutable snapshot of the elements, links and operations of a workflow"""
+
+    __slots__ = ('workflow', 'elements', 'elements_by_slug', 'initial', 'links', 'operations')
+
+    def __init__(self, workflow, elements, links, operations):
+        set_attr = super().__setattr__
+        set_attr('workflow', workflow)
+        set_attr('elements', MappingProxyType({e.pk: e for e in elements}))
+        set_attr('elements_by_slug', MappingProxyType({e.slug_name: e for e in elements}))
+
+        initial = [e for e in elements if e.is_initial]
+        set_attr('initial', initial[0] if initial else None)
+
+        outgoing = {e.pk: {} for e in elements}
+        for link in links:
+            outgoing[link.source_id][link.slug_name] = self.elements[link.target_id]
+        set_attr('links', MappingProxyType({k: MappingProxyType(v) for k, v in outgoing.items()}))
+
+        set_attr('operations', MappingProxyType(dict(operations)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def element(self, element_id):
+        """Return the element with the given primary key"""
+        return self.elements[element_id]
+
+    def links_from(self, element_id):
+        """Return a mapping of link slug_name to target element for an element"""
+        return self.links.get(element_id, MappingProxyType({}))
+
+    def operation_callable(self, element_id):
+        """Return the resolved operation callable for an element"""
+        return operation_registry.callable_for(self.operations[self.elements[element_id].operation_id])
+
+    def uses_operation(self, operation_id):
+        return operation_id in self.operations
+
+    @classmethod
+    def compile(cls, workflow_id):
+        """Load a workflow definition from the database and compile it"""
+
+        from .models import Workflow, Element, Link
+
+        workflow = Workflow.objects.get(pk=workflow_id)
+        elements = list(Element.objects.filter(workflow=workflow).select_related('operation').order_by('pk'))
+
+        operations = {}
+        for element in elements:
+            element.workflow = workflow
+            if element.operation_id not in operations:
+                # Resolve now so that a bad operation fails on compilation rather than mid-ticket
+                operation_registry.callable_for(element.operation.function)
+                operations[element.operation_id] = element.operation.function
+
+        links = list(Link.objects.filter(source__workflow=workflow).order_by('pk'))
+
+        return cls(workflow, elements, links, operations)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+# Incremented by every invalidation, so that a compilation that overlapped one is not kept
+_generation = 0
+
+
+def _fresh(entry):
+    """Whether a cache entry was checked against the database recently enough to use as it is"""
+    return entry is not None and time.monotonic() - entry[1] < taskflow_setting('GRAPH_CHECK_INTERVAL')
+
+
+def compiled_workflow(workflow_id):
+    """Get the compiled graph for a workflow, compiling it if needed"""
+    entry = _cache.get(workflow_id)
+    if _fresh(entry):
+        return entry[0]
+
+    from .models import Workflow
+
+    if entry is not None:
+        updated = Workflow.objects.filter(pk=workflow_id).values_list('updated', flat=True).first()
+        if updated == entry[0].workflow.updated:
+            with _cache_lock:
+                if _cache.get(workflow_id) is entry:
+                    _cache[workflow_id] = (entry[0], time.monotonic())
+            return entry[0]
+
+    while True:
+        generation = _generation
+        checked = time.monotonic()
+        graph = CompiledWorkflow.compile(workflow_id)
+        with _cache_lock:
+            if generation == _generation:
+                _cache[workflow_id] = (graph, checked)
+                return graph
+
+
+def cached_workflow(workflow_id):
+    """Get the compiled graph for a workflow as last checked, compiling it only if there is none.
+
+    For labels and other uses that can tolerate a slightly stale graph, and that may run
+    within an event loop once the graph has been compiled.
+    """
+    entry = _cache.get(workflow_id)
+    if entry is not None:
+        return entry[0]
+    return compiled_workflow(workflow_id)
+
+
+async def acompiled_workflow(workflow_id):
+    """Get the compiled graph for a workflow from within an event loop"""
+    entry = _cache.get(workflow_id)
+    if _fresh(entry):
+        return entry[0]
+    return await sync_to_async(compiled_workflow, thread_sensitive=True)(workflow_id)
+
+
+def invalidate(workflow_id=None):
+    """Discard the compiled graph for a workflow, or for all workflows if none is given"""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        if workflow_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(workflow_id, None)
+
+
+def _invalidate_matching(predicate):
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        for workflow_id in [k for k, (graph, checked) in _cache.items() if predicate(graph)]:
+            del _cache[workflow_id]
+
+
+def _changed(workflows):
+    """Stamp the workflows in a queryset as changed, for other processes to notice"""
+    workflows.update(updated=now())
+
+
+def _workflow_changed(sender, instance, **kwargs):
+    invalidate(instance.pk)
+    _changed(sender.objects.filter(pk=instance.pk))
+
+
+def _element_changed(sender, instance, **kwargs):
+    from .models import Workflow
+    invalidate(instance.workflow_id)
+    _invalidate_matching(lambda g: instance.pk in g.elements)
+    _changed(Workflow.objects.filter(pk=instance.workflow_id))
+
+
+def _link_changed(sender, instance, **kwargs):
+    from .models import Workflow
+    _invalidate_matching(lambda g: instance.source_id in g.elements or instance.target_id in g.elements)
+    _changed(Workflow.objects.filter(element__in=[instance.source_id, instance.target_id]))
+
+
+def _operation_changed(sender, instance, **kwargs):
+    from .models import Workflow
+    _invalidate_matching(lambda g: g.uses_operation(instance.pk))
+    _changed(Workflow.objects.filter(element__operation=instance.pk))
+
+
+def connect_signals():
+    """Invalidate compiled graphs whenever a workflow definition changes"""
+    for model_name, handler in [('Workflow', _workflow_changed),
+                                ('Element', _element_changed),
+                                ('Link', _link_changed),
+                                ('Operation', _operation_changed),
+                                ]:
+        sender = f"django_taskflow.{model_name}"
+        post_save.connect(handler, sender=sender, dispatch_uid=f"taskflow_graph_save_{model_name}")
+        post_delete.connect(handler, sender=sender, dispatch_uid=f"taskflow_graph_delete_{model_name}")
@@ -0,0 +1,82 @@
+"""Measurement of the work done by the engine
+
+The parts of each step are timed, along with the database queries they run, and
+the measurements are sent with the signals in django_taskflow.signals. Nothing
+is measured unless a receiver is connected to the signal.
+"""
+
+
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class QueryTimer:
+    """Execute wrapper counting and timing the queries run on a connection"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+@contextmanager
+def measured(signal, sender, queries=True, **kwargs):
+    """Time a block of code and send the result with a signal.
+
+    Yields the dictionary of arguments for the signal, so that the block can add to them.
+    With queries False, as in code run on an event loop whose queries are run by another
+    thread, query counts are not collected.
+    """
+    if not signal.has_listeners(sender):
+        yield kwargs
+        return
+
+    timer = QueryTimer()
+    start = time.perf_counter()
+    if queries:
+        with connection.execute_wrapper(timer):
+            yield kwargs
+    else:
+        yield kwargs
+    signal.send(sender=sender,
+                seconds=time.perf_counter() - start,
+                queries=timer.count if queries else None,
+                query_seconds=timer.seconds if queries else None,
+                **kwargs)
+
+
+@contextmanager
+def measured_each(signal, sender, measurements, queries=True):
+    """As measured, for a block doing the work of several measurements at once.
+
+    measurements is a list of dictionaries of arguments, which the block can add to. The
+    signal is sent for each of them, with an equal share of the time and queries.
+    """
+    if not measurements or not signal.has_listeners(sender):
+        yield measurements
+        return
+
+    timer = QueryTimer()
+    start = time.perf_counter()
+    if queries:
+        with connection.execute_wrapper(timer):
+            yield measurements
+    else:
+        yield measurements
+    share = len(measurements)
+    seconds = (time.perf_counter() - start) / share
+    for kwargs in measurements:
+        signal.send(sender=sender,
+                    seconds=seconds,
+                    queries=timer.count / share if queries else None,
+                    query_seconds=timer.seconds / share if queries else None,
+                    **kwargs)
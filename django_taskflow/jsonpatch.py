@@ -0,0 +1,71 @@
+"""Minimal JSON patch (RFC 6902) support for task state deltas
+
+Only the add, remove and replace operations are generated or applied. Objects
+are compared key by key; lists and scalars that differ are replaced whole.
+"""
+
+
+import copy
+
+
+def _escape(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def make_patch(source, target, path=''):
+    """Return a list of operations that transform source into target"""
+    if isinstance(source, dict) and isinstance(target, dict):
+        ops = []
+        for key in source:
+            if key not in target:
+                ops.append({'op': 'remove', 'path': f"{path}/{_escape(key)}"})
+        for key, value in target.items():
+            key_path = f"{path}/{_escape(key)}"
+            if key not in source:
+                ops.append({'op': 'add', 'path': key_path, 'value': value})
+            else:
+                ops.extend(make_patch(source[key], value, key_path))
+        return ops
+
+    if source == target and type(source) == type(target):
+        return []
+
+    return [{'op': 'replace', 'path': path, 'value': target}]
+
+
+def apply_patch(document, patch):
+    """Return a copy of document with the patch operations applied"""
+    document = copy.deepcopy(document)
+    for op in patch:
+        tokens = [_unescape(t) for t in op['path'].split('/')[1:]]
+        value = copy.deepcopy(op.get('value'))
+
+        if not tokens:
+            if op['op'] == 'remove':
+                raise ValueError("Cannot remove the whole document")
+            document = value
+            continue
+
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token) if isinstance(parent, list) else token]
+
+        last = tokens[-1]
+        if isinstance(parent, list):
+            last = len(parent) if last == '-' else int(last)
+            if op['op'] == 'add':
+                parent.insert(last, value)
+            elif op['op'] == 'remove':
+                del parent[last]
+            else:
+                parent[last] = value
+        else:
+            if op['op'] == 'remove':
+                del parent[last]
+            else:
+                parent[last] = value
+    return document
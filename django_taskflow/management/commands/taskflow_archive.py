@@ -0,0 +1,61 @@
+"""Archive or delete the history of finished tickets"""
+
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from django_taskflow.archive import archivable_tickets, archive_tickets
+
+
+class Command(BaseCommand):
+    help = "Move tickets finished or terminated before a cutoff, with their steps and tasks, into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, required=True,
+                            help="Only tickets whose last task is at least this many days old")
+        parser.add_argument('--delete', action='store_true',
+                            help="Delete the tickets without archiving them")
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help="Number of tickets removed in each transaction")
+        parser.add_argument('--after-id', type=int, default=0,
+                            help="Resume after this ticket id, as reported by an earlier run")
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help="Stop after this many chunks")
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Seconds to pause between chunks")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        cutoff = now() - timedelta(days=options['older_than'])
+        remaining = archivable_tickets(cutoff).filter(pk__gt=options['after_id']).count()
+        action = "Deleted" if options['delete'] else "Archived"
+        self.stdout.write(f"{remaining} tickets finished before {cutoff.isoformat()}")
+
+        total = 0
+        skipped = []
+        chunks = archive_tickets(cutoff,
+                                 after_id=options['after_id'],
+                                 chunk_size=options['chunk_size'],
+                                 delete_only=options['delete'],
+                                 skipped=skipped)
+        for count, ticket_ids in enumerate(chunks, 1):
+            total += len(ticket_ids)
+            self.stdout.write(f"{action} {total}/{remaining} tickets, up to id {ticket_ids[-1]}")
+            if options['max_chunks'] is not None and count >= options['max_chunks']:
+                # Resume before the first skipped ticket, so that it is not left behind
+                resume = min(skipped) - 1 if skipped else ticket_ids[-1]
+                self.stdout.write(f"Stopped after {count} chunks; resume with --after-id {resume}")
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(f"{action} {total} tickets")
+        if skipped:
+            ids = ", ".join(str(ticket_id) for ticket_id in skipped)
+            self.stderr.write(f"Skipped {len(skipped)} tickets locked by other transactions: {ids}; "
+                              "run the command again to remove them")
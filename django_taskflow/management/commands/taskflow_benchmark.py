@@ -0,0 +1,66 @@
+"""Measure the throughput and latency of the workflow engine"""
+
+
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from django_taskflow.benchmark import SCENARIOS, ENGINES, METRICS, run_benchmarks, compare_results
+
+
+class Command(BaseCommand):
+    help = "Run benchmark scenarios against the configured database, optionally failing on regressions against a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), dest='scenarios',
+                            help="Scenario to run; may be repeated. Defaults to all of them")
+        parser.add_argument('--engine', action='append', choices=ENGINES, dest='engines',
+                            help="Engine to run each scenario with; may be repeated. Defaults to all of them")
+        parser.add_argument('--tickets', type=int, default=100,
+                            help="Number of tickets run in each scenario")
+        parser.add_argument('--output', default=None,
+                            help="File to write the results to, as JSON")
+        parser.add_argument('--baseline', default=None,
+                            help="JSON results of an earlier run to compare against")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Fraction by which a metric may be worse than the baseline")
+        parser.add_argument('--user', default=None,
+                            help="Username recorded as creator of the tickets; defaults to a benchmark user")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        created_user = False
+        if options['user']:
+            try:
+                user = User.objects.get_by_natural_key(options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']}")
+        else:
+            user, created_user = User.objects.get_or_create(**{User.USERNAME_FIELD: 'taskflow-benchmark'})
+
+        try:
+            results = run_benchmarks(user,
+                                     scenarios=options['scenarios'],
+                                     engines=options['engines'] or ENGINES,
+                                     count=options['tickets'])
+        finally:
+            if created_user:
+                user.delete()
+
+        for scenario, measured in results['scenarios'].items():
+            values = ", ".join(f"{metric} {measured[metric]:.2f}" for metric in METRICS if measured[metric] is not None)
+            self.stdout.write(f"{scenario}: {measured['steps']} steps, {values}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare_results(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(f"Regression: {regression}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} metrics regressed by more than {options['threshold']:.0%}")
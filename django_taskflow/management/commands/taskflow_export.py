@@ -0,0 +1,59 @@
+"""Export the history of tickets as newline delimited JSON"""
+
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_taskflow.export import parse_moment, export_tickets, ndjson_line
+
+
+class Command(BaseCommand):
+    help = "Write the history of each ticket, with its steps and tasks, as a line of JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help="File to append to, rather than standard output")
+        parser.add_argument('--workflow', default=None,
+                            help="Only tickets of the workflow with this slug")
+        parser.add_argument('--status', type=int, default=None,
+                            help="Only tickets with this status")
+        parser.add_argument('--since', default=None,
+                            help="Only tickets created at or after this ISO 8601 date or time")
+        parser.add_argument('--until', default=None,
+                            help="Only tickets created before this ISO 8601 date or time")
+        parser.add_argument('--after-id', type=int, default=0,
+                            help="Resume after this ticket id, as reported by an earlier run")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of tickets read at a time")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        filters = {'workflow': options['workflow'],
+                   'status': options['status'],
+                   'after_id': options['after_id'],
+                   }
+        for name in ('since', 'until'):
+            if options[name] is not None:
+                filters[name] = parse_moment(options[name])
+                if filters[name] is None:
+                    raise CommandError(f"Invalid --{name} {options[name]}")
+
+        if options['output']:
+            output = open(options['output'], 'a')
+            write = output.write
+        else:
+            output = None
+            write = lambda line: self.stdout.write(line, ending='')
+
+        count = 0
+        last_id = options['after_id']
+        try:
+            for record in export_tickets(chunk_size=options['chunk_size'], **filters):
+                write(ndjson_line(record))
+                count += 1
+                last_id = record['id']
+        finally:
+            if output is not None:
+                output.close()
+            self.stderr.write(f"Exported {count} tickets, up to id {last_id}")
@@ -0,0 +1,81 @@
+"""Simulate tickets through a workflow in memory, to find its bottlenecks"""
+
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_taskflow.models import Workflow
+from django_taskflow.simulation import Simulation, SimWorkflow, exponential
+
+
+def _assignments(values, parse):
+    """Parse repeated element=value options; an element of '*' applies to all others"""
+    assigned = {}
+    for value in values or []:
+        element, sep, setting = value.partition('=')
+        if not sep:
+            raise CommandError(f"Expected element=value, not {value}")
+        try:
+            assigned[element] = parse(setting)
+        except ValueError:
+            raise CommandError(f"Invalid value {setting} for {element}")
+    return assigned
+
+
+def _duration(value):
+    """A number of seconds, or exp:<mean> for exponentially distributed durations"""
+    if value.startswith('exp:'):
+        return exponential(float(value[4:]))
+    return float(value)
+
+
+class Command(BaseCommand):
+    help = "Run synthetic tickets through a workflow without the database, reporting throughput and bottlenecks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('workflow',
+                            help="Slug of the workflow to simulate")
+        parser.add_argument('--tickets', type=int, default=10000,
+                            help="Number of tickets")
+        parser.add_argument('--arrival-rate', type=float, default=None,
+                            help="Tickets arriving per second, at random; by default all arrive at once")
+        parser.add_argument('--latency', action='append', metavar='ELEMENT=SECONDS',
+                            help="Time taken by each step at an element, or exp:<mean>; may be repeated")
+        parser.add_argument('--external-latency', action='append', metavar='ELEMENT=SECONDS',
+                            help="Time before an external task at an element is resolved, or exp:<mean>")
+        parser.add_argument('--capacity', action='append', metavar='ELEMENT=N',
+                            help="Number of tasks an element serves at once; unlimited by default")
+        parser.add_argument('--seed', type=int, default=None,
+                            help="Seed for the random durations")
+        parser.add_argument('--output', default=None,
+                            help="File to write the report to, as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            workflow = SimWorkflow.load(options['workflow'])
+        except Workflow.DoesNotExist:
+            raise CommandError(f"Unknown workflow {options['workflow']}")
+
+        simulation = Simulation(workflow,
+                                latency=_assignments(options['latency'], _duration),
+                                external_latency=_assignments(options['external_latency'], _duration),
+                                capacity=_assignments(options['capacity'], int),
+                                seed=options['seed'])
+        report = simulation.run(options['tickets'], options['arrival_rate'])
+
+        throughput = report['throughput']
+        self.stdout.write(f"{report['tickets']} tickets in {report['duration']:.2f}s: "
+                          f"{report['finished']} finished, {report['terminated']} terminated, "
+                          f"{report['stalled']} stalled"
+                          + (f", {throughput:.2f} tickets/s" if throughput is not None else ""))
+        for slug in report['bottlenecks']:
+            measured = report['elements'][slug]
+            utilisation = measured['utilisation']
+            self.stdout.write(f"{slug}: occupancy {measured['mean_occupancy']:.2f}, "
+                              f"mean wait {measured['mean_wait']:.3f}s, max queue {measured['max_queue']}"
+                              + (f", utilisation {utilisation:.0%}" if utilisation is not None else ""))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
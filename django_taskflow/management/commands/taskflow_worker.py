@@ -0,0 +1,84 @@
+"""Run workers that advance runnable tickets"""
+
+
+import multiprocessing
+import signal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from django_taskflow.notify import notification_backend
+from django_taskflow.worker import TicketWorker, AsyncTicketWorker
+
+
+class Command(BaseCommand):
+    help = "Advance runnable tickets, claiming them with SELECT ... FOR UPDATE SKIP LOCKED"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Number of tickets claimed per transaction")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait for a notification when there are no runnable tickets, before polling again")
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Number of worker processes to run on this host")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Exit after this many batches in each process")
+        parser.add_argument('--once', action='store_true',
+                            help="Process a single batch and exit")
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help="Advance the tickets of each batch concurrently on an event loop")
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help="Maximum number of tickets in flight at once with --async")
+        parser.add_argument('--user', default=None,
+                            help="Username recorded as creator of new tasks; defaults to each ticket's creator")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get_by_natural_key(options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']}")
+
+        max_batches = 1 if options['once'] else options['max_batches']
+        worker_args = (options['batch_size'], options['poll_interval'], user, max_batches,
+                       options['concurrency'] if options['use_async'] else None)
+
+        if options['processes'] <= 1:
+            self.run_worker(*worker_args)
+            return
+
+        # Each process needs its own database connection
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        procs = [ctx.Process(target=self.run_worker, args=worker_args)
+                 for _ in range(options['processes'])]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+    def run_worker(self, batch_size, poll_interval, user, max_batches, concurrency):
+        if concurrency is None:
+            worker = TicketWorker(batch_size=batch_size,
+                                  poll_interval=poll_interval,
+                                  user=user,
+                                  notifications=notification_backend())
+        else:
+            worker = AsyncTicketWorker(concurrency=concurrency,
+                                       batch_size=batch_size,
+                                       poll_interval=poll_interval,
+                                       user=user,
+                                       notifications=notification_backend())
+        previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            worker.run(max_batches=max_batches)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+        for ticket_id, error in worker.failures:
+            self.stderr.write(f"Ticket {ticket_id} failed: {error}")
+        self.stdout.write(f"Processed {worker.processed} tickets")
@@ -0,0 +1,180 @@
+"""Memoisation of the results of pure operations
+
+An operation is pure when its result depends only on the parameters of the
+element and the status and state of the incoming task. Script elements opt in
+with ``op_params['memoise'] = True``, and other operations by setting ``pure``
+on the class. The result of a pure operation is then kept under a hash of the
+operation, the element parameters and the incoming status and state, and a later
+task arriving with the same ones gets a copy of that result without the operation
+being run.
+
+Results are kept in an in-process LRU cache of TASKFLOW_MEMO_SIZE entries, each
+expiring after TASKFLOW_MEMO_TTL seconds, and optionally in the Django cache named
+by TASKFLOW_MEMO_CACHE, which is shared by every process; a DatabaseCache keeps
+them in a table. Lookups are counted by element and result.
+"""
+
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .conf import taskflow_setting
+from .graph import cached_workflow
+from .metrics import Counter
+
+
+MISSING = object()
+
+
+def stable_key(*parts):
+    """Hash of JSON serialisable parts that does not depend on the order of dictionary keys"""
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class LRUCache:
+    """Mapping holding at most maxsize entries, each for at most ttl seconds"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    """Local and optionally shared store of operation results, counting lookups"""
+
+    def __init__(self, maxsize=None, ttl=None, shared=None):
+        self.ttl = ttl if ttl is not None else taskflow_setting('MEMO_TTL')
+        self.local = LRUCache(maxsize or taskflow_setting('MEMO_SIZE'), self.ttl)
+        alias = shared if shared is not None else taskflow_setting('MEMO_CACHE')
+        self.shared = caches[alias] if alias else None
+        self.lookups = Counter('taskflow_memo_lookups_total',
+                               "Lookups of memoised operation results",
+                               ('workflow', 'element', 'result'))
+        self._lock = threading.Lock()
+
+    def get(self, key, element):
+        """Return the result stored under key, or MISSING"""
+        value = self.local.get(key)
+        result = 'hit'
+        if value is MISSING and self.shared is not None:
+            value = self.shared.get(f"taskflow-memo:{key}", MISSING)
+            if value is not MISSING:
+                result = 'shared_hit'
+                self.local.set(key, value)
+        self.count(element, result if value is not MISSING else 'miss')
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(f"taskflow-memo:{key}", value, self.ttl)
+
+    def count(self, element, result):
+        labels = {'workflow': cached_workflow(element.workflow_id).workflow.slug,
+                  'element': element.slug_name,
+                  'result': result,
+                  }
+        with self._lock:
+            self.lookups.inc(labels)
+
+    def stats(self):
+        """Total lookups by result"""
+        totals = {'hit': 0, 'shared_hit': 0, 'miss': 0}
+        with self._lock:
+            for (workflow, element, result), value in self.lookups.series.items():
+                totals[result] += value
+        return totals
+
+    def render(self):
+        with self._lock:
+            return self.lookups.render()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def result_cache():
+    """Return the process-wide result cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
+
+
+def reset():
+    """Discard the process-wide result cache, for example after changing its settings"""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def result_key(operation, element, incoming_task):
+    return stable_key(f"{operation.__class__.__module__}.{operation.__class__.__qualname__}",
+                      element.op_params,
+                      int(incoming_task.status),
+                      incoming_task.state)
+
+
+def remember(incoming_task, element, result):
+    """The part of an operation's result that can be replayed, or MISSING if it cannot be.
+
+    Results that move the task to another element are not kept, as they depend on the
+    links of the element rather than only its parameters.
+    """
+    if result is None:
+        return None
+    if result.step is not incoming_task.step:
+        return MISSING
+    return {'in_place': result is incoming_task,
+            'status': int(result.status),
+            'state': copy.deepcopy(result.state),
+            }
+
+
+def replay(incoming_task, value, context):
+    """Recreate the result of an operation from what was remembered"""
+    if value is None:
+        return None
+    task = incoming_task if value['in_place'] else incoming_task.clone_task(context)
+    task.status = task.Status(value['status'])
+    task.state = copy.deepcopy(value['state'])
+    return task
@@ -0,0 +1,224 @@
+"""Collection and exposition of engine metrics
+
+A collector receives the measurements sent by the engine through the signals in
+django_taskflow.signals. The collector named by TASKFLOW_METRICS_COLLECTOR is
+connected at startup. PrometheusCollector keeps histograms and counters in
+memory and renders them in the Prometheus text format, for the metrics view.
+
+Measurements are held by the process that made them, so each web and worker
+process has to be scraped, or a collector that forwards them elsewhere used.
+"""
+
+
+import json
+import math
+import threading
+
+from django.utils.module_loading import import_string
+
+from .conf import taskflow_setting
+from .graph import cached_workflow
+from .signals import operation_measured, persistence_measured, link_measured
+
+
+class MetricsCollector:
+    """Base class for collectors, receiving each kind of measurement"""
+
+    def connect(self):
+        operation_measured.connect(self.receive_operation, dispatch_uid="taskflow_metrics_operation")
+        persistence_measured.connect(self.receive_persistence, dispatch_uid="taskflow_metrics_persistence")
+        link_measured.connect(self.receive_link, dispatch_uid="taskflow_metrics_link")
+
+    def disconnect(self):
+        operation_measured.disconnect(dispatch_uid="taskflow_metrics_operation")
+        persistence_measured.disconnect(dispatch_uid="taskflow_metrics_persistence")
+        link_measured.disconnect(dispatch_uid="taskflow_metrics_link")
+
+    def receive_operation(self, sender, element, task, status, new_task, seconds, queries, query_seconds, **kwargs):
+        pass
+
+    def receive_persistence(self, sender, task, count, seconds, queries, query_seconds, **kwargs):
+        pass
+
+    def receive_link(self, sender, element, slug_name, seconds, queries, query_seconds, **kwargs):
+        pass
+
+
+def element_labels(element):
+    """Workflow, element and operation labels for an element"""
+    graph = cached_workflow(element.workflow_id)
+    return {'workflow': graph.workflow.slug,
+            'element': element.slug_name,
+            'operation': graph.operations.get(element.operation_id, ''),
+            }
+
+
+def state_size(task):
+    """Size of the state of a task, as JSON"""
+    try:
+        return len(json.dumps(task.state))
+    except (TypeError, ValueError):
+        return None
+
+
+class Histogram:
+    """Cumulative histogram of observations for each set of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        key = tuple(labels[name] for name in self.label_names)
+        counts = self.series.get(key)
+        if counts is None:
+            counts = self.series[key] = [[0] * len(self.buckets), 0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[0][i] += 1
+        counts[1] += 1
+        counts[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} histogram"]
+        for key, (buckets, count, total) in sorted(self.series.items()):
+            labels = _labels(zip(self.label_names, key))
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(f"{self.name}_bucket{{{labels}{',' if labels else ''}le=\"{_number(bound)}\"}} {bucket_count}")
+            lines.append(f"{self.name}_bucket{{{labels}{',' if labels else ''}le=\"+Inf\"}} {count}")
+            lines.append(f"{self.name}_sum{{{labels}}} {_number(total)}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    """Count of events for each set of label values"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        key = tuple(labels[name] for name in self.label_names)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_labels(zip(self.label_names, key))}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+def _number(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+ELEMENT_LABELS = ('workflow', 'element', 'operation')
+
+
+class PrometheusCollector(MetricsCollector):
+    """In-memory histograms and counters, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operation_seconds = Histogram('taskflow_operation_seconds',
+                                           "Time taken by an element to process a task",
+                                           ELEMENT_LABELS, SECONDS_BUCKETS)
+        self.operation_queries = Histogram('taskflow_operation_queries',
+                                           "Database queries run by an element to process a task",
+                                           ELEMENT_LABELS, QUERY_BUCKETS)
+        self.operation_query_seconds = Histogram('taskflow_operation_query_seconds',
+                                                 "Time spent in database queries by an element processing a task",
+                                                 ELEMENT_LABELS, SECONDS_BUCKETS)
+        self.state_bytes = Histogram('taskflow_state_bytes',
+                                     "Size of the state of each new task, as JSON",
+                                     ELEMENT_LABELS, BYTES_BUCKETS)
+        self.transitions = Counter('taskflow_transitions_total',
+                                   "Tasks produced, by status of the task processed and of the new task",
+                                   ('workflow', 'from_status', 'to_status'))
+        self.persistence_seconds = Histogram('taskflow_persistence_seconds',
+                                             "Time taken to write tasks, singly or in bulk",
+                                             ('mode',), SECONDS_BUCKETS)
+        self.persisted = Counter('taskflow_persisted_tasks_total',
+                                 "Tasks written, singly or in bulk",
+                                 ('mode',))
+        self.link_seconds = Histogram('taskflow_link_seconds',
+                                      "Time taken to follow a link to the next element",
+                                      ELEMENT_LABELS + ('link',), SECONDS_BUCKETS)
+
+    def receive_operation(self, sender, element, task, status, new_task, seconds, queries, query_seconds, **kwargs):
+        labels = element_labels(element)
+        size = state_size(new_task) if new_task is not None else None
+        with self._lock:
+            self.operation_seconds.observe(labels, seconds)
+            if queries is not None:
+                self.operation_queries.observe(labels, queries)
+                self.operation_query_seconds.observe(labels, query_seconds)
+            if new_task is not None:
+                if size is not None:
+                    self.state_bytes.observe(labels, size)
+                self.transitions.inc({'workflow': labels['workflow'],
+                                      'from_status': task.Status(status).label,
+                                      'to_status': task.Status(new_task.status).label})
+
+    def receive_persistence(self, sender, task, count, seconds, queries, query_seconds, **kwargs):
+        labels = {'mode': 'single' if task is not None else 'bulk'}
+        with self._lock:
+            self.persistence_seconds.observe(labels, seconds)
+            self.persisted.inc(labels, count)
+
+    def receive_link(self, sender, element, slug_name, seconds, queries, query_seconds, **kwargs):
+        labels = dict(element_labels(element), link=slug_name)
+        with self._lock:
+            self.link_seconds.observe(labels, seconds)
+
+    def metrics(self):
+        return [self.operation_seconds, self.operation_queries, self.operation_query_seconds,
+                self.state_bytes, self.transitions,
+                self.persistence_seconds, self.persisted,
+                self.link_seconds]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        from . import memo
+        with self._lock:
+            lines = [line for metric in self.metrics() for line in metric.render()]
+        lines.extend(memo.result_cache().render())
+        return "\n".join(lines) + "\n"
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def metrics_collector():
+    """Return the configured metrics collector, or None if there is none"""
+    global _collector
+    path = taskflow_setting('METRICS_COLLECTOR')
+    if not path:
+        return None
+    with _collector_lock:
+        if _collector is None:
+            _collector = import_string(path)()
+        return _collector
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_current_tasks(apps, schema_editor):
+    Ticket = apps.get_model('django_taskflow', 'Ticket')
+    Task = apps.get_model('django_taskflow', 'Task')
+    for ticket in Ticket.objects.all():
+        task = Task.objects.filter(step__ticket=ticket).order_by('-creation', '-pk').first()
+        if task is not None:
+            ticket.current_task = task
+            ticket.status = task.status
+            ticket.save(update_fields=['current_task', 'status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_taskflow', '0002_add_operations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='current_task',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ticket_current', to='django_taskflow.task'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='status',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(0, 'New'), (1, 'Waiting'), (2, 'Updated'), (3, 'Completed'), (4, 'Error'), (5, 'Finished'), (6, 'Terminated')], null=True),
+        ),
+        migrations.RunPython(set_current_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:13
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django_taskflow.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_taskflow', '0003_ticket_current_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='state_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='django_taskflow.task'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='state_depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='state_patch',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='state',
+            field=django_taskflow.models.StateField(null=True),
+        ),
+    ]
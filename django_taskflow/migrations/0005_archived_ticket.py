@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:16
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('django_taskflow', '0004_task_state_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTicket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_id', models.IntegerField(unique=True)),
+                ('creation', models.DateTimeField()),
+                ('finished', models.DateTimeField()),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'New'), (1, 'Waiting'), (2, 'Updated'), (3, 'Completed'), (4, 'Error'), (5, 'Finished'), (6, 'Terminated')])),
+                ('history', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('creator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('workflow', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='django_taskflow.workflow')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_taskflow', '0005_archived_ticket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operatortask',
+            index=models.Index(condition=models.Q(completed__isnull=True), fields=['operator', 'created'], name='taskflow_optask_open'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', '-creation'], name='taskflow_task_status'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', 'current_task'], name='taskflow_ticket_status'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_taskflow', '0006_engine_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operatortask',
+            index=models.Index(fields=['-created', '-id'], name='taskflow_optask_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['-creation', '-id'], name='taskflow_task_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['-creation', '-id'], name='taskflow_ticket_recent'),
+        ),
+    ]
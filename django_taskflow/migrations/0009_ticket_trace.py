@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:34
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_taskflow', '0008_ticket_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketTrace',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation', models.DateTimeField(auto_now_add=True)),
+                ('steps', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='django_taskflow.ticket')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_taskflow', '0009_ticket_trace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflow',
+            name='updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-17 10:59
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('django_taskflow', '0010_workflow_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('script_name', models.CharField(max_length=255)),
+                ('op_params', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('state', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('claimed', models.DateTimeField(blank=True, null=True)),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('step', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='django_taskflow.step')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='scriptrun',
+            index=models.Index(fields=['claimed', 'id'], name='taskflow_scriptrun_claim'),
+        ),
+    ]
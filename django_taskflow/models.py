@@ -1,21 +1,33 @@
-import importlib
+import copy
+import logging
 
-import datetime
+from asgiref.sync import sync_to_async
 
-from django.db import models
-from django.db.models import Q, F, OuterRef, Max, Subquery
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.query_utils import DeferredAttribute
 
 from django.conf import settings
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.utils.text import slugify
 from django.utils.timezone import now
 from django.contrib.postgres.fields import JSONField
 
+from . import events
 from .app_name import app_name
+from .conf import taskflow_setting
+from .graph import compiled_workflow, acompiled_workflow
+from .instrumentation import measured, measured_each
+from .jsonpatch import make_patch, apply_patch
+from .registry import operation_registry
+from .signals import send_ticket_runnable, operation_measured, persistence_measured
 
 User = settings.AUTH_USER_MODEL
 
+logger = logging.getLogger(__name__)
+
 class NameSlugBase(models.Model):
     name = models.CharField(max_length=100, unique=False, blank=False, null=False)
     slug = models.SlugField(max_length=100, unique=True, blank=True, null=False)
@@ -43,21 +55,17 @@ class Operation(NameSlugBase):
 
     @staticmethod
     def load_object_by_name(name):
-        name_parts = name.split('.')
-        mod_name = ".".join(name_parts[:-1])
-        module = importlib.import_module(mod_name)
-        return getattr(module, name_parts[-1])
+        return operation_registry.resolve(name)
 
     def function_as_callable(self):
         """Get the task processing function for this operation"""
+        return operation_registry.callable_for(self.function)
 
-        func = Operation.load_object_by_name(self.function)
+    def clean(self):
         try:
-            # If a class, then instantiate it
-            func = func()
-        except:
-            pass
-        return func
+            operation_registry.resolve(self.function)
+        except Exception as e:
+            raise ValidationError({'function': f"Cannot resolve operation function: {e}"})
 
 
 class OperationAdmin(admin.ModelAdmin):
@@ -67,6 +75,10 @@ class OperationAdmin(admin.ModelAdmin):
 class Workflow(NameSlugBase):
     description = models.TextField()
 
+    # Time of the last change to the workflow or its elements, links or operations, set by
+    # graph.connect_signals, so that processes holding a compiled graph notice the change
+    updated = models.DateTimeField(null=True, blank=True, editable=False)
+
     def get_absolute_url(self):
         return reverse(f"{app_name}:workflow", kwargs={'slug': self.slug})
 
@@ -85,16 +97,42 @@ class Workflow(NameSlugBase):
         """Form a context from the curent request."""
         context = {'user': request.user,
                    }
+        if request.headers.get('Idempotency-Key'):
+            context['idempotency_key'] = request.headers['Idempotency-Key']
         return context
 
     def create_ticket(self, context):
+        """Create a ticket on this workflow.
+
+        If the context holds an 'idempotency_key' already used by the same user, the
+        ticket created with it is returned instead, and nothing is run.
+        """
+        key = context.get('idempotency_key')
+        if key is not None:
+            existing = Ticket.objects.filter(creator=context['user'],
+                                             idempotency_key=key).first()
+            if existing is not None:
+                return existing
+
         t = Ticket(workflow=self,
-                   creator=context['user'])
-        t.save()
+                   creator=context['user'],
+                   idempotency_key=key)
+        try:
+            with transaction.atomic():
+                t.save()
+        except IntegrityError:
+            if key is None:
+                raise
+            # A concurrent request with the same key got there first
+            return Ticket.objects.get(creator=context['user'],
+                                      idempotency_key=key)
 
         if 'initial_arguments' in context:
             # Perform init step on the ticket
             t.run_workflow_step(context)
+
+        # Workers only advance the ticket, so it can be announced before it has a task
+        send_ticket_runnable(self.__class__, t.pk)
         return t
 
 
@@ -122,6 +160,14 @@ class Element(models.Model):
     def __str__(self):
         return f"{self.workflow}:{self.slug_name}"
 
+    def clean(self):
+        script_name = (self.op_params or {}).get('script_name')
+        if script_name is not None:
+            try:
+                operation_registry.resolve(script_name)
+            except Exception as e:
+                raise ValidationError({'op_params': f"Cannot resolve script_name: {e}"})
+
     class Meta:
         constraints = [models.UniqueConstraint(fields=['workflow', 'slug_name'], name="uniqueness_workflow_slug"),
                        models.UniqueConstraint(fields=['workflow'], condition=Q(is_initial=True), name="unique_initial_element"),
@@ -141,21 +187,103 @@ class Element(models.Model):
         if task.status == task.Status.FINISHED or task.status== task.Status.TERMINATED:
             return None
 
-        func = self.operation.function_as_callable()
-        try:
-            new_task = func(incoming_task=task,
-                            element=self,
-                            context=context)
-        except Exception as e:
-            print("Handling exception :", e)
-            print(e.args)
-            import traceback
-            traceback.print_exc()
-            new_task = task.clone_task(context)
-            new_task.status = task.Status.ERROR
-            new_task.state = {'state': task.state,
-                              'error': str(e)}
+        func = compiled_workflow(self.workflow_id).operation_callable(self.pk)
+        # The status of the incoming task may be changed by the operation
+        status = task.status
+        started = events.start(task)
+        with measured(operation_measured, Element, element=self, task=task, status=status) as measurement:
+            try:
+                new_task = func(incoming_task=task,
+                                element=self,
+                                context=context)
+            except Exception as e:
+                new_task = self.error_task(task, context, e)
+
+            new_task = measurement['new_task'] = self.settle_task(task, new_task, context)
+
+        if started is not None:
+            events.step(started, task, self, status, new_task)
+        return new_task
+
+    async def aprocess_task(self, task, context):
+        """Run a single step on the task using this element, from within an event loop.
+
+        Operations providing an acall method are awaited directly, so that any number of
+        them can wait on external systems concurrently. Other operations are run in the
+        thread that owns the database connection, each in a transaction of its own so
+        that a database error in one does not abort the work of others sharing the
+        connection.
+        """
+        if task.status == task.Status.FINISHED or task.status== task.Status.TERMINATED:
+            return None
+
+        graph = await acompiled_workflow(self.workflow_id)
+        func = graph.operation_callable(self.pk)
+        status = task.status
+        started = events.start(task)
+        with measured(operation_measured, Element, queries=False, element=self, task=task, status=status) as measurement:
+            try:
+                acall = getattr(func, 'acall', None)
+                if acall is not None:
+                    new_task = await acall(incoming_task=task,
+                                           element=self,
+                                           context=context)
+                else:
+                    new_task = await sync_to_async(transaction.atomic(func), thread_sensitive=True)(incoming_task=task,
+                                                                                                    element=self,
+                                                                                                    context=context)
+            except Exception as e:
+                new_task = self.error_task(task, context, e)
 
+            new_task = measurement['new_task'] = self.settle_task(task, new_task, context)
+
+        if started is not None:
+            events.step(started, task, self, status, new_task)
+        return new_task
+
+    def process_batch(self, tasks, context):
+        """Run a single step on several tasks at once, with the operate_batch method of the operation.
+
+        Returns the new task, or None, for each task, as process_task would. If the batch
+        operation raises an exception, every task enters the error state; if it returns an
+        exception in place of a new task, only that task does.
+        """
+        func = compiled_workflow(self.workflow_id).operation_callable(self.pk)
+        live = [task for task in tasks
+                if task.status != task.Status.FINISHED and task.status != task.Status.TERMINATED]
+        started = [events.start(task) for task in live]
+        measurements = [{'element': self, 'task': task, 'status': task.status} for task in live]
+        with measured_each(operation_measured, Element, measurements):
+            try:
+                results = list(func.operate_batch(live, self, context)) if live else []
+                if len(results) != len(live):
+                    raise ValueError(f"Batch operation returned {len(results)} results for {len(live)} tasks")
+            except Exception as e:
+                results = [e] * len(live)
+
+            new_tasks = {}
+            for task, result, measurement in zip(live, results, measurements):
+                if isinstance(result, Exception):
+                    result = self.error_task(task, context, result)
+                new_tasks[id(task)] = measurement['new_task'] = self.settle_task(task, result, context)
+
+        for task, start, measurement in zip(live, started, measurements):
+            if start is not None:
+                events.step(start, task, self, measurement['status'], measurement['new_task'])
+        return [new_tasks.get(id(task)) for task in tasks]
+
+    @staticmethod
+    def error_task(task, context, e):
+        logger.warning("Operation failed on %s", task, exc_info=e)
+        new_task = task.clone_task(context)
+        new_task.status = task.Status.ERROR
+        new_task.state = {'state': task.state,
+                          'error': str(e)}
+        return new_task
+
+    @staticmethod
+    def settle_task(task, new_task, context):
+        """Finish or terminate a completed or errored task that the operation did not move on"""
         if new_task is None:
             if task.status == task.Status.COMPLETED or task.status== task.Status.ERROR:
                 new_task = task.clone_task(context)
@@ -178,7 +306,7 @@ class Link(models.Model):
     slug_name = models.SlugField(max_length=100, unique=False)
 
     def save(self, *args, **kwargs):
-        if self.source.workflow != target.source.workflow:
+        if self.source.workflow_id != self.target.workflow_id:
             raise ValueError("Cannor have a link berween elements of different workflows")
         return super().save(*args, **kwargs)
 
@@ -188,6 +316,27 @@ class LinkAdmin(admin.ModelAdmin):
     list_filter = ['slug_name', ]
 
 
+class TaskStatus(models.IntegerChoices):
+    NEW = 0
+    WAITING = 1
+    UPDATED = 2
+    COMPLETED = 3
+    ERROR = 4
+    FINISHED = 5
+    TERMINATED = 6
+
+
+# Statuses of a current task from which the engine can make progress
+RUNNABLE_STATUSES = [TaskStatus.NEW,
+                     TaskStatus.UPDATED,
+                     TaskStatus.COMPLETED,
+                     TaskStatus.ERROR,
+                     ]
+
+# Statuses of a current task for a ticket that has not yet finished
+LIVE_STATUSES = RUNNABLE_STATUSES + [TaskStatus.WAITING]
+
+
 class Ticket(models.Model):
     workflow = models.ForeignKey(Workflow, blank=False, unique=False, null=False, on_delete=models.CASCADE)
     creation = models.DateTimeField(auto_now_add=True)
@@ -196,25 +345,38 @@ class Ticket(models.Model):
     last_check = models.DateTimeField(null=True, blank=True, unique=False)
     last_checkor = models.ForeignKey(User, blank=True, unique=False, null=True, on_delete=models.CASCADE, related_name="creator")
 
+    # Denormalised copy of the most recent task, and its status, maintained by Task.save
+    current_task = models.ForeignKey('Task', blank=True, unique=False, null=True, on_delete=models.SET_NULL, related_name="ticket_current")
+    status = models.PositiveSmallIntegerField(choices=TaskStatus.choices, null=True, blank=True)
+
+    # Supplied by the client creating the ticket, so that a retried request returns the
+    # ticket created by the first one. Unique for each creator.
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, unique=False)
+
+    # Set while the engine is advancing this ticket, so that the tasks it creates on the
+    # way do not announce the ticket as runnable
+    advancing = False
+
     def get_absolute_url(self):
         return reverse('taskflow:ticket', kwargs={'pk': self.pk})
 
-    def run_workflow_step(self, context):
-        """Run a single workflow step on this ticket.
+    def pending_task(self, context):
+        """Return the task to be processed next on this ticket, and the element to process it"""
+        graph = compiled_workflow(self.workflow_id)
 
-        Can assume that the caller has a transaction lock on this ticket.
-        """
-        if self.last_check is None:
+        # Read the pointer through the database, in case this instance is stale
+        pre_task = Task.objects.select_related('step').filter(ticket_current=self).first()
+
+        if pre_task is None:
             # Never run on this one before
-            element = Element.objects.get(workflow=self.workflow,
-                                          is_initial=True)
+            element = graph.initial
+            if element is None:
+                raise Element.DoesNotExist(f"No initial element for workflow {graph.workflow}")
 
             steps = Step.objects.filter(element=element,
                                        ticket=self)
             if steps.count() == 0:
-                step = Step(ticket=self,
-                            element=element)
-                step.save()
+                step = Step.start(self, element, context)
             else:
                 step = steps[0]
 
@@ -223,55 +385,176 @@ class Ticket(models.Model):
                             creator=context['user'])
         else:
             # Not a brand-new ticket
-            pre_task = Task.objects.filter(step__ticket=self).order_by('-creation')[0]
-            element = pre_task.step.element
+            pre_task.step.ticket = self
+            element = graph.element(pre_task.step.element_id)
+
+        return pre_task, element
+
+    def run_workflow_step(self, context):
+        """Run a single workflow step on this ticket.
+
+        Can assume that the caller has a transaction lock on this ticket.
+        """
+        pre_task, element = self.pending_task(context)
 
         task = element.process_task(pre_task, context)
 
         return task
 
-    def run_workflow(self, context):
+    def advance_step(self, context):
+        """Run a single workflow step on this ticket and save the resulting task.
+
+        Can assume that the caller has a transaction lock on this ticket.
+        """
+        task = self.run_workflow_step(context)
+        if task is not None:
+            task.save()
+            self.last_checkor = context['user']
+            self.last_check = now()
+            self.save(update_fields=['last_check', 'last_checkor'])
+        return task
+
+    async def arun_workflow_step(self, context):
+        """Run a single workflow step on this ticket, from within an event loop"""
+        pre_task, element = await sync_to_async(self.pending_task, thread_sensitive=True)(context)
+
+        task = await element.aprocess_task(pre_task, context)
+
+        return task
+
+    def saves_checkpoints(self):
+        """Whether the workflow of this ticket is one of TASKFLOW_CHECKPOINT_WORKFLOWS"""
+        slugs = taskflow_setting('CHECKPOINT_WORKFLOWS')
+        return bool(slugs) and compiled_workflow(self.workflow_id).workflow.slug in slugs
+
+    def run_workflow(self, context, checkpoints=None):
         """Run multiple workflow steps until no progress is made.
 
+        With checkpoints, or for the workflows in TASKFLOW_CHECKPOINT_WORKFLOWS, the steps
+        are run in memory and only checkpoint tasks are saved; see engine.BatchRun.
+
         This function assumes that the caller has a transaction lock on this ticket
         """
+        if checkpoints is None:
+            checkpoints = self.saves_checkpoints()
+        if checkpoints:
+            from .engine import BatchRun
+            return BatchRun(context, checkpoints=True).run([self])[0]
+
         self.last_checkor = context['user']
-        last_task = None
-        while True:
-            task = self.run_workflow_step(context)
-            self.last_check = now()
-            if task is None:
-                self.save()
-                if last_task is not None:
-                    last_task.save()
-                return last_task
-            last_task = task
-            last_task.save()
+        self.advancing = True
+        try:
+            last_task = None
+            while True:
+                task = self.run_workflow_step(context)
+                self.last_check = now()
+                if task is None:
+                    self.save(update_fields=['last_check', 'last_checkor'])
+                    if last_task is not None:
+                        last_task.save()
+                    return last_task
+                last_task = task
+                last_task.save()
+        finally:
+            self.advancing = False
+
+    async def arun_workflow(self, context):
+        """Run multiple workflow steps until no progress is made, from within an event loop.
+
+        Operations are awaited, and database access is passed to the thread that owns the
+        connection, so many tickets can be advanced concurrently on one event loop.
+        """
+        self.last_checkor = context['user']
+        self.advancing = True
+        try:
+            last_task = None
+            while True:
+                task = await self.arun_workflow_step(context)
+                self.last_check = now()
+                if task is None:
+                    await sync_to_async(self.save, thread_sensitive=True)(update_fields=['last_check', 'last_checkor'])
+                    if last_task is not None:
+                        await sync_to_async(last_task.save, thread_sensitive=True)()
+                    return last_task
+                last_task = task
+                await sync_to_async(last_task.save, thread_sensitive=True)()
+        finally:
+            self.advancing = False
+
+    @classmethod
+    def create_many(cls, items, context, run=False, keys=None):
+        """Create a ticket for each (workflow, state) pair using bulk inserts.
+
+        With run, the initial element processes the new tickets in a batch. keys gives an
+        idempotency key, or None, for each item. Returns the tickets in the order of the
+        items.
+        """
+        from .engine import create_tickets
+        return create_tickets(items, context, run, keys)
+
+    @classmethod
+    def advance_many(cls, tickets, context, **options):
+        """Lock and run the workflow of each ticket, a group of tickets per transaction.
+
+        See engine.advance_tickets for the options. Returns the last task of each ticket.
+        """
+        from .engine import advance_tickets
+        return advance_tickets(tickets, context, **options)
+
+    @classmethod
+    def run_workflow_many(cls, tickets, context, checkpoints=False):
+        """Run the workflow of many tickets until no progress is made.
+
+        Operations are run in memory and the resulting steps, tasks and ticket updates
+        are written with bulk inserts and updates; with checkpoints, only the checkpoint
+        tasks are written. Returns the last task of each ticket, in the order of the
+        tickets. Assumes that the caller holds locks on the tickets.
+        """
+        from .engine import BatchRun
+        return BatchRun(context, checkpoints=checkpoints).run(tickets)
 
     def __str__(self):
         return f"TK:{self.pk}:{self.creation}"
 
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['creator', 'idempotency_key'],
+                                               name='taskflow_ticket_idempotency'),
+                       ]
+        # Finished tickets soon outnumber the others, so lookups by status avoid reading
+        # them. The status values are query parameters, which rules out partial indexes.
+        # Serves runnable_tickets, Task.latest_tasks and archivable_tickets
+        indexes = [models.Index(fields=['status', 'current_task'],
+                                name='taskflow_ticket_status'),
+                   # Pages of the list view
+                   models.Index(fields=['-creation', '-id'],
+                                name='taskflow_ticket_recent'),
+                   ]
+
+
+def advance_from_admin(modeladmin, request, ticket_ids, **options):
+    """Advance tickets for an admin action, reporting any that failed to the user"""
+    failures = []
+    Ticket.advance_many(ticket_ids, Workflow.request_context(request), failures=failures, **options)
+    if failures:
+        modeladmin.message_user(request,
+                                "Failed to advance tickets " + ", ".join(str(ticket_id) for ticket_id, e in failures),
+                                level=messages.WARNING)
+
+
 class TicketAdmin(admin.ModelAdmin):
-    list_display = ['workflow', 'creation', 'creator', 'last_check', 'last_checkor']
-    list_filter = ['last_check', 'creation', 'workflow', 'creator', 'last_checkor']
+    list_display = ['workflow', 'creation', 'creator', 'status', 'last_check', 'last_checkor']
+    list_filter = ['status', 'last_check', 'creation', 'workflow', 'creator', 'last_checkor']
+    readonly_fields = ['current_task', 'status']
 
     def run_workflow_step(self, request, queryset):
-        context = Workflow.request_context(request)
-        for q in queryset.all():
-            t = q.run_workflow_step(context)
-            if t is not None:
-                t.save()
-                q.last_checkor = context['user']
-                q.last_check = now()
-                q.save()
+        advance_from_admin(self, request, queryset.values_list('pk', flat=True),
+                           single_step=True)
 
     run_workflow_step.short_description = 'Run workflow step on ticket and save the resultant task'
 
     def run_workflow(self, request, queryset):
-        context = Workflow.request_context(request)
-        for q in queryset.all():
-            q.run_workflow(context)
+        advance_from_admin(self, request, queryset.values_list('pk', flat=True))
 
     run_workflow.short_description = 'Run workflow on ticket and save the resultant task'
 
@@ -287,6 +570,27 @@ class Step(models.Model):
     def __str__(self):
         return f"S-{self.pk}:{self.ticket}:{self.element}:{self.creation}"
 
+    @classmethod
+    def start(cls, ticket, element, context):
+        """Create a new step for a ticket at an element.
+
+        If the context holds a 'deferred_steps' list then the step is added to it, to be
+        inserted later in bulk, instead of being saved immediately.
+        """
+        step = cls(ticket=ticket,
+                   element=element)
+        deferred_steps = context.get('deferred_steps')
+        if deferred_steps is None:
+            step.save()
+        else:
+            deferred_steps.append(step)
+        return step
+
+    def ensure_saved(self):
+        """Save a deferred step, for operations that need to refer to it from other rows"""
+        if self.pk is None:
+            self.save()
+
     class Meta:
         constraints = [models.UniqueConstraint(fields=['ticket', 'element', 'creation'],
                                                name='workflow_step_uniqueness'),
@@ -298,45 +602,174 @@ class StepAdmin(admin.ModelAdmin):
     list_filter = ['creation', 'element', ]
 
 
+class StateDescriptor(DeferredAttribute):
+    """Rebuild the state of a delta-encoded task the first time it is read"""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if value is None and instance is not None and instance.__dict__.get('state_patch') is not None:
+            value = instance.rebuild_state()
+            instance.__dict__[self.field.attname] = value
+            instance._stored_state = copy.deepcopy(value)
+        return value
+
+    def __set__(self, instance, value):
+        # A data descriptor, so that it is consulted even once the instance holds a value
+        instance.__dict__[self.field.attname] = value
+
+
+class StateField(JSONField):
+    """JSON field that stores NULL for tasks whose state is held as a patch"""
+
+    descriptor_class = StateDescriptor
+
+    def pre_save(self, model_instance, add):
+        if model_instance.state_patch is not None:
+            return None
+        return super().pre_save(model_instance, add)
+
+
 class Task(models.Model):
     """The current task for a ticket.
 
     The ticket is in the current element, and processing has been paused within the element.
     """
 
-    class Status(models.IntegerChoices):
-        NEW = 0
-        WAITING = 1
-        UPDATED = 2
-        COMPLETED = 3
-        ERROR = 4
-        FINISHED = 5
-        TERMINATED = 6
+    Status = TaskStatus
 
     step = models.ForeignKey(Step, blank=False, unique=False, on_delete=models.CASCADE)
     creation = models.DateTimeField(auto_now_add=True)
-    state = JSONField(null=False, blank=False, unique=False)
+    state = StateField(null=True, blank=False, unique=False)
     creator = models.ForeignKey(User, blank=False, unique=False, null=False, on_delete=models.CASCADE)
     status = models.PositiveSmallIntegerField(choices=Status.choices,
                                               default=Status.NEW)
 
+    # With delta state storage, the state is held as a JSON patch against an earlier task.
+    # A patch cannot be decoded without its base, so deleting the base deletes the task
+    state_base = models.ForeignKey('self', blank=True, unique=False, null=True, on_delete=models.CASCADE, related_name="+")
+    state_patch = JSONField(null=True, blank=True, unique=False)
+    state_depth = models.PositiveSmallIntegerField(default=0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if taskflow_setting('STATE_STORAGE') == 'delta' and instance.__dict__.get('state') is not None:
+            instance._stored_state = copy.deepcopy(instance.__dict__['state'])
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with measured(persistence_measured, Task, task=self, count=1):
+            dependants = self.encode_state(adding)
+            with transaction.atomic():
+                ret = super().save(*args, **kwargs)
+                for task in dependants:
+                    Task.objects.filter(pk=task.pk).update(state_patch=make_patch(self._stored_state, task.state))
+                self.update_ticket(adding)
+        return ret
+
+    def encode_state(self, adding):
+        """Decide how the state of this task is to be stored.
+
+        With TASKFLOW_STATE_STORAGE set to 'delta', a new task is stored as a patch against
+        the task it was cloned from, and a full snapshot is written whenever the chain of
+        patches would reach TASKFLOW_STATE_SNAPSHOT_INTERVAL. An existing patch is always
+        recomputed against its base.
+
+        Returns the tasks stored as patches against this one whose patches have to be
+        recomputed because the state of this task has changed.
+        """
+        if adding:
+            base = getattr(self, '_state_source', None)
+            if (taskflow_setting('STATE_STORAGE') != 'delta' or base is None or base.pk is None
+                    or base.step.ticket_id != self.step.ticket_id
+                    or base.state_depth + 1 >= taskflow_setting('STATE_SNAPSHOT_INTERVAL')):
+                base = None
+        else:
+            base = self.state_base if self.state_base_id is not None else None
+
+        state = self.state
+        dependants = []
+        stored = getattr(self, '_stored_state', None)
+        if not adding and stored is not None and stored != state:
+            dependants = list(Task.objects.filter(state_base=self.pk))
+            for task in dependants:
+                # Decoded against the state as it is still stored
+                task.state
+
+        if base is None:
+            self.state_base = None
+            self.state_patch = None
+            self.state_depth = 0
+        else:
+            self.state_base = base
+            self.state_patch = make_patch(getattr(base, '_stored_state', base.state), state)
+            self.state_depth = base.state_depth + 1
+
+        if taskflow_setting('STATE_STORAGE') == 'delta':
+            # What has been written, so that later tasks are encoded against it even if
+            # the state of this instance is changed in memory
+            self._stored_state = copy.deepcopy(state)
+        return dependants
+
+    def rebuild_state(self):
+        """Reconstruct the state of a delta-encoded task by applying its chain of patches"""
+        patches = [self.state_patch]
+        base = self.state_base if Task.state_base.is_cached(self) else None
+        base_id = self.state_base_id
+        while True:
+            if base is not None:
+                state = getattr(base, '_stored_state', base.state)
+                break
+            row = Task.objects.values('state', 'state_patch', 'state_base_id').get(pk=base_id)
+            if row['state_patch'] is None:
+                state = row['state']
+                break
+            patches.append(row['state_patch'])
+            base_id = row['state_base_id']
+
+        for patch in reversed(patches):
+            state = apply_patch(state, patch)
+        return state
+
+    def update_ticket(self, adding):
+        """Make this task the current task of its ticket.
+
+        A newly added task always becomes current; an existing task only refreshes the
+        ticket status if it is still the current one.
+        """
+        tickets = Ticket.objects.filter(pk=self.step.ticket_id)
+        if not adding:
+            tickets = tickets.filter(current_task=self)
+        tickets.update(current_task=self,
+                       status=self.status)
+
+        ticket = self.step.ticket if Step.ticket.is_cached(self.step) else None
+        if ticket is not None and (adding or ticket.current_task_id == self.pk):
+            ticket.current_task = self
+            ticket.status = self.status
+
+        if adding and self.status in RUNNABLE_STATUSES and not (ticket is not None and ticket.advancing):
+            send_ticket_runnable(self.__class__, self.step.ticket_id)
+
     def clone_task(self, context):
-        return Task(step=self.step,
+        task = Task(step=self.step,
                     state=self.state,
                     creator=context['user'])
+        task._state_source = self
+        return task
 
     def __str__(self):
         return f"{self.step}:{self.creation}"
 
     @classmethod
     def latest_tasks(cls, exclude_finished=True):
-        sub_query = cls.objects.filter(step__ticket=OuterRef('step__ticket')).values('step__ticket').annotate(max_creation=Max('creation')).values_list('max_creation')
-        qs = cls.objects.filter(creation=Subquery(sub_query))
+        tickets = Ticket.objects.filter(current_task__isnull=False)
 
         if exclude_finished:
-            qs = qs.filter(~Q(status=Task.Status.FINISHED),
-                           ~Q(status=Task.Status.TERMINATED))
-        return qs
+            # Listing the statuses, rather than excluding some, lets the index be used
+            tickets = tickets.filter(Q(status__isnull=True) | Q(status__in=LIVE_STATUSES))
+        return cls.objects.filter(pk__in=tickets.values('current_task'))
 
     def get_absolute_url(self):
         return reverse('taskflow:task', kwargs={'pk': self.pk})
@@ -347,6 +780,15 @@ class Task(models.Model):
                        models.UniqueConstraint(fields=['step', 'creation'],
                                                name='workflow_task_uniqueness'),
                        ]
+        # Tasks waiting at a step are found through the step index of the unique
+        # constraint, as each step only has a few tasks
+        indexes = [# Tasks by status, newest first, for the list views
+                   models.Index(fields=['status', '-creation'],
+                                name='taskflow_task_status'),
+                   # Pages of the list views
+                   models.Index(fields=['-creation', '-id'],
+                                name='taskflow_task_recent'),
+                   ]
 
 
 class TaskAdmin(admin.ModelAdmin):
@@ -354,21 +796,14 @@ class TaskAdmin(admin.ModelAdmin):
     list_filter = ['status', 'creation', 'creator',]
 
     def run_task_step(self, request, queryset):
-        context = Workflow.request_context(request)
-        for q in queryset.all():
-            t = q.step.ticket.run_workflow_step(context)
-            if t is not None:
-                t.save()
-                q.step.ticket.last_checkor = context['user']
-                q.step.ticket.last_check = now()
-                q.step.ticket.save()
+        ticket_ids = dict.fromkeys(queryset.values_list('step__ticket', flat=True))
+        advance_from_admin(self, request, ticket_ids, single_step=True)
 
     run_task_step.short_description = "Run next workflow step on ticket associated with task"
 
     def run_task(self, request, queryset):
-        context = Workflow.request_context(request)
-        for q in queryset.all():
-            q.step.ticket.run_workflow(context)
+        ticket_ids = dict.fromkeys(queryset.values_list('step__ticket', flat=True))
+        advance_from_admin(self, request, ticket_ids)
 
     run_task.short_description = "Run workflow for ticket associated with task"
 
@@ -382,31 +817,58 @@ class OperatorTask(models.Model):
     completed = models.DateTimeField(null=True, blank=True, unique=False)
     operator = models.ForeignKey(User, blank=False, unique=False, null=False, on_delete=models.CASCADE)
 
+    # Value of completed when loaded, so that completion is only acted on once
+    _saved_completed = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_completed = instance.__dict__.get('completed')
+        return instance
+
     def progress_task(self):
         """Set state to done."""
         if self.completed is None:
-            self.completed = datetime.datetime.now()
+            self.completed = now()
             self.save()
 
     def save(self, *args, **kwargs):
         ret = super().save(*args, **kwargs)
-        if self.completed is not None:
+        if self.completed is not None and self._saved_completed is None:
             self.check_completed_task(Workflow.user_context(self.operator))
+        self._saved_completed = self.completed
         return ret
 
+    def waiting_tasks(self):
+        """Current tasks of tickets waiting at the step of this operator task"""
+        return Task.objects.filter(step=self.step_id,
+                                   status=Task.Status.WAITING,
+                                   ticket_current__status=Task.Status.WAITING)
+
     def check_completed_task(self, context):
-        """Check all operator tasks for completed state that are still waiting"""
+        """Move the task waiting on this operator task, if any, to UPDATED.
+
+        Saving the UPDATED task sends ticket_runnable for its ticket.
+        """
         if self.completed is None:
             return
-        comp_tasks = Task.latest_tasks().filter(status=Task.Status.WAITING,
-                                                step=self.step)
-
-        for task in comp_tasks:
+        for task in self.waiting_tasks():
             new_task = task.clone_task(context)
             new_task.status = Task.Status.UPDATED
             new_task.save()
 
 
+    class Meta:
+        indexes = [# Open operator tasks, oldest first, for each operator
+                   models.Index(fields=['operator', 'created'],
+                                condition=Q(completed__isnull=True),
+                                name='taskflow_optask_open'),
+                   # Pages of the list view
+                   models.Index(fields=['-created', '-id'],
+                                name='taskflow_optask_recent'),
+                   ]
+
+
 class OperatorTaskAdmin(admin.ModelAdmin):
     list_filter = ['created', 'completed', 'operator', ]
     list_display = ['step', 'created', 'completed', 'operator', ]
@@ -420,3 +882,71 @@ class OperatorTaskAdmin(admin.ModelAdmin):
     progress_task.short_description = "Progress operator task"
 
     actions = [progress_task, ]
+
+
+class ScriptRun(models.Model):
+    """Script to be run in the process pool of a worker, for the task waiting at a step.
+
+    Any worker can claim a run. The worker running it renews the claim until it records
+    the result and deletes the run, so the run of a worker that stopped is taken over
+    by another once its claim is TASKFLOW_PROCESS_CLAIM_TIMEOUT seconds old.
+    """
+    step = models.ForeignKey(Step, blank=False, unique=False, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    creator = models.ForeignKey(User, blank=False, unique=False, null=False, on_delete=models.CASCADE, related_name="+")
+    script_name = models.CharField(max_length=255)
+    op_params = JSONField(null=False, blank=False, unique=False)
+    state = JSONField(null=True, blank=True, unique=False)
+    claimed = models.DateTimeField(null=True, blank=True, unique=False)
+
+    def __str__(self):
+        return f"{self.script_name}:{self.step}"
+
+    class Meta:
+        indexes = [# Runs for workers to claim, oldest first
+                   models.Index(fields=['claimed', 'id'],
+                                name='taskflow_scriptrun_claim'),
+                   ]
+
+
+class ScriptRunAdmin(admin.ModelAdmin):
+    list_display = ['step', 'script_name', 'created', 'claimed']
+    list_filter = ['created', 'claimed', ]
+
+
+class ArchivedTicket(models.Model):
+    """Compact record of a finished ticket whose steps and tasks have been archived"""
+    ticket_id = models.IntegerField(unique=True)
+    workflow = models.ForeignKey(Workflow, blank=True, unique=False, null=True, on_delete=models.SET_NULL)
+    creation = models.DateTimeField()
+    creator = models.ForeignKey(User, blank=True, unique=False, null=True, on_delete=models.SET_NULL, related_name="+")
+    finished = models.DateTimeField()
+    status = models.PositiveSmallIntegerField(choices=TaskStatus.choices)
+    # The steps of the ticket, each with its tasks and operator tasks, oldest first
+    history = JSONField(null=False, blank=False, unique=False)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"TK:{self.ticket_id}:{self.finished}"
+
+
+class ArchivedTicketAdmin(admin.ModelAdmin):
+    list_display = ['ticket_id', 'workflow', 'creation', 'finished', 'status', 'archived']
+    list_filter = ['status', 'finished', 'workflow', ]
+
+
+class TicketTrace(models.Model):
+    """Compact record of the steps taken by a ticket in one run, when only checkpoints are saved"""
+    ticket = models.ForeignKey(Ticket, blank=False, unique=False, null=False, on_delete=models.CASCADE)
+    creation = models.DateTimeField(auto_now_add=True)
+    # Each task of the run, oldest first: its element, status, and state as a JSON patch
+    # against the state before it
+    steps = JSONField(null=False, blank=False, unique=False)
+
+    def __str__(self):
+        return f"TK:{self.ticket_id}:{self.creation}"
+
+
+class TicketTraceAdmin(admin.ModelAdmin):
+    list_display = ['ticket', 'creation']
+    list_filter = ['creation', ]
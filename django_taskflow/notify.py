@@ -0,0 +1,124 @@
+"""Notification of runnable tickets
+
+Whenever a ticket becomes runnable from outside the engine, when it is created
+or a runnable task is saved for it, for example as an operator task completes,
+the ticket_runnable signal is published to the configured backend. Workers block on the backend between
+batches instead of polling the database, and only poll when the wait times out.
+
+The backend is selected with the TASKFLOW_NOTIFY_BACKEND setting.
+"""
+
+
+import re
+import select
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .conf import taskflow_setting
+
+
+class NotificationBackend:
+    """Base class for notification backends"""
+
+    def publish(self, ticket_id):
+        raise NotImplementedError("Notification backend must provide publish")
+
+    def listen(self):
+        """Start receiving notifications. Notifications published after this call are not lost."""
+
+    def wait(self, timeout):
+        """Wait for notifications, returning the set of ticket ids received before the timeout"""
+        raise NotImplementedError("Notification backend must provide wait")
+
+    def close(self):
+        pass
+
+
+class InMemoryBackend(NotificationBackend):
+    """Notifications between threads of a single process, for tests and single-node setups"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = set()
+
+    def publish(self, ticket_id):
+        with self._condition:
+            self._pending.add(ticket_id)
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            ticket_ids, self._pending = self._pending, set()
+        return ticket_ids
+
+
+class PostgresBackend(NotificationBackend):
+    """Notifications through PostgreSQL LISTEN/NOTIFY, shared by every process using the database"""
+
+    def __init__(self, using='default', channel=None):
+        self.using = using
+        self.channel = channel or taskflow_setting('NOTIFY_CHANNEL')
+        if not re.match(r'^[a-z_][a-z0-9_]*$', self.channel):
+            raise ImproperlyConfigured(f"Invalid notification channel name {self.channel}")
+        if connections[using].vendor != 'postgresql':
+            raise ImproperlyConfigured("PostgresBackend requires a PostgreSQL database")
+        self._listener = None
+
+    def publish(self, ticket_id):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, str(ticket_id)])
+
+    def listen(self):
+        # A dedicated connection, outside of Django's transaction management
+        if self._listener is None:
+            wrapper = connections[self.using]
+            listener = wrapper.get_new_connection(wrapper.get_connection_params())
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            self._listener = listener
+        return self._listener
+
+    def wait(self, timeout):
+        listener = self.listen()
+        listener.poll()
+        if not listener.notifies:
+            if select.select([listener], [], [], timeout)[0]:
+                listener.poll()
+
+        ticket_ids = {int(n.payload) for n in listener.notifies if n.channel == self.channel}
+        del listener.notifies[:]
+        return ticket_ids
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def notification_backend():
+    """Return the configured notification backend, or None if there is none"""
+    global _backend
+    path = taskflow_setting('NOTIFY_BACKEND')
+    if not path:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(path)()
+        return _backend
+
+
+def publish_runnable(sender, ticket_id, **kwargs):
+    """Receiver for ticket_runnable that publishes to the configured backend"""
+    backend = notification_backend()
+    if backend is not None:
+        backend.publish(ticket_id)
@@ -1,19 +1,107 @@
 """Standard operations"""
 
 
+import asyncio
+import logging
 from abc import ABC, abstractmethod
-from .models import Task, Operation, OperatorTask, Step
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.db import transaction
+
+from . import memo
+from .executors import submit_script
+from .models import Task, OperatorTask, Step
+from .graph import compiled_workflow
+from .instrumentation import measured
+from .registry import operation_registry
+from .signals import link_measured
+
+
+logger = logging.getLogger(__name__)
 
 
 class OpBase(ABC):
-    """Base classs for operations, providing methods through dispatch"""
+    """Base classs for operations, providing methods through dispatch.
+
+    An operation may also define operate_batch(tasks, element, context), returning a new
+    task or None for each task. The batch engine then passes it all the tasks in
+    batch_statuses waiting at an element together, instead of one at a time.
+    """
+
+    batch_statuses = (Task.Status.NEW,)
+
+    # Whether the result depends only on the op_params of the element and the status and
+    # state of the incoming task, so that it can be memoised
+    pure = False
+
+    # Statuses in which the result of a pure operation is memoised. Completed tasks
+    # follow the links of the element, so are never memoised
+    memo_statuses = (Task.Status.NEW,)
 
     def __call__(self, incoming_task, element, context):
-        print("OpBase call")
-        print(incoming_task)
-        print(element)
-        print(incoming_task.status, incoming_task.status.__class__)
+        logger.debug("%s on %s at %s", self.__class__.__name__, incoming_task, element)
+
+        key = self.memo_key(incoming_task, element)
+        if key is not None:
+            value = memo.result_cache().get(key, element)
+            if value is not memo.MISSING:
+                return memo.replay(incoming_task, value, context)
+
+        op_func = self.operation_for(incoming_task)
+        if asyncio.iscoroutinefunction(op_func):
+            result = async_to_sync(op_func)(incoming_task, element, context)
+        else:
+            result = op_func(incoming_task, element, context)
+
+        if key is not None:
+            self.memo_store(key, incoming_task, element, result)
+        return result
+
+    async def acall(self, incoming_task, element, context):
+        """Dispatch from within an event loop.
+
+        Methods defined with async def are awaited; others are run in the thread that
+        owns the database connection, in a transaction of their own.
+        """
+        key = self.memo_key(incoming_task, element)
+        if key is not None:
+            value = memo.result_cache().get(key, element)
+            if value is not memo.MISSING:
+                return memo.replay(incoming_task, value, context)
+
+        op_func = self.operation_for(incoming_task)
+        if asyncio.iscoroutinefunction(op_func):
+            result = await op_func(incoming_task, element, context)
+        else:
+            result = await sync_to_async(transaction.atomic(op_func), thread_sensitive=True)(incoming_task, element, context)
+
+        if key is not None:
+            self.memo_store(key, incoming_task, element, result)
+        return result
+
+    def memoised(self, element):
+        """Whether results at an element are memoised"""
+        return self.pure
+
+    def memo_key(self, incoming_task, element):
+        """The key of the result for a task, or None if it is not memoised"""
+        if incoming_task.status not in self.memo_statuses or not self.memoised(element):
+            return None
+        try:
+            return memo.result_key(self, element, incoming_task)
+        except (TypeError, ValueError):
+            # A state that cannot be serialised is never memoised
+            return None
+
+    @staticmethod
+    def memo_store(key, incoming_task, element, result):
+        value = memo.remember(incoming_task, element, result)
+        if value is not memo.MISSING:
+            memo.result_cache().set(key, value)
 
+    def operation_for(self, incoming_task):
+        """Find the method that handles a task in its current status"""
         try:
             label = incoming_task.status.label
         except:
@@ -25,10 +113,14 @@ class OpBase(ABC):
         # Missing method is a no-op
         if op_func is None:
             op_func = self.default_operation
-        return op_func(incoming_task, element, context)
+        return op_func
+
+    def supports_batch(self, incoming_task, element):
+        """Whether a task can be passed to operate_batch with others"""
+        return hasattr(self, 'operate_batch') and incoming_task.status in self.batch_statuses
 
     def default_operation(self, incoming_task, element, context):
-        print(f"In default op for {incoming_task} on {element}")
+        logger.debug("Default operation of %s for %s at %s", self.__class__.__name__, incoming_task, element)
         return None
 
     def operate_Error(self, incoming_task, element, context):
@@ -53,22 +145,24 @@ class OpBase(ABC):
 
     @staticmethod
     def move_to_next(element, slug_name, incoming_task, context):
-        targets = element.link_source.all()
+        targets = compiled_workflow(element.workflow_id).links_from(element.pk)
 
         if len(targets) < 1:
             return None
 
-        task = incoming_task.clone_task(context)
-        for link in targets:
-            if link.slug_name == slug_name:
-                if link.target != task.step.element:
-                    step = Step(ticket=task.step.ticket,
-                                element=link.target)
-                    step.save()
-                    task.step = step
+        with measured(link_measured, OpBase, element=element, slug_name=slug_name):
+            task = incoming_task.clone_task(context)
+            target = targets.get(slug_name)
+            if target is not None and target.pk != task.step.element_id:
+                task.step = Step.start(task.step.ticket, target, context)
 
         return task
 
+    @classmethod
+    async def amove_to_next(cls, element, slug_name, incoming_task, context):
+        """Version of move_to_next for use in async def operations"""
+        return await sync_to_async(transaction.atomic(cls.move_to_next), thread_sensitive=True)(element, slug_name, incoming_task, context)
+
 
 class Init(OpBase):
 
@@ -89,14 +183,55 @@ class Init(OpBase):
 
 class Script(OpBase):
 
+    # Where the script runs: None for inline, or 'process' for the process pool.
+    # Can be overridden per element with op_params['executor']
+    executor = None
+
+    batch_statuses = (Task.Status.NEW, Task.Status.UPDATED)
+
+    memo_statuses = (Task.Status.NEW, Task.Status.UPDATED)
+
+    def memoised(self, element):
+        # Opted into per element; scripts run in the process pool return their results later
+        return (bool(element.op_params.get('memoise', self.pure))
+                and element.op_params.get('executor', self.executor) != 'process')
+
+    def supports_batch(self, incoming_task, element):
+        # Only elements naming a script that takes a list of states
+        return (super().supports_batch(incoming_task, element)
+                and 'batch_script_name' in element.op_params
+                and element.op_params.get('executor', self.executor) != 'process')
+
+    def operate_batch(self, tasks, element, context):
+        """Run op_params['batch_script_name'] once on the states of all the tasks.
+
+        The script is called with element_parameters and a list of states as
+        source_data, and returns a list of new states in the same order.
+        """
+        func = operation_registry.resolve(element.op_params['batch_script_name'])
+        results = func(element_parameters=element.op_params,
+                       source_data=[task.state for task in tasks])
+
+        new_tasks = []
+        for incoming_task, res in zip(tasks, results):
+            task = incoming_task.clone_task(context)
+            task.state = res
+            task.status = task.Status.COMPLETED
+            new_tasks.append(task)
+        return new_tasks
+
     def default_operation(self, incoming_task, element, context):
 
         op_params = element.op_params
 
+        if op_params.get('executor', self.executor) == 'process':
+            return self.submit_to_process(incoming_task, element, context)
+
         try:
-            func = Operation.load_object_by_name(op_params['script_name'])
+            func = operation_registry.resolve(op_params['script_name'])
         except:
-            print("Cannot locate script_name in ", op_params)
+            logger.error("Cannot locate script_name in %s", op_params)
+            raise
 
         res = func(element_parameters = op_params,
                    source_data = incoming_task.state)
@@ -107,12 +242,32 @@ class Script(OpBase):
 
         return task
 
+    def operate_Waiting(self, incoming_task, element, context):
+        # Waiting on a script in the process pool; its result arrives as a new task
+        return None
+
+    @staticmethod
+    def submit_to_process(incoming_task, element, context):
+        """Record the script to be run in the process pool of a worker, and wait for it"""
+        operation_registry.resolve(element.op_params['script_name'])
+
+        submit_script(incoming_task.step,
+                      element.op_params['script_name'],
+                      element.op_params,
+                      incoming_task.state,
+                      context['user'])
+
+        task = incoming_task.clone_task(context)
+        task.status = task.Status.WAITING
+        return task
+
 
 class ExternalTaskBase(OpBase):
     """An external task, that pauses progress until resolved."""
 
     def default_operation(self, incoming_task, element, context):
-        print("External default reached default operation - this should not happen")
+        logger.warning("Default operation of %s reached for %s at %s; this should not happen",
+                       self.__class__.__name__, incoming_task, element)
         return None
 
     @abstractmethod
@@ -146,6 +301,7 @@ class OperatorExternalTask(ExternalTaskBase):
 
     def operate_New(self, incoming_task, element, context):
         # Create operator task, and change this task to WAITING
+        incoming_task.step.ensure_saved()
         operator_task = OperatorTask(step=incoming_task.step,
                                      operator=context['user'])
         operator_task.save()
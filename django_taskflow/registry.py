@@ -0,0 +1,115 @@
+"""Process-wide registry of operation callables
+
+Dotted names are imported once and, for classes, a single instance is shared
+by every step that uses it. Operations that hold per-call state can opt out
+of instance sharing by setting ``cache_instance = False`` on the class.
+"""
+
+
+import importlib
+import threading
+
+from .conf import taskflow_setting
+
+
+class OperationRegistry:
+    """Resolve and cache operation functions and instances by name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._declared = {}
+        self._objects = {}
+        self._instances = {}
+
+    def declare(self, name, dotted_name):
+        """Declare an operation name as an alias for a dotted name"""
+        with self._lock:
+            self._declared[name] = dotted_name
+            self._objects.pop(name, None)
+            self._instances.pop(name, None)
+
+    def undeclare(self, name):
+        with self._lock:
+            self._declared.pop(name, None)
+            self._objects.pop(name, None)
+            self._instances.pop(name, None)
+
+    def declared_names(self):
+        return list(self._declared.keys())
+
+    def load_declarations(self):
+        """Declare operations listed in settings and in package entry points"""
+        for name, dotted_name in taskflow_setting('OPERATIONS').items():
+            self.declare(name, dotted_name)
+
+        for entry_point in _entry_points(taskflow_setting('OPERATION_ENTRY_POINT_GROUP')):
+            self.declare(entry_point.name, entry_point.value.replace(':', '.'))
+
+    def resolve(self, name):
+        """Return the object named by a declared name or a dotted path"""
+        obj = self._objects.get(name)
+        if obj is None:
+            obj = _import_object(self._declared.get(name, name))
+            with self._lock:
+                self._objects[name] = obj
+        return obj
+
+    def callable_for(self, name):
+        """Return the callable for an operation, instantiating classes as needed"""
+        func = self._instances.get(name)
+        if func is not None:
+            return func
+
+        func = self.resolve(name)
+        if isinstance(func, type):
+            func = func()
+            if not getattr(func, 'cache_instance', True):
+                return func
+
+        with self._lock:
+            self._instances[name] = func
+        return func
+
+    def warm(self, names=()):
+        """Resolve declared and given names ahead of use.
+
+        Returns a dictionary of name to exception for any that could not be resolved.
+        """
+        failures = {}
+        for name in list(self._declared.keys()) + list(names):
+            try:
+                self.callable_for(name)
+            except Exception as e:
+                failures[name] = e
+        return failures
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._instances.clear()
+
+
+def _import_object(dotted_name):
+    name_parts = dotted_name.split('.')
+    mod_name = ".".join(name_parts[:-1])
+    if not mod_name:
+        raise ImportError(f"Operation name {dotted_name} is not a dotted path")
+    module = importlib.import_module(mod_name)
+    try:
+        return getattr(module, name_parts[-1])
+    except AttributeError as e:
+        raise ImportError(f"Module {mod_name} has no attribute {name_parts[-1]}") from e
+
+
+def _entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=group)
+    return eps.get(group, [])
+
+
+operation_registry = OperationRegistry()
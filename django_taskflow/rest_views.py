@@ -3,10 +3,46 @@ DRF views to provide endpoints
 """
 
 
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .models import Workflow, Ticket
 
 
 class TicketArgumentSerializer(serializers.Serializer):
 
     workflow = serializers.SlugField()
     state = serializers.JSONField()
+    idempotency_key = serializers.CharField(max_length=255, required=False)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_tickets(request):
+    """Create a ticket for each {workflow, state} item of the list posted.
+
+    With ?run=1 the initial element of each workflow processes the new tickets. An item
+    with an idempotency_key already used by the user gets the ticket created with it.
+    Responds with the ids of the tickets, in the order of the items.
+    """
+    serializer = TicketArgumentSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+
+    # One query for every workflow named, rather than one per item
+    slugs = {item['workflow'] for item in serializer.validated_data}
+    workflows = Workflow.objects.in_bulk(slugs, field_name='slug')
+    errors = [{} if item['workflow'] in workflows else {'workflow': [f"Unknown workflow {item['workflow']}"]}
+              for item in serializer.validated_data]
+    if any(errors):
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+    run = request.query_params.get('run') in ('1', 'true')
+    tickets = Ticket.create_many([(workflows[item['workflow']], item['state'])
+                                  for item in serializer.validated_data],
+                                 Workflow.request_context(request),
+                                 run=run,
+                                 keys=[item.get('idempotency_key') for item in serializer.validated_data])
+    return Response({'tickets': [ticket.pk for ticket in tickets]},
+                    status=status.HTTP_201_CREATED)
@@ -0,0 +1,29 @@
+"""Signals sent by django_taskflow"""
+
+
+from django.db import transaction
+from django.dispatch import Signal
+
+
+# Sent, once the current transaction commits, when a ticket that was waiting can make
+# progress again. Arguments: ticket_id
+ticket_runnable = Signal()
+
+
+def send_ticket_runnable(sender, ticket_id):
+    """Send ticket_runnable for a ticket after the current transaction commits"""
+    transaction.on_commit(lambda: ticket_runnable.send(sender=sender,
+                                                       ticket_id=ticket_id))
+
+
+# Sent after an element has processed a task. Arguments: element, task, status (of the task
+# before processing), new_task (None if there was no progress), seconds, queries, query_seconds
+operation_measured = Signal()
+
+# Sent after tasks have been written. Arguments: task (None for a bulk write), count,
+# seconds, queries, query_seconds
+persistence_measured = Signal()
+
+# Sent after an operation has followed a link. Arguments: element, slug_name, seconds,
+# queries, query_seconds
+link_measured = Signal()
@@ -0,0 +1,409 @@
+"""Simulation of workflows without a database, for capacity planning
+
+A workflow definition is loaded once into plain objects, and synthetic tickets
+are then pushed through it entirely in memory by a discrete event simulation.
+Tasks are dispatched on their status exactly as OpBase does, but to stand-in
+operations ("stubs") rather than the real ones, so that nothing is written and
+external systems are not called. Each element serves a limited number of tasks
+at once, taking a simulated time for each step, and tasks waiting on an external
+task are resumed after a simulated delay.
+
+The report gives the throughput of the workflow, and for each element its
+utilisation, queueing, and average occupancy: the number of tickets at the
+element at any moment, whether queued, being served or waiting. The elements
+where tickets accumulate are the bottlenecks.
+"""
+
+
+import heapq
+import random
+from collections import deque
+
+from .benchmark import percentile
+from .graph import compiled_workflow
+from .models import Workflow, TaskStatus
+from .operations import OpBase, Init, Script, ExternalTaskBase
+from .registry import operation_registry
+
+
+FINAL_STATUSES = (TaskStatus.FINISHED,
+                  TaskStatus.TERMINATED,
+                  )
+
+
+class SimElement:
+    __slots__ = ('pk', 'slug_name', 'operation', 'op_params', 'is_initial', 'links')
+
+    def __init__(self, pk, slug_name, operation, op_params, is_initial):
+        self.pk = pk
+        self.slug_name = slug_name
+        self.operation = operation
+        self.op_params = op_params
+        self.is_initial = is_initial
+        self.links = {}
+
+    def __repr__(self):
+        return f"<SimElement {self.slug_name}>"
+
+
+class SimWorkflow:
+    """The elements and links of a workflow, as plain objects"""
+
+    __slots__ = ('slug', 'elements', 'initial')
+
+    def __init__(self, slug, elements):
+        self.slug = slug
+        self.elements = {element.slug_name: element for element in elements}
+        initial = [element for element in elements if element.is_initial]
+        self.initial = initial[0] if initial else None
+
+    @classmethod
+    def from_compiled(cls, graph):
+        """Copy a compiled workflow graph"""
+        elements = {pk: SimElement(pk, element.slug_name, graph.operations[element.operation_id],
+                                   dict(element.op_params or {}), element.is_initial)
+                    for pk, element in graph.elements.items()}
+        for source, targets in graph.links.items():
+            elements[source].links = {slug_name: elements[target.pk] for slug_name, target in targets.items()}
+        return cls(graph.workflow.slug, list(elements.values()))
+
+    @classmethod
+    def load(cls, slug):
+        """Load the workflow with a slug; the only database access made by a simulation"""
+        return cls.from_compiled(compiled_workflow(Workflow.objects.get(slug=slug).pk))
+
+
+class SimTask:
+    __slots__ = ('ticket', 'element', 'status', 'state')
+
+    Status = TaskStatus
+
+    def __init__(self, ticket, element, status, state):
+        self.ticket = ticket
+        self.element = element
+        self.status = status
+        self.state = state
+
+    def clone_task(self, context=None):
+        # As Task.clone_task, the clone is a new task
+        return SimTask(self.ticket, self.element, TaskStatus.NEW, self.state)
+
+
+class SimTicket:
+    __slots__ = ('id', 'task', 'arrived', 'steps', 'enqueued')
+
+    def __init__(self, id, task, arrived):
+        self.id = id
+        self.task = task
+        self.arrived = arrived
+        self.steps = 0
+        self.enqueued = arrived
+
+
+class SimOperation:
+    """Stand-in for an operation, dispatched on the status of the task as OpBase does.
+
+    Methods take the task, the element and the simulation, and return a new task or None.
+    By default new and updated tasks complete, and completed tasks move to the next element.
+    """
+
+    operation_for = OpBase.operation_for
+
+    def __call__(self, incoming_task, element, simulation):
+        return self.operation_for(incoming_task)(incoming_task, element, simulation)
+
+    def default_operation(self, incoming_task, element, simulation):
+        if incoming_task.status in (TaskStatus.NEW, TaskStatus.UPDATED):
+            task = incoming_task.clone_task()
+            task.status = TaskStatus.COMPLETED
+            return task
+        return None
+
+    def operate_Error(self, incoming_task, element, simulation):
+        return None
+
+    def operate_Completed(self, incoming_task, element, simulation):
+        return simulation.move_to_next(element, 'next', incoming_task)
+
+
+class InitStub(SimOperation):
+
+    def operate_New(self, incoming_task, element, simulation):
+        incoming_task.state = dict(incoming_task.state, **element.op_params)
+        incoming_task.status = TaskStatus.COMPLETED
+        return incoming_task
+
+    def default_operation(self, incoming_task, element, simulation):
+        incoming_task.status = TaskStatus.COMPLETED
+        return incoming_task
+
+
+class ScriptStub(SimOperation):
+    """Completes without running the script; the state is passed on unchanged"""
+
+    def default_operation(self, incoming_task, element, simulation):
+        task = incoming_task.clone_task()
+        task.status = TaskStatus.COMPLETED
+        return task
+
+    def operate_Waiting(self, incoming_task, element, simulation):
+        return None
+
+
+class ExternalTaskStub(SimOperation):
+    """Waits for the external task, which the simulation resolves after the external latency"""
+
+    def default_operation(self, incoming_task, element, simulation):
+        return None
+
+    def operate_New(self, incoming_task, element, simulation):
+        task = incoming_task.clone_task()
+        task.status = TaskStatus.WAITING
+        simulation.resolve_later(task)
+        return task
+
+    def operate_Updated(self, incoming_task, element, simulation):
+        task = incoming_task.clone_task()
+        task.status = TaskStatus.COMPLETED
+        return task
+
+    def operate_Completed(self, incoming_task, element, simulation):
+        return None
+
+
+def default_stub(operation):
+    """Stub for an operation, by the kind of its standard implementation"""
+    obj = operation_registry.resolve(operation)
+    if isinstance(obj, type):
+        for base, stub in [(Init, InitStub),
+                           (Script, ScriptStub),
+                           (ExternalTaskBase, ExternalTaskStub)]:
+            if issubclass(obj, base):
+                return stub()
+    return SimOperation()
+
+
+def sampler(value):
+    """Return a function of a random generator giving a duration: from a number, a callable, or None for 0"""
+    if value is None:
+        return lambda rng: 0.0
+    if callable(value):
+        return value
+    return lambda rng: float(value)
+
+
+def exponential(mean):
+    """Durations exponentially distributed about a mean, as for independent arrivals"""
+    return lambda rng: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+
+
+class ElementStats:
+    __slots__ = ('steps', 'busy', 'waited', 'max_wait', 'max_queue', 'present', 'area', 'changed')
+
+    def __init__(self):
+        self.steps = 0
+        self.busy = 0.0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self.max_queue = 0
+        self.present = 0
+        self.area = 0.0
+        self.changed = 0.0
+
+    def occupy(self, now, change):
+        self.area += self.present * (now - self.changed)
+        self.changed = now
+        self.present += change
+
+
+class Simulation:
+    """Push synthetic tickets through a workflow in simulated time.
+
+    stubs, latency, capacity and external_latency are mappings keyed by element slug or
+    operation function, with the key '*' for elements not otherwise listed.
+    latency is the time taken by each step at an element and external_latency the time
+    before an external task waiting at an element is resolved, each given as a number
+    of seconds or a function of a random.Random, such as exponential(mean). capacity is
+    the number of tasks an element serves at once; None for no limit.
+    """
+
+    def __init__(self, workflow, stubs=None, latency=None, capacity=None, external_latency=None,
+                 seed=None, max_steps=1000):
+        self.workflow = workflow
+        if workflow.initial is None:
+            raise ValueError(f"No initial element for workflow {workflow.slug}")
+        self.rng = random.Random(seed)
+        self.max_steps = max_steps
+
+        def lookup(mapping, element, default=None):
+            mapping = mapping or {}
+            return mapping.get(element.slug_name, mapping.get(element.operation, mapping.get('*', default)))
+
+        self.stubs = {}
+        self.latency = {}
+        self.external_latency = {}
+        self.capacity = {}
+        for slug, element in workflow.elements.items():
+            self.stubs[slug] = lookup(stubs, element) or default_stub(element.operation)
+            self.latency[slug] = sampler(lookup(latency, element))
+            self.external_latency[slug] = sampler(lookup(external_latency, element))
+            self.capacity[slug] = lookup(capacity, element)
+
+    def move_to_next(self, element, slug_name, incoming_task):
+        """As OpBase.move_to_next"""
+        if not element.links:
+            return None
+        task = incoming_task.clone_task()
+        target = element.links.get(slug_name)
+        if target is not None and target is not task.element:
+            task.element = target
+        return task
+
+    def resolve_later(self, task):
+        """Have the external task that a task waits on resolved after the external latency"""
+        delay = self.external_latency[task.element.slug_name](self.rng)
+        self._schedule(self.now + delay, 'resolve', task)
+
+    def _schedule(self, at, action, subject):
+        self._sequence += 1
+        heapq.heappush(self._events, (at, self._sequence, action, subject))
+
+    def run(self, tickets, arrival_rate=None, state=None):
+        """Run a number of tickets, arriving at arrival_rate per second, or all at once. Returns the report."""
+        self.now = 0.0
+        self._events = []
+        self._sequence = 0
+        self.stats = {slug: ElementStats() for slug in self.workflow.elements}
+        self.busy = {slug: 0 for slug in self.workflow.elements}
+        self.queues = {slug: deque() for slug in self.workflow.elements}
+        self.outcomes = {'finished': 0, 'terminated': 0, 'stalled': 0}
+        self.ticket_times = []
+
+        arrivals = exponential(1.0 / arrival_rate) if arrival_rate else sampler(0)
+        created = 0
+        if tickets:
+            self._schedule(0.0, 'arrive', None)
+
+        while self._events:
+            self.now, sequence, action, subject = heapq.heappop(self._events)
+            if action == 'arrive':
+                created += 1
+                ticket = SimTicket(created, None, self.now)
+                ticket.task = SimTask(ticket, self.workflow.initial, TaskStatus.NEW, dict(state or {}))
+                self.stats[ticket.task.element.slug_name].occupy(self.now, 1)
+                self._enqueue(ticket)
+                if created < tickets:
+                    self._schedule(self.now + arrivals(self.rng), 'arrive', None)
+            elif action == 'done':
+                self._step(subject)
+            elif action == 'resolve' and subject.ticket.task is subject:
+                # The ticket is still waiting on this external task
+                task = subject.clone_task()
+                task.status = TaskStatus.UPDATED
+                subject.ticket.task = task
+                self._enqueue(subject.ticket)
+
+        return self.report(created)
+
+    def _enqueue(self, ticket):
+        slug = ticket.task.element.slug_name
+        ticket.enqueued = self.now
+        capacity = self.capacity[slug]
+        if capacity is None or self.busy[slug] < capacity:
+            self._serve(ticket)
+        else:
+            self.queues[slug].append(ticket)
+            stats = self.stats[slug]
+            stats.max_queue = max(stats.max_queue, len(self.queues[slug]))
+
+    def _serve(self, ticket):
+        slug = ticket.task.element.slug_name
+        stats = self.stats[slug]
+        wait = self.now - ticket.enqueued
+        stats.waited += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        stats.steps += 1
+        duration = self.latency[slug](self.rng)
+        stats.busy += duration
+        self.busy[slug] += 1
+        self._schedule(self.now + duration, 'done', ticket)
+
+    def _step(self, ticket):
+        task = ticket.task
+        element = task.element
+        self.busy[element.slug_name] -= 1
+        if self.queues[element.slug_name]:
+            self._serve(self.queues[element.slug_name].popleft())
+
+        status = task.status
+        try:
+            new_task = self.stubs[element.slug_name](task, element, self)
+        except Exception as e:
+            new_task = task.clone_task()
+            new_task.status = TaskStatus.ERROR
+            new_task.state = {'state': task.state,
+                              'error': str(e)}
+        if new_task is None and status in (TaskStatus.COMPLETED, TaskStatus.ERROR):
+            # As Element.settle_task
+            new_task = task.clone_task()
+            new_task.status = TaskStatus.FINISHED if status == TaskStatus.COMPLETED else TaskStatus.TERMINATED
+
+        ticket.steps += 1
+        if new_task is None or ticket.steps >= self.max_steps:
+            if task.status != TaskStatus.WAITING:
+                self._leave(ticket, element, 'stalled')
+            return
+
+        ticket.task = new_task
+        if new_task.element is not element:
+            self.stats[element.slug_name].occupy(self.now, -1)
+            self.stats[new_task.element.slug_name].occupy(self.now, 1)
+
+        if new_task.status in FINAL_STATUSES:
+            self._leave(ticket, new_task.element,
+                        'finished' if new_task.status == TaskStatus.FINISHED else 'terminated')
+        elif new_task.status != TaskStatus.WAITING:
+            # A waiting task makes no progress until its external task is resolved
+            self._enqueue(ticket)
+
+    def _leave(self, ticket, element, outcome):
+        self.stats[element.slug_name].occupy(self.now, -1)
+        ticket.task = None
+        self.outcomes[outcome] += 1
+        if outcome != 'stalled':
+            self.ticket_times.append(self.now - ticket.arrived)
+
+    def report(self, created):
+        duration = self.now
+        elements = {}
+        for slug, stats in self.stats.items():
+            stats.occupy(duration, 0)
+            capacity = self.capacity[slug]
+            elements[slug] = {'steps': stats.steps,
+                              'busy_seconds': stats.busy,
+                              'utilisation': stats.busy / (capacity * duration) if capacity and duration else None,
+                              'mean_wait': stats.waited / stats.steps if stats.steps else 0.0,
+                              'max_wait': stats.max_wait,
+                              'max_queue': stats.max_queue,
+                              'mean_occupancy': stats.area / duration if duration else 0.0,
+                              }
+
+        bottlenecks = sorted((slug for slug in elements if elements[slug]['mean_occupancy'] > 0),
+                             key=lambda slug: (elements[slug]['mean_occupancy'], elements[slug]['utilisation'] or 0),
+                             reverse=True)
+        completed = self.outcomes['finished'] + self.outcomes['terminated']
+        return {'workflow': self.workflow.slug,
+                'tickets': created,
+                **self.outcomes,
+                'duration': duration,
+                'throughput': completed / duration if duration else None,
+                'ticket_seconds_p50': percentile(self.ticket_times, 0.5),
+                'ticket_seconds_p99': percentile(self.ticket_times, 0.99),
+                'elements': elements,
+                'bottlenecks': bottlenecks,
+                }
+
+
+def simulate(slug, tickets, arrival_rate=None, **options):
+    """Load a workflow and simulate a number of tickets through it. See Simulation for the options."""
+    return Simulation(SimWorkflow.load(slug), **options).run(tickets, arrival_rate)
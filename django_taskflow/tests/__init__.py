@@ -3,3 +3,20 @@ from .test_models import *
 from .test_misc import *
 from .test_operation import *
 from .test_run_workflow import *
+from .test_graph import *
+from .test_registry import *
+from .test_worker import *
+from .test_engine import *
+from .test_async import *
+from .test_executors import *
+from .test_wakeup import *
+from .test_notify import *
+from .test_state_delta import *
+from .test_archive import *
+from .test_query_plans import *
+from .test_benchmark import *
+from .test_metrics import *
+from .test_events import *
+from .test_export import *
+from .test_simulation import *
+from .test_memo import *
@@ -0,0 +1,135 @@
+import pytest
+
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.test import override_settings
+from django.utils.timezone import now
+
+from django_taskflow.archive import archive_tickets
+from django_taskflow.models import Workflow, Ticket, Step, Task, OperatorTask, ArchivedTicket
+
+
+def _tickets(user, count):
+    context = {'user': user,
+               }
+    finished = []
+    for _ in range(count):
+        ticket = Workflow.objects.get(slug='multistep').create_ticket(context)
+        ticket.run_workflow(context)
+        for op_task in OperatorTask.objects.filter(step__ticket=ticket):
+            op_task.progress_task()
+        ticket.run_workflow(context)
+        finished.append(ticket)
+
+    waiting = Workflow.objects.get(slug='multistep').create_ticket(context)
+    waiting.run_workflow(context)
+    return finished, waiting
+
+
+@pytest.fixture
+def locked_tickets(monkeypatch):
+    """Skip the tickets whose ids are added to the returned set, as skip_locked does for
+    tickets locked by another transaction on databases that support it.
+    """
+    locked = set()
+    select_for_update = QuerySet.select_for_update
+
+    def skip_locked(self, *args, **kwargs):
+        queryset = select_for_update(self, *args, **kwargs)
+        if kwargs.get('skip_locked') and self.model is Ticket:
+            queryset = queryset.exclude(pk__in=locked)
+        return queryset
+
+    monkeypatch.setattr(QuerySet, 'select_for_update', skip_locked)
+    return locked
+
+
+@pytest.mark.django_db
+@override_settings(TASKFLOW_STATE_STORAGE='delta', TASKFLOW_STATE_SNAPSHOT_INTERVAL=3)
+def test_archive_tickets(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    finished, waiting = _tickets(user, 3)
+
+    expected = {}
+    for ticket in finished:
+        ticket.refresh_from_db()
+        assert ticket.status == Task.Status.FINISHED
+        expected[ticket.pk] = [task.state for task in Task.objects.filter(step__ticket=ticket).order_by('creation', 'pk')]
+
+    # Nothing has finished before the cutoff yet
+    assert list(archive_tickets(now() - timedelta(days=1))) == []
+
+    chunks = list(archive_tickets(now() + timedelta(seconds=1), chunk_size=2))
+    assert chunks == [[finished[0].pk, finished[1].pk], [finished[2].pk]]
+
+    assert list(Ticket.objects.all()) == [waiting]
+    assert not Step.objects.exclude(ticket=waiting).exists()
+    assert not Task.objects.exclude(step__ticket=waiting).exists()
+    assert not OperatorTask.objects.exclude(step__ticket=waiting).exists()
+
+    for archived in ArchivedTicket.objects.all():
+        assert archived.status == Task.Status.FINISHED
+        assert [s['element'] for s in archived.history] == ['start', 'script-one', 'et-one', 'et-one', 'et-one'][:len(archived.history)]
+        states = [t['state'] for s in archived.history for t in s['tasks']]
+        assert states == expected[archived.ticket_id]
+        assert sum(len(s['operator_tasks']) for s in archived.history) == 1
+
+
+@pytest.mark.django_db
+def test_archive_command(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    finished, waiting = _tickets(user, 3)
+    Task.objects.update(creation=F('creation') - timedelta(days=10))
+
+    call_command('taskflow_archive', '--older-than', '5', '--delete', '--chunk-size', '1', '--max-chunks', '2')
+    assert Ticket.objects.count() == 2
+    call_command('taskflow_archive', '--older-than', '5', '--delete', '--after-id', str(finished[1].pk))
+    assert list(Ticket.objects.all()) == [waiting]
+    assert not ArchivedTicket.objects.exists()
+
+
+@pytest.mark.django_db
+def test_archive_locked_tickets(django_user_model, locked_tickets):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    finished, waiting = _tickets(user, 3)
+    cutoff = now() + timedelta(seconds=1)
+
+    locked_tickets.update([finished[0].pk, finished[1].pk])
+    skipped = []
+    chunks = archive_tickets(cutoff, chunk_size=1, skipped=skipped)
+    assert next(chunks) == [finished[2].pk]
+    assert skipped == [finished[0].pk, finished[1].pk]
+
+    # Skipped tickets are tried again at the end of the run, and those still locked reported
+    locked_tickets.discard(finished[0].pk)
+    assert list(chunks) == [[finished[0].pk]]
+    assert skipped == [finished[1].pk]
+    assert list(Ticket.objects.order_by('pk')) == [finished[1], waiting]
+
+
+@pytest.mark.django_db
+def test_archive_command_locked(django_user_model, locked_tickets):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    finished, waiting = _tickets(user, 3)
+    Task.objects.update(creation=F('creation') - timedelta(days=10))
+    locked_tickets.add(finished[0].pk)
+
+    out, err = StringIO(), StringIO()
+    call_command('taskflow_archive', '--older-than', '5', '--chunk-size', '1', '--max-chunks', '1',
+                 stdout=out, stderr=err)
+    assert f"resume with --after-id {finished[0].pk - 1}" in out.getvalue()
+    assert f"tickets locked by other transactions: {finished[0].pk};" in err.getvalue()
+    assert Ticket.objects.count() == 3
+
+    locked_tickets.clear()
+    call_command('taskflow_archive', '--older-than', '5', '--after-id', str(finished[0].pk - 1),
+                 stdout=out, stderr=err)
+    assert list(Ticket.objects.all()) == [waiting]
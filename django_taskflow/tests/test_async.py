@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+from django_taskflow.metrics import PrometheusCollector
+from django_taskflow.models import Workflow, Element, Link, Operation, Ticket, Step, Task
+from django_taskflow.operations import OpBase
+from django_taskflow.worker import AsyncTicketWorker
+
+
+class SlowExternalCall(OpBase):
+
+    async def operate_New(self, incoming_task, element, context):
+        await asyncio.sleep(element.op_params['delay'])
+        task = incoming_task.clone_task(context)
+        task.state = dict(incoming_task.state, called=True)
+        if incoming_task.state.get('unsaveable'):
+            task.state['called'] = object()
+        task.status = task.Status.COMPLETED
+        return task
+
+
+def _slow_workflow(delay):
+    wf = Workflow(name="Slow", slug="slow", description="")
+    wf.save()
+    start = Element(workflow=wf,
+                    operation=Operation.objects.get(slug='__init'),
+                    op_params={},
+                    slug_name="start",
+                    is_initial=True)
+    start.save()
+    op = Operation(name="Slow call",
+                   slug="slow-call",
+                   description="",
+                   function="django_taskflow.tests.test_async.SlowExternalCall")
+    op.save()
+    slow = Element(workflow=wf,
+                   operation=op,
+                   op_params={'delay': delay},
+                   slug_name="slow")
+    slow.save()
+    Link(source=start, target=slow, slug_name="next").save()
+    return wf
+
+
+@pytest.mark.django_db
+def test_async_operation_from_sync_engine(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    ticket = _slow_workflow(0).create_ticket(context)
+    task = ticket.run_workflow(context)
+
+    assert task.status == Task.Status.FINISHED
+    assert task.state['called']
+
+
+@pytest.mark.django_db
+def test_async_worker(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    wf = _slow_workflow(0.2)
+    tickets = [wf.create_ticket(context) for _ in range(10)]
+
+    worker = AsyncTicketWorker(concurrency=10, batch_size=10)
+    start = time.monotonic()
+    assert worker.process_batch() == 10
+    elapsed = time.monotonic() - start
+
+    assert worker.failures == []
+    # Sequential processing would take at least two seconds
+    assert elapsed < 1.5
+
+    for ticket in Ticket.objects.filter(pk__in=[t.pk for t in tickets]):
+        assert ticket.status == Task.Status.FINISHED
+        assert ticket.current_task.state['called']
+
+
+@pytest.mark.django_db
+def test_async_worker_graph_check(django_user_model, settings):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    settings.TASKFLOW_METRICS_COLLECTOR = 'django_taskflow.metrics.PrometheusCollector'
+    collector = PrometheusCollector()
+    collector.connect()
+    try:
+        wf = _slow_workflow(0)
+        ticket = wf.create_ticket(context)
+        # Graphs are checked against the database on every use, which must not happen
+        # on the event loop
+        settings.TASKFLOW_GRAPH_CHECK_INTERVAL = 0
+        worker = AsyncTicketWorker(batch_size=10)
+        assert worker.process_batch() == 1
+        assert worker.failures == []
+    finally:
+        collector.disconnect()
+    ticket.refresh_from_db()
+    assert ticket.status == Task.Status.FINISHED
+    assert 'taskflow_operation_seconds_count{workflow="slow",element="slow",operation="django_taskflow.tests.test_async.SlowExternalCall"} 2' in collector.render().splitlines()
+
+
+@pytest.mark.django_db
+def test_async_worker_failure(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    wf = _slow_workflow(0)
+    tickets = Ticket.create_many([(wf, {}), (wf, {'unsaveable': True}), (wf, {})], context)
+
+    worker = AsyncTicketWorker(batch_size=10)
+    assert worker.process_batch() == 3
+    assert [ticket_id for ticket_id, e in worker.failures] == [tickets[1].pk]
+
+    for ticket in Ticket.objects.filter(pk__in=[tickets[0].pk, tickets[2].pk]):
+        assert ticket.status == Task.Status.FINISHED
+
+    # Nothing of the failed run was written, and the ticket is not claimed again
+    failed = Ticket.objects.get(pk=tickets[1].pk)
+    assert failed.status == Task.Status.NEW
+    assert Step.objects.filter(ticket=failed).count() == 1
+    assert Task.objects.filter(step__ticket=failed).count() == 1
+    assert failed.last_check is not None
+    assert worker.process_batch() == 0
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from django_taskflow.benchmark import SCENARIOS, run_benchmarks, compare_results
+from django_taskflow.models import Workflow, Ticket
+
+
+@pytest.mark.django_db
+def test_run_benchmarks(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    workflows = Workflow.objects.count()
+
+    results = run_benchmarks(user, count=3)
+    assert set(results['scenarios']) == {f"{name}/{engine}" for name in SCENARIOS for engine in ['single', 'bulk']}
+
+    steps = {'simple-steps': 2, 'multistep': 5, 'deep': 42, 'wide': 6}
+    for scenario, measured in results['scenarios'].items():
+        name, engine = scenario.split('/')
+        assert measured['steps'] == 3 * steps[name]
+        assert measured['tickets_per_second'] > 0
+        assert measured['queries_per_step'] > 0
+        assert measured['peak_memory_kb'] > 0
+        assert (measured['step_p99_ms'] is not None) == (engine == 'single')
+        if engine == 'single':
+            assert measured['step_p99_ms'] >= measured['step_p50_ms']
+
+    # Everything created is removed
+    assert Workflow.objects.count() == workflows
+    assert not Ticket.objects.exists()
+
+    assert compare_results(results, results) == []
+    baseline = {'scenarios': {'deep/single': dict(results['scenarios']['deep/single'],
+                                                  tickets_per_second=results['scenarios']['deep/single']['tickets_per_second'] * 2,
+                                                  queries_per_step=results['scenarios']['deep/single']['queries_per_step'] * 1.1)}}
+    regressions = compare_results(results, baseline, threshold=0.2)
+    assert len(regressions) == 1
+    assert regressions[0].startswith('deep/single tickets_per_second')
+
+
+@pytest.mark.django_db
+def test_benchmark_command(tmp_path):
+    output = tmp_path / 'results.json'
+    call_command('taskflow_benchmark', '--scenario', 'simple-steps', '--engine', 'bulk', '--tickets', '2',
+                 '--output', str(output))
+    results = json.loads(output.read_text())
+    assert list(results['scenarios']) == ['simple-steps/bulk']
+
+    results['scenarios']['simple-steps/bulk']['queries_per_step'] /= 10
+    output.write_text(json.dumps(results))
+    with pytest.raises(CommandError):
+        call_command('taskflow_benchmark', '--scenario', 'simple-steps', '--engine', 'bulk', '--tickets', '2',
+                     '--baseline', str(output))
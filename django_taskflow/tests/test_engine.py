@@ -0,0 +1,275 @@
+import pytest
+
+from django.db import connection, models
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from django_taskflow.models import Workflow, Ticket, Task, OperatorTask, TicketTrace, Element, Operation, Link
+
+
+def _history(ticket):
+    return [(task.step.element.slug_name, task.status, task.state)
+            for task in Task.objects.filter(step__ticket=ticket).order_by('creation', 'pk')]
+
+
+@pytest.mark.django_db
+def test_run_workflow_many(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    for slug in ['simple-steps', 'multistep']:
+        wf = Workflow.objects.get(slug=slug)
+
+        single = wf.create_ticket(context)
+        single_task = single.run_workflow(context)
+
+        tickets = [wf.create_ticket(context) for _ in range(5)]
+        last_tasks = Ticket.run_workflow_many(Ticket.objects.filter(pk__in=[t.pk for t in tickets]).order_by('pk'),
+                                              context)
+        assert len(last_tasks) == 5
+
+        for ticket, last_task in zip(tickets, last_tasks):
+            ticket.refresh_from_db()
+            assert last_task.pk is not None
+            assert ticket.current_task == last_task
+            assert ticket.status == single_task.status
+            assert ticket.last_check >= last_task.creation
+            assert _history(ticket) == _history(single)
+
+        # A second pass makes no progress, as with run_workflow
+        assert Ticket.run_workflow_many(tickets, context) == [None] * 5
+
+    # Tickets waiting on operators continue once their operator task completes
+    for op_task in OperatorTask.objects.filter(step__ticket__in=tickets):
+        op_task.progress_task()
+    last_tasks = Ticket.run_workflow_many(tickets, context)
+    assert [t.status for t in last_tasks] == [Task.Status.FINISHED] * 5
+
+
+@pytest.fixture
+def returning_bulk_insert(monkeypatch):
+    """Take the bulk insert path, as on a database that returns the keys of inserted rows.
+
+    Each bulk_create inserts its rows one by one, bypassing Model.save as a bulk insert
+    would, and is recorded as (model name, number of rows).
+    """
+    inserts = []
+
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
+        objs = list(objs)
+        inserts.append((self.model.__name__, len(objs)))
+        for obj in objs:
+            models.Model.save_base(obj, force_insert=True)
+        return objs
+
+    monkeypatch.setattr(connection.features, 'can_return_rows_from_bulk_insert', True)
+    monkeypatch.setattr(QuerySet, 'bulk_create', bulk_create)
+    return inserts
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage', ['full', 'delta'])
+def test_run_workflow_many_bulk(django_user_model, settings, returning_bulk_insert, storage):
+    settings.TASKFLOW_STATE_STORAGE = storage
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = Workflow.objects.get(slug='multistep')
+    single = wf.create_ticket(context)
+    single.run_workflow(context)
+
+    tickets = [wf.create_ticket(context) for _ in range(5)]
+    Ticket.run_workflow_many(tickets, context)
+    for ticket in tickets:
+        assert _history(ticket) == _history(single)
+
+    task_inserts = [count for model, count in returning_bulk_insert if model == 'Task']
+    assert sum(task_inserts) == 5 * len(_history(single))
+    if storage == 'full':
+        # All the tasks at once, however long the chains of tasks
+        assert task_inserts == [5 * len(_history(single))]
+    else:
+        # Each task after the one it is stored as a patch against
+        assert len(task_inserts) == len(_history(single))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('bulk', [False, True])
+def test_batch_announcements(django_user_model, monkeypatch, request, bulk):
+    if bulk:
+        request.getfixturevalue('returning_bulk_insert')
+    announced = []
+    def send(sender, ticket_id):
+        announced.append(ticket_id)
+    monkeypatch.setattr('django_taskflow.models.send_ticket_runnable', send)
+    monkeypatch.setattr('django_taskflow.engine.send_ticket_runnable', send)
+
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = Workflow.objects.get(slug='multistep')
+
+    # Each new ticket is announced once, however its rows were inserted
+    tickets = Ticket.create_many([(wf, {}) for _ in range(3)], context, run=True)
+    assert sorted(announced) == sorted(t.pk for t in tickets)
+
+    # Running them in a batch announces none of the tasks it creates
+    announced.clear()
+    Ticket.run_workflow_many(tickets, context)
+    assert announced == []
+    assert not any(t.advancing for t in tickets)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage', ['full', 'delta'])
+def test_run_workflow_checkpoints(django_user_model, settings, storage):
+    settings.TASKFLOW_STATE_STORAGE = storage
+    settings.TASKFLOW_CHECKPOINT_TRACE = True
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    for slug in ['simple-steps', 'multistep']:
+        wf = Workflow.objects.get(slug=slug)
+        single = wf.create_ticket(context)
+        single_task = single.run_workflow(context)
+        history = _history(single)
+
+        ticket = wf.create_ticket(context)
+        last_task = ticket.run_workflow(context, checkpoints=True)
+        ticket.refresh_from_db()
+        assert ticket.current_task == last_task
+        assert (ticket.status, ticket.current_task.state) == (single_task.status, _history(single)[-1][2])
+
+        # Only the last task and those waiting or in error are written
+        checkpoints = _history(ticket)
+        assert checkpoints == [h for h in history[:-1] if h[1] in (Task.Status.WAITING, Task.Status.ERROR)] + history[-1:]
+        assert len(checkpoints) < len(history)
+
+        trace = TicketTrace.objects.get(ticket=ticket)
+        assert [(s['element'], s['status']) for s in trace.steps] == [h[:2] for h in history]
+
+    # Workflows can be run this way by default, and continue from their checkpoints
+    settings.TASKFLOW_CHECKPOINT_WORKFLOWS = ['multistep']
+    for op_task in OperatorTask.objects.filter(step__ticket=ticket):
+        op_task.progress_task()
+    ticket.run_workflow(context)
+    ticket.refresh_from_db()
+    assert ticket.status == Task.Status.FINISHED
+    assert TicketTrace.objects.filter(ticket=ticket).count() == 2
+
+
+@pytest.mark.django_db
+def test_advance_many(django_user_model, admin_client):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = Workflow.objects.get(slug='simple-steps')
+    single = wf.create_ticket(context)
+    single.run_workflow(context)
+
+    tickets = [wf.create_ticket(context) for _ in range(5)]
+    ids = [t.pk for t in tickets]
+    with CaptureQueriesContext(connection) as queries:
+        last_tasks = Ticket.advance_many(reversed(ids), context, per_transaction=2)
+    assert [t.step.ticket_id for t in last_tasks] == ids[::-1]
+    # One lock query for every two tickets
+    locks = [q for q in queries if q['sql'].startswith('SELECT') and '"django_taskflow_ticket"."id" IN' in q['sql']]
+    assert len(locks) == 3
+    for ticket in tickets:
+        ticket.refresh_from_db()
+        assert ticket.status == Task.Status.FINISHED
+        assert _history(ticket) == _history(single)
+    assert Ticket.advance_many(ids, context) == [None] * 5
+
+    # The admin actions lock and advance each ticket once
+    ticket = wf.create_ticket(context)
+    admin_client.post(reverse('admin:django_taskflow_ticket_changelist'),
+                      {'action': 'run_workflow_step', '_selected_action': [ticket.pk]})
+    assert Task.objects.filter(step__ticket=ticket).count() == 1
+    task = Task.objects.get(step__ticket=ticket)
+    admin_client.post(reverse('admin:django_taskflow_task_changelist'),
+                      {'action': 'run_task', '_selected_action': [task.pk]})
+    ticket.refresh_from_db()
+    assert ticket.status == Task.Status.FINISHED
+
+
+@pytest.mark.django_db
+def test_advance_many_failures(django_user_model, admin_client, monkeypatch):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = Workflow.objects.get(slug='simple-steps')
+    tickets = [wf.create_ticket(context) for _ in range(3)]
+    ids = [t.pk for t in tickets]
+
+    run_workflow = Ticket.run_workflow
+    def failing_run_workflow(self, context, **kwargs):
+        last_task = run_workflow(self, context, **kwargs)
+        if self.pk == ids[1]:
+            raise RuntimeError("Failed after writing tasks")
+        return last_task
+    monkeypatch.setattr(Ticket, 'run_workflow', failing_run_workflow)
+
+    # The failed ticket is rolled back alone, and the others in its transaction advance
+    failures = []
+    last_tasks = Ticket.advance_many(ids, context, per_transaction=3, failures=failures)
+    assert [ticket_id for ticket_id, e in failures] == [ids[1]]
+    assert last_tasks[1] is None
+    assert [t.step.ticket_id for t in last_tasks[::2]] == ids[::2]
+    assert not Task.objects.filter(step__ticket=ids[1]).exists()
+    assert Ticket.objects.get(pk=ids[2]).status == Task.Status.FINISHED
+
+    # The admin actions report the tickets that failed
+    resp = admin_client.post(reverse('admin:django_taskflow_ticket_changelist'),
+                             {'action': 'run_workflow', '_selected_action': ids}, follow=True)
+    assert [str(m) for m in resp.context['messages']] == [f"Failed to advance tickets {ids[1]}"]
+
+
+batch_calls = []
+
+
+def batch_script(element_parameters, source_data):
+    batch_calls.append(len(source_data))
+    if any(state.get('fail') for state in source_data):
+        raise RuntimeError("Batch failed")
+    return [dict(state, total=len(source_data)) for state in source_data]
+
+
+@pytest.mark.django_db
+def test_operate_batch(django_user_model, settings):
+    settings.TASKFLOW_OPERATION_BATCH_SIZE = 3
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    workflow = Workflow.objects.create(name="Batch", slug='batch')
+    start = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='__init'),
+                                   op_params={}, slug_name='start', is_initial=True)
+    script = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='script'),
+                                    op_params={'batch_script_name': 'django_taskflow.tests.test_engine.batch_script'},
+                                    slug_name='batch')
+    Link.objects.create(source=start, target=script, slug_name='next')
+
+    batch_calls.clear()
+    tickets = [workflow.create_ticket(context) for _ in range(5)]
+    last_tasks = Ticket.run_workflow_many(tickets, context)
+    # The five tickets waiting at the script are passed to it three at a time
+    assert batch_calls == [3, 2]
+    assert [t.status for t in last_tasks] == [Task.Status.FINISHED] * 5
+    assert [t.state['total'] for t in last_tasks] == [3, 3, 3, 2, 2]
+
+    # A failing batch puts every ticket in it into error
+    batch_calls.clear()
+    tickets = Ticket.create_many([(workflow, {'fail': i == 1}) for i in range(2)], context)
+    last_tasks = Ticket.run_workflow_many(tickets, context)
+    assert batch_calls == [2]
+    assert [t.status for t in last_tasks] == [Task.Status.TERMINATED] * 2
@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+
+from django.test import override_settings
+
+from django_taskflow import events
+from django_taskflow.models import Workflow
+
+
+@pytest.mark.django_db
+def test_step_events(django_user_model, caplog):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    ticket = Workflow.objects.get(slug='multistep').create_ticket(context)
+    with caplog.at_level(logging.INFO, logger='django_taskflow.events'):
+        ticket.run_workflow(context)
+
+    logged = [record.taskflow_event for record in caplog.records if record.name == 'django_taskflow.events']
+    assert [(e['element'], e['from_status'], e['to_status']) for e in logged] == [
+        ('start', 'New', 'Completed'),
+        ('start', 'Completed', 'New'),
+        ('script-one', 'New', 'Completed'),
+        ('script-one', 'Completed', 'New'),
+        ('et-one', 'New', 'Waiting'),
+        ('et-one', 'Waiting', None),
+        ]
+    assert all(e['ticket'] == ticket.pk and e['duration'] >= 0 for e in logged)
+
+
+@pytest.mark.django_db
+def test_trace_sampling(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = Workflow.objects.get(slug='simple-steps')
+
+    events.trace_buffer.clear()
+    try:
+        wf.create_ticket(context).run_workflow(context)
+        assert events.trace_buffer.events() == []
+
+        with override_settings(TASKFLOW_TRACE_SAMPLE_RATE=1.0, TASKFLOW_TRACE_BUFFER_SIZE=3):
+            tickets = [wf.create_ticket(context) for _ in range(2)]
+            for ticket in tickets:
+                ticket.run_workflow(context)
+
+            traced = events.trace_buffer.events()
+            assert len(traced) == 3
+            assert [e['ticket'] for e in traced] == [tickets[0].pk, tickets[1].pk, tickets[1].pk]
+            assert events.trace_buffer.events(tickets[1].pk)[0]['state'] == {'fred': 'jim'}
+    finally:
+        events.trace_buffer.clear()
+
+    with override_settings(TASKFLOW_TRACE_SAMPLE_RATE=0.25):
+        fraction = sum(events.sampled(ticket_id) for ticket_id in range(1, 10001)) / 10000
+    assert 0.2 < fraction < 0.3
@@ -0,0 +1,96 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from django.utils.timezone import now
+
+from django_taskflow import executors
+from django_taskflow.models import Workflow, Element, Link, Operation, Task, ScriptRun
+from django_taskflow.worker import TicketWorker
+
+
+def double_values(element_parameters, source_data):
+    return {k: v * 2 for k, v in source_data.items()}
+
+
+def slow_double_values(element_parameters, source_data):
+    time.sleep(3)
+    return double_values(element_parameters, source_data)
+
+
+def _pooled_workflow(script_name):
+    wf = Workflow(name="Pooled", slug="pooled", description="")
+    wf.save()
+    start = Element(workflow=wf,
+                    operation=Operation.objects.get(slug='__init'),
+                    op_params={'x': 1, 'y': 2},
+                    slug_name="start",
+                    is_initial=True)
+    start.save()
+    script = Element(workflow=wf,
+                     operation=Operation.objects.get(slug='script'),
+                     op_params={'script_name': script_name,
+                                'executor': 'process'},
+                     slug_name="pooled-script")
+    script.save()
+    Link(source=start, target=script, slug_name="next").save()
+    return wf
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_process_executor(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = _pooled_workflow('django_taskflow.tests.test_executors.double_values')
+
+    # Reached outside of a worker, as from the admin or a web request
+    ticket = wf.create_ticket(context)
+    ticket.run_workflow(context)
+    ticket.refresh_from_db()
+    assert ticket.status == Task.Status.WAITING
+    assert ScriptRun.objects.get().claimed is None
+
+    # Claimed by a worker that has since stopped
+    abandoned = wf.create_ticket(context)
+    abandoned.run_workflow(context)
+    ScriptRun.objects.filter(step__ticket=abandoned).update(claimed=now() - timedelta(hours=1))
+
+    worker = TicketWorker(user=user)
+    try:
+        worker.process_batch()
+        assert executors.pending_count() == 2
+        assert not ScriptRun.objects.filter(claimed__lt=now() - timedelta(minutes=1)).exists()
+
+        deadline = time.monotonic() + 60
+        while ScriptRun.objects.exists() and time.monotonic() < deadline:
+            executors.wait_for_results(timeout=1)
+            worker.process_batch()
+    finally:
+        executors.shutdown()
+
+    assert worker.failures == []
+    for t in (ticket, abandoned):
+        t.refresh_from_db()
+        assert t.status == Task.Status.FINISHED
+        assert t.current_task.state == {'x': 2, 'y': 4}
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_worker_releases_runs(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    wf = _pooled_workflow('django_taskflow.tests.test_executors.slow_double_values')
+    wf.create_ticket(context).run_workflow(context)
+
+    worker = TicketWorker(user=user, poll_interval=0.1)
+    worker.run(max_batches=1)
+
+    # The pool stops with the worker, and the run it still held is left for another
+    assert executors.pending_count() == 0
+    assert executors._pool is None
+    assert ScriptRun.objects.get().claimed is None
@@ -0,0 +1,75 @@
+import io
+import json
+
+import pytest
+
+from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.urls import reverse
+
+from django_taskflow.export import export_tickets
+from django_taskflow.models import Workflow, Task
+
+
+def _run_tickets(user, slug, count):
+    context = {'user': user,
+               }
+    tickets = []
+    for _ in range(count):
+        ticket = Workflow.objects.get(slug=slug).create_ticket(context)
+        ticket.run_workflow(context)
+        tickets.append(ticket)
+    return tickets
+
+
+@pytest.mark.django_db
+def test_export_tickets(django_user_model, django_assert_max_num_queries):
+    user = django_user_model.objects.create(username="fred")
+    simple = _run_tickets(user, 'simple-steps', 3)
+    multi = _run_tickets(user, 'multistep', 2)
+
+    # Queries per chunk, not per ticket
+    with django_assert_max_num_queries(2 * 4):
+        records = list(export_tickets(chunk_size=3))
+    assert [r['id'] for r in records] == [t.pk for t in simple + multi]
+
+    record = records[0]
+    assert record['workflow'] == 'simple-steps'
+    assert record['status'] == Task.Status.FINISHED
+    tasks = [task for step in record['steps'] for task in step['tasks']]
+    assert len(tasks) == 2
+    assert tasks[-1]['state'] == {'fred': 'jim'}
+
+    assert [r['id'] for r in export_tickets(workflow='multistep')] == [t.pk for t in multi]
+    assert [r['id'] for r in export_tickets(status=Task.Status.FINISHED)] == [t.pk for t in simple]
+    assert [r['id'] for r in export_tickets(after_id=simple[1].pk)] == [t.pk for t in simple[2:] + multi]
+
+
+@pytest.mark.django_db
+def test_export_view(client, django_user_model):
+    user = django_user_model.objects.create(username="fred")
+    tickets = _run_tickets(user, 'simple-steps', 2)
+
+    client.force_login(user)
+    assert client.get(reverse('taskflow:export')).status_code == 403
+
+    user.user_permissions.add(Permission.objects.get(codename='view_ticket'))
+    resp = client.get(reverse('taskflow:export'), {'workflow': 'simple-steps',
+                                                   'after': tickets[0].pk})
+    assert resp.status_code == 200
+    assert resp['Content-Type'] == 'application/x-ndjson'
+    lines = b''.join(resp.streaming_content).decode().splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [tickets[1].pk]
+
+    assert client.get(reverse('taskflow:export'), {'since': 'never'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_export_command(django_user_model):
+    user = django_user_model.objects.create(username="fred")
+    tickets = _run_tickets(user, 'simple-steps', 3)
+
+    out, err = io.StringIO(), io.StringIO()
+    call_command('taskflow_export', '--after-id', str(tickets[0].pk), stdout=out, stderr=err)
+    assert [json.loads(line)['id'] for line in out.getvalue().splitlines()] == [t.pk for t in tickets[1:]]
+    assert f"up to id {tickets[-1].pk}" in err.getvalue()
@@ -0,0 +1,106 @@
+import pytest
+
+from django.utils.timezone import now
+
+from django_taskflow.graph import CompiledWorkflow, compiled_workflow, invalidate
+from django_taskflow.models import Workflow, Element, Operation, Task
+from django_taskflow.operations import Init, Script
+
+
+@pytest.mark.django_db
+def test_compiled_workflow():
+    wf = Workflow.objects.get(slug='multistep')
+    invalidate()
+
+    graph = compiled_workflow(wf.pk)
+    assert graph is compiled_workflow(wf.pk)
+
+    assert graph.initial.slug_name == 'start'
+    assert set(graph.elements_by_slug.keys()) == {'start', 'script-one', 'et-one'}
+
+    start = graph.elements_by_slug['start']
+    script_one = graph.elements_by_slug['script-one']
+    assert graph.links_from(start.pk)['next'] is script_one
+    assert len(graph.links_from(graph.elements_by_slug['et-one'].pk)) == 0
+
+    assert isinstance(graph.operation_callable(start.pk), Init)
+    assert isinstance(graph.operation_callable(script_one.pk), Script)
+
+    with pytest.raises(AttributeError):
+        graph.initial = None
+    with pytest.raises(TypeError):
+        graph.elements_by_slug['other'] = start
+
+
+@pytest.mark.django_db
+def test_compiled_workflow_invalidation():
+    wf = Workflow.objects.get(slug='simple-steps')
+    graph = compiled_workflow(wf.pk)
+
+    Element(workflow=wf,
+            operation=Operation.objects.get(slug='script'),
+            op_params={},
+            slug_name="added").save()
+
+    new_graph = compiled_workflow(wf.pk)
+    assert new_graph is not graph
+    assert 'added' in new_graph.elements_by_slug
+
+    Operation.objects.get(slug='script').save()
+    assert compiled_workflow(wf.pk) is not new_graph
+
+
+@pytest.mark.django_db
+def test_multistep_workflow(django_user_model):
+    wf = Workflow.objects.get(slug='multistep')
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    t = wf.create_ticket(context)
+    task = t.run_workflow(context)
+
+    assert task.status == Task.Status.WAITING
+    assert task.step.element.slug_name == 'et-one'
+    assert Task.objects.filter(step__ticket=t).count() == 5
+
+
+@pytest.mark.django_db
+def test_compiled_workflow_changed_elsewhere(settings):
+    wf = Workflow.objects.get(slug='simple-steps')
+    graph = compiled_workflow(wf.pk)
+
+    # A change saved by another process, which sends no signal here
+    Element.objects.filter(workflow=wf, is_initial=True).update(slug_name='renamed')
+    Workflow.objects.filter(pk=wf.pk).update(updated=now())
+    assert compiled_workflow(wf.pk) is graph
+
+    settings.TASKFLOW_GRAPH_CHECK_INTERVAL = 0
+    new_graph = compiled_workflow(wf.pk)
+    assert new_graph is not graph
+    assert new_graph.initial.slug_name == 'renamed'
+    # Unchanged since, so kept
+    assert compiled_workflow(wf.pk) is new_graph
+
+
+@pytest.mark.django_db
+def test_compilation_overlapping_invalidation(monkeypatch):
+    wf = Workflow.objects.get(slug='simple-steps')
+    invalidate()
+
+    compile = CompiledWorkflow.compile
+    compilations = []
+
+    def invalidated_during(workflow_id):
+        graph = compile(workflow_id)
+        compilations.append(graph)
+        if len(compilations) == 1:
+            invalidate(workflow_id)
+        return graph
+
+    monkeypatch.setattr(CompiledWorkflow, 'compile', invalidated_during)
+    graph = compiled_workflow(wf.pk)
+    # The first compilation may predate the change that was invalidated, so is not kept
+    assert graph is compilations[1]
+    assert compiled_workflow(wf.pk) is graph
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from django_taskflow import memo
+from django_taskflow.models import Workflow, Element, Operation, Link, Ticket, Task
+
+
+script_calls = []
+
+
+def counting_script(element_parameters, source_data):
+    script_calls.append(source_data)
+    return dict(source_data, doubled=source_data.get('value', 0) * 2)
+
+
+def _workflow():
+    workflow = Workflow.objects.create(name="Memo", slug='memo')
+    start = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='__init'),
+                                   op_params={}, slug_name='start', is_initial=True)
+    script = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='script'),
+                                    op_params={'script_name': 'django_taskflow.tests.test_memo.counting_script',
+                                               'memoise': True},
+                                    slug_name='double')
+    Link.objects.create(source=start, target=script, slug_name='next')
+    return workflow
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('shared', [None, 'default'])
+def test_memoised_script(django_user_model, settings, shared):
+    settings.TASKFLOW_MEMO_CACHE = shared
+    memo.reset()
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    workflow = _workflow()
+    script_calls.clear()
+
+    tickets = Ticket.create_many([(workflow, {'value': value}) for value in (1, 2, 1, 1)], context)
+    for ticket in tickets:
+        ticket.run_workflow(context)
+        ticket.refresh_from_db()
+        assert ticket.status == Task.Status.FINISHED
+    assert [t.current_task.state['doubled'] for t in tickets] == [2, 4, 2, 2]
+    # The script only ran for each distinct state
+    assert [call['value'] for call in script_calls] == [1, 2]
+    assert memo.result_cache().stats() == {'hit': 2, 'shared_hit': 0, 'miss': 2}
+
+    # Another process finds the results in the shared cache
+    memo.reset()
+    ticket = Ticket.create_many([(workflow, {'value': 2})], context)[0]
+    ticket.run_workflow(context)
+    assert len(script_calls) == (2 if shared else 3)
+    assert memo.result_cache().stats()['shared_hit'] == (1 if shared else 0)
+    memo.reset()
+
+
+def test_lru_cache(monkeypatch):
+    cache = memo.LRUCache(2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # b was the least recently used
+    assert cache.get('b') is memo.MISSING
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+    later = time.monotonic() + 11
+    monkeypatch.setattr(memo.time, 'monotonic', lambda: later)
+    assert cache.get('a') is memo.MISSING
+    assert len(cache) == 1
+
+    assert memo.stable_key({'a': 1, 'b': [1, 2]}) == memo.stable_key({'b': [1, 2], 'a': 1})
+    assert memo.stable_key({'a': 1}) != memo.stable_key({'a': 2})
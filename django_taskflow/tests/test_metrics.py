@@ -0,0 +1,72 @@
+import pytest
+
+from django.test import override_settings
+from django.urls import reverse
+
+from django_taskflow import metrics
+from django_taskflow.metrics import PrometheusCollector
+from django_taskflow.models import Workflow, Ticket
+from django_taskflow.signals import operation_measured
+
+
+@pytest.fixture
+def collector():
+    collector = PrometheusCollector()
+    collector.connect()
+    try:
+        yield collector
+    finally:
+        collector.disconnect()
+
+
+@pytest.mark.django_db
+def test_prometheus_collector(django_user_model, collector):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    wf = Workflow.objects.get(slug='multistep')
+    wf.create_ticket(context).run_workflow(context)
+    Ticket.run_workflow_many([wf.create_ticket(context) for _ in range(2)], context)
+
+    labels = 'workflow="multistep",element="script-one",operation="django_taskflow.operations.Script"'
+    text = collector.render()
+    lines = text.splitlines()
+
+    assert f'taskflow_operation_seconds_count{{{labels}}} 6' in lines
+    assert f'taskflow_operation_seconds_bucket{{{labels},le="+Inf"}} 6' in lines
+    assert f'taskflow_operation_queries_count{{{labels}}} 6' in lines
+    assert f'taskflow_state_bytes_count{{{labels}}} 6' in lines
+    assert 'taskflow_transitions_total{workflow="multistep",from_status="New",to_status="Waiting"} 3' in lines
+    # Bulk writes are only used where the database returns the new primary keys
+    assert any(line.startswith('taskflow_persisted_tasks_total{mode=') for line in lines)
+    assert 'taskflow_link_seconds_count{workflow="multistep",element="start",operation="django_taskflow.operations.Init",link="next"} 3' in lines
+    assert "# TYPE taskflow_operation_seconds histogram" in lines
+
+
+def test_measurement_needs_listener():
+    assert not operation_measured.has_listeners()
+
+
+@pytest.mark.django_db
+def test_metrics_view(client, admin_client, collector):
+    # Only users allowed to view tickets, or scrapers with the token, see the metrics
+    assert client.get(reverse('taskflow:metrics')).status_code == 403
+    resp = admin_client.get(reverse('taskflow:metrics'))
+    assert resp.status_code == 404
+
+    with override_settings(TASKFLOW_METRICS_COLLECTOR='django_taskflow.metrics.PrometheusCollector',
+                           TASKFLOW_METRICS_TOKEN='scraper-token'):
+        metrics._collector = collector
+        try:
+            resp = admin_client.get(reverse('taskflow:metrics'))
+            scraped = client.get(reverse('taskflow:metrics'), HTTP_AUTHORIZATION='Bearer scraper-token')
+            guessed = client.get(reverse('taskflow:metrics'), HTTP_AUTHORIZATION='Bearer other-token')
+        finally:
+            metrics._collector = None
+    assert resp.status_code == 200
+    assert resp['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert scraped.status_code == 200
+    assert scraped.content == resp.content
+    assert guessed.status_code == 403
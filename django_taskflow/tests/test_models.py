@@ -2,7 +2,7 @@ import pytest
 
 from datetime import datetime
 
-from django_taskflow.models import Workflow, Ticket, Task
+from django_taskflow.models import Workflow, Ticket, Task, OperatorTask
 
 
 @pytest.mark.django_db
@@ -36,3 +36,40 @@ def test_create_ticket(django_user_model):
 
     task_2 = t.run_workflow_step(context)
     assert task_2 is None
+
+
+@pytest.mark.django_db
+def test_ticket_current_task(django_user_model):
+    wf = Workflow.objects.get(slug='multistep')
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    t = wf.create_ticket(context)
+    assert t.current_task is None
+    assert t.status is None
+
+    task = t.run_workflow(context)
+    t.refresh_from_db()
+    assert t.current_task == task
+    assert t.status == Task.Status.WAITING
+
+    assert list(Task.latest_tasks()) == [task]
+    assert list(Task.latest_tasks(False)) == [task]
+
+    op_task = OperatorTask.objects.get(step=task.step)
+    op_task.progress_task()
+
+    t.refresh_from_db()
+    assert t.status == Task.Status.UPDATED
+    assert t.current_task.step == task.step
+
+    final_task = t.run_workflow(context)
+    t.refresh_from_db()
+    assert final_task.status == Task.Status.FINISHED
+    assert t.current_task == final_task
+    assert t.status == Task.Status.FINISHED
+
+    assert Task.latest_tasks().filter(step__ticket=t).count() == 0
+    assert list(Task.latest_tasks(False).filter(step__ticket=t)) == [final_task]
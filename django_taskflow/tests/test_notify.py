@@ -0,0 +1,69 @@
+import pytest
+
+from django.test import override_settings
+from django.urls import reverse
+
+from django_taskflow import notify
+from django_taskflow.models import Workflow, Ticket, Task, OperatorTask
+from django_taskflow.notify import InMemoryBackend
+from django_taskflow.worker import TicketWorker
+
+
+def test_in_memory_backend():
+    backend = InMemoryBackend()
+    assert backend.wait(0) == set()
+
+    backend.publish(3)
+    backend.publish(4)
+    backend.publish(3)
+    assert backend.wait(0) == {3, 4}
+    assert backend.wait(0.01) == set()
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_runnable_notifications(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    with override_settings(TASKFLOW_NOTIFY_BACKEND='django_taskflow.notify.InMemoryBackend'):
+        notify._backend = None
+        backend = notify.notification_backend()
+        try:
+            # New tickets are announced, however they are created
+            wf = Workflow.objects.get(slug='multistep')
+            created = Ticket.create_many([(wf, {})], context)[0]
+            assert backend.wait(0) == {created.pk}
+            ticket = wf.create_ticket(context)
+            assert backend.wait(0) == {ticket.pk}
+
+            # Tasks created by the worker as it advances the ticket are not announced
+            worker = TicketWorker(notifications=backend, poll_interval=0)
+            worker.run(max_batches=1)
+            assert backend.wait(0) == set()
+
+            OperatorTask.objects.get(step__ticket=ticket).progress_task()
+            assert backend.wait(0) == {ticket.pk}
+
+            worker.run(max_batches=1)
+            ticket.refresh_from_db()
+            assert ticket.status == Task.Status.FINISHED
+        finally:
+            notify._backend = None
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_start_ticket_notification(client, django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    client.force_login(user)
+
+    with override_settings(TASKFLOW_NOTIFY_BACKEND='django_taskflow.notify.InMemoryBackend'):
+        notify._backend = None
+        backend = notify.notification_backend()
+        try:
+            resp = client.get(reverse('taskflow:initiate_workflow', kwargs={'slug': 'multistep'}))
+            assert backend.wait(0) == {resp.json()['ticket']}
+        finally:
+            notify._backend = None
@@ -0,0 +1,99 @@
+"""Query plans of the engine's hot queries
+
+Each query is explained, with the planner's default settings, against a database
+holding many finished tickets and a few live ones, as a long-running installation
+does, and fails the test if it reads a whole table.
+
+The plans are only checked on PostgreSQL. SQLite keeps no statistics unless
+ANALYZE is run, and those it keeps only record the average number of rows per
+status, so its plans say nothing about the indexes' use on a skewed table.
+"""
+
+import pytest
+
+from django.db import connection
+from django.db.models import F, Max
+from django.utils.timezone import now
+
+from django_taskflow.archive import archivable_tickets
+from django_taskflow.models import Workflow, Ticket, Step, Task, OperatorTask
+from django_taskflow.worker import runnable_tickets
+
+
+FINISHED_TICKETS = 5000
+
+postgresql_only = pytest.mark.skipif(connection.vendor != 'postgresql',
+                                     reason="Query plans are only representative on PostgreSQL")
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def seed_finished(workflow, user, count):
+    """Add finished tickets, each with a step and a task, and refresh the planner's statistics"""
+    element = workflow.element_set.order_by('pk').first()
+    ticket_start, step_start, task_start = _next_id(Ticket), _next_id(Step), _next_id(Task)
+    Ticket.objects.bulk_create([Ticket(pk=ticket_start + i,
+                                       workflow=workflow,
+                                       creator=user,
+                                       status=Task.Status.FINISHED,
+                                       last_check=now())
+                                for i in range(count)])
+    Step.objects.bulk_create([Step(pk=step_start + i,
+                                   ticket_id=ticket_start + i,
+                                   element=element)
+                              for i in range(count)])
+    Task.objects.bulk_create([Task(pk=task_start + i,
+                                   step_id=step_start + i,
+                                   creator=user,
+                                   status=Task.Status.FINISHED,
+                                   state={})
+                              for i in range(count)])
+    Ticket.objects.filter(pk__gte=ticket_start).update(current_task=F('pk') - ticket_start + task_start)
+
+    # As autovacuum would have by now
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def full_scans(queryset):
+    """Return the lines of the plan of a queryset that read a whole table"""
+    plan = queryset.explain()
+    return [line for line in plan.splitlines() if 'Seq Scan' in line]
+
+
+@postgresql_only
+@pytest.mark.django_db
+def test_query_plans(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    wf = Workflow.objects.get(slug='multistep')
+    tickets = [wf.create_ticket(context) for _ in range(20)]
+    Ticket.run_workflow_many(tickets, context)
+    for op_task in OperatorTask.objects.filter(step__ticket__in=tickets[:10]):
+        op_task.progress_task()
+    Ticket.run_workflow_many(tickets[:10], context)
+    seed_finished(wf, user, FINISHED_TICKETS)
+
+    ticket = tickets[-1]
+    op_task = OperatorTask.objects.filter(step__ticket=ticket).first()
+
+    queries = {
+        # Ticket.pending_task
+        'pending_task': Task.objects.select_related('step').filter(ticket_current=ticket),
+        'check_completed_task': op_task.waiting_tasks(),
+        'latest_tasks': Task.latest_tasks(),
+        'runnable_tickets': runnable_tickets().order_by(F('last_check').asc(nulls_first=True), 'pk'),
+        'archivable_tickets': archivable_tickets(now()).filter(pk__gt=0).order_by('pk'),
+        'tasks_by_status': Task.objects.filter(status=Task.Status.WAITING).order_by('-creation'),
+        'open_operator_tasks': OperatorTask.objects.filter(operator=user, completed__isnull=True).order_by('created'),
+        'ticket_steps': Step.objects.filter(ticket=ticket).order_by('creation', 'pk'),
+        'ticket_tasks': Task.objects.filter(step__ticket=ticket).order_by('creation', 'pk'),
+    }
+
+    scans = {name: full_scans(queryset) for name, queryset in queries.items()}
+    assert {name: lines for name, lines in scans.items() if lines} == {}
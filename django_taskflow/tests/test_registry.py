@@ -0,0 +1,58 @@
+import pytest
+
+from django.core.exceptions import ValidationError
+from django.test import override_settings
+
+from django_taskflow.checks import check_operations
+from django_taskflow.models import Operation
+from django_taskflow.operations import OpBase, Script
+from django_taskflow.registry import OperationRegistry, operation_registry
+
+
+class StatefulOp(OpBase):
+    cache_instance = False
+
+
+def test_registry_caches_instances():
+    registry = OperationRegistry()
+
+    script = registry.callable_for('django_taskflow.operations.Script')
+    assert isinstance(script, Script)
+    assert registry.callable_for('django_taskflow.operations.Script') is script
+
+    name = 'django_taskflow.tests.test_registry.StatefulOp'
+    assert registry.callable_for(name) is not registry.callable_for(name)
+    assert registry.resolve(name) is StatefulOp
+
+
+def test_registry_declarations():
+    registry = OperationRegistry()
+
+    with override_settings(TASKFLOW_OPERATIONS={'my-script': 'django_taskflow.operations.Script',
+                                                'broken': 'django_taskflow.operations.NoSuchOperation'}):
+        registry.load_declarations()
+
+    assert isinstance(registry.callable_for('my-script'), Script)
+
+    failures = registry.warm(['not_a_dotted_name'])
+    assert set(failures.keys()) == {'broken', 'not_a_dotted_name'}
+
+
+def test_operation_checks():
+    assert check_operations(None) == []
+
+    operation_registry.declare('broken', 'django_taskflow.operations.NoSuchOperation')
+    try:
+        errors = check_operations(None)
+        assert [e.id for e in errors] == ['django_taskflow.E001']
+    finally:
+        operation_registry.undeclare('broken')
+
+
+def test_operation_clean():
+    op = Operation(name="name",
+                   slug="slug",
+                   description="desc",
+                   function="django_taskflow.tests.test_registry.missing_function")
+    with pytest.raises(ValidationError):
+        op.clean()
@@ -1,5 +1,7 @@
 import pytest
 
+from django_taskflow.models import Workflow, Task
+
 @pytest.mark.django_db
 def test_simple_workflow(django_user_model):
 
@@ -8,5 +10,9 @@ def test_simple_workflow(django_user_model):
     context = {'user': user,
                }
 
+    ticket = Workflow.objects.get(slug='simple-steps').create_ticket(context)
+    last_task = ticket.run_workflow(context)
 
-
+    assert last_task.status == Task.Status.FINISHED
+    assert last_task.state == {'fred': 'jim'}
+    assert ticket.run_workflow(context) is None
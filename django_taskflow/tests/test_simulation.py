@@ -0,0 +1,66 @@
+import io
+
+import pytest
+
+from django.core.management import call_command
+
+from django_taskflow.simulation import Simulation, SimWorkflow, SimOperation, simulate
+
+
+@pytest.mark.django_db
+def test_simulate_example_workflows(django_assert_num_queries):
+    workflow = SimWorkflow.load('multistep')
+
+    # Nothing touches the database once the workflow is loaded
+    with django_assert_num_queries(0):
+        report = Simulation(workflow,
+                            latency={'*': 0.01},
+                            external_latency={'et-one': 1.0},
+                            seed=1).run(100)
+    assert report['tickets'] == 100
+    assert report['finished'] == 100
+    # Every ticket takes seven steps, and waits a second on the external task at et-one
+    assert report['ticket_seconds_p50'] == pytest.approx(1.07)
+    assert report['bottlenecks'][0] == 'et-one'
+    # start takes two steps: initialising and moving on
+    assert report['elements']['start']['steps'] == 200
+    assert report['elements']['script-one']['steps'] == 200
+    assert report['elements']['et-one']['steps'] == 300
+
+    report = simulate('simple-steps', 10)
+    assert report['finished'] == 10
+    assert report['elements']['start']['steps'] == 20
+
+
+@pytest.mark.django_db
+def test_simulate_queueing():
+    workflow = SimWorkflow.load('multistep')
+
+    # script-one serves one task at a time, so tickets queue for it
+    report = Simulation(workflow,
+                        latency={'script-one': 0.1},
+                        capacity={'script-one': 1},
+                        seed=1).run(50, arrival_rate=5)
+    script = report['elements']['script-one']
+    assert report['bottlenecks'][0] == 'script-one'
+    assert script['utilisation'] > 0.9
+    assert script['max_queue'] > 1
+    assert script['mean_wait'] > 0
+
+    # Stubs replace the operations, and failures terminate the ticket
+    class Failing(SimOperation):
+        def operate_New(self, incoming_task, element, simulation):
+            raise RuntimeError("Unavailable")
+
+    report = Simulation(workflow, stubs={'et-one': Failing()}).run(5)
+    assert report['terminated'] == 5
+
+
+@pytest.mark.django_db
+def test_simulate_command():
+    out = io.StringIO()
+    call_command('taskflow_simulate', 'multistep', '--tickets', '20', '--latency', '*=exp:0.01',
+                 '--external-latency', 'et-one=2', '--capacity', 'script-one=2', '--seed', '3', stdout=out)
+    assert "20 tickets" in out.getvalue()
+    assert "20 finished" in out.getvalue()
+    assert out.getvalue().splitlines()[1].startswith("et-one")
@@ -0,0 +1,103 @@
+import pytest
+
+from django.test import override_settings
+
+from django_taskflow.jsonpatch import make_patch, apply_patch
+from django_taskflow.models import Workflow, Ticket, Task, OperatorTask
+
+
+def test_jsonpatch_round_trip():
+    pairs = [({}, {'a': 1}),
+             ({'a': 1, 'b': {'c': [1, 2]}}, {'b': {'c': [1, 2, 3], 'd/e': None}}),
+             ({'a': {'b': 1}}, {'a': 'replaced'}),
+             ({'a~b': 1}, {'a~b': 2}),
+             ({'a': 1}, [1, 2]),
+             ({'a': 1}, {'a': 1.0}),
+             ]
+    for source, target in pairs:
+        patch = make_patch(source, target)
+        assert apply_patch(source, patch) == target
+
+    source = {'a': {'b': 1}}
+    assert make_patch(source, {'a': {'b': 1}}) == []
+    apply_patch(source, make_patch(source, {'a': {'b': 2}}))
+    assert source == {'a': {'b': 1}}
+
+
+def _history(ticket):
+    return [(task.step.element.slug_name, task.status, task.state)
+            for task in Task.objects.filter(step__ticket=ticket).order_by('creation', 'pk')]
+
+
+@pytest.mark.django_db
+@override_settings(TASKFLOW_STATE_STORAGE='delta', TASKFLOW_STATE_SNAPSHOT_INTERVAL=3)
+def test_delta_state_storage(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    wf = Workflow.objects.get(slug='multistep')
+    with override_settings(TASKFLOW_STATE_STORAGE='full'):
+        full = wf.create_ticket(context)
+        full.run_workflow(context)
+
+    single = wf.create_ticket(context)
+    single.run_workflow(context)
+    tickets = [wf.create_ticket(context) for _ in range(3)]
+    Ticket.run_workflow_many(tickets, context)
+
+    for ticket in [single] + tickets:
+        assert _history(ticket) == _history(full)
+
+        rows = list(Task.objects.filter(step__ticket=ticket).order_by('creation', 'pk')
+                    .values('state', 'state_patch', 'state_depth'))
+        assert [row['state_depth'] for row in rows] == [0, 1, 2, 0, 1]
+        for row in rows:
+            assert (row['state'] is None) == (row['state_patch'] is not None)
+
+    # Operator completion and later progress are encoded against the waiting task
+    for op_task in OperatorTask.objects.filter(step__ticket__in=[single] + tickets):
+        op_task.progress_task()
+    single.run_workflow(context)
+    Ticket.run_workflow_many(tickets, context)
+
+    with override_settings(TASKFLOW_STATE_STORAGE='full'):
+        for op_task in OperatorTask.objects.filter(step__ticket=full):
+            op_task.progress_task()
+        full.run_workflow(context)
+
+    for ticket in [single] + tickets:
+        assert _history(ticket) == _history(full)
+
+
+@pytest.mark.django_db
+@override_settings(TASKFLOW_STATE_STORAGE='delta')
+def test_delta_state_in_place_changes(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    ticket = Workflow.objects.get(slug='simple-steps').create_ticket(context)
+    first = ticket.run_workflow(context)
+    initial = dict(first.state)
+
+    # A clone shares the state of its source until it is replaced
+    second = first.clone_task(context)
+    second.state['changed'] = True
+    second.save()
+    third = second.clone_task(context)
+    third.state = {'replaced': True}
+    third.save()
+
+    assert Task.objects.get(pk=first.pk).state == initial
+    assert Task.objects.get(pk=second.pk).state == dict(initial, changed=True)
+    assert Task.objects.get(pk=third.pk).state == {'replaced': True}
+
+    # Updating a delta-encoded task recomputes its patch
+    loaded = Task.objects.get(pk=second.pk)
+    loaded.state['more'] = 1
+    loaded.save()
+    assert Task.objects.get(pk=second.pk).state == dict(initial, changed=True, more=1)
+    assert Task.objects.get(pk=third.pk).state == {'replaced': True}
@@ -1,7 +1,8 @@
 import pytest
 
 from django.urls import reverse
-from django_taskflow.models import Workflow, Ticket
+from django_taskflow.models import Workflow, Ticket, Task, OperatorTask
+from django_taskflow.views import TaskListView
 
 
 @pytest.mark.django_db
@@ -32,3 +33,132 @@ def test_start_workflow(client, django_user_model):
     resp = client.get(reverse('taskflow:initiate_workflow', kwargs={'slug':wflow.slug}))
     assert resp.status_code == 200
     assert Ticket.objects.filter(workflow=wflow).count() == num_tickets + 1
+
+
+def _run_tickets(user, count):
+    context = {'user': user,
+               }
+    for _ in range(count):
+        Workflow.objects.get(slug='multistep').create_ticket(context).run_workflow(context)
+
+
+@pytest.mark.django_db
+def test_task_list_pages(client, rf, django_user_model, django_assert_num_queries):
+    user = django_user_model.objects.create(username="fred")
+    _run_tickets(user, 3)
+    total = Task.objects.count()
+
+    # The number of queries does not depend on the number of rows shown
+    for page_size in (2, total):
+        view = TaskListView.as_view(page_size=page_size)
+        with django_assert_num_queries(1):
+            resp = view(rf.get(reverse('taskflow:full_task_list')))
+            resp.render()
+        assert len(resp.context_data['object_list']) == page_size
+
+    seen = []
+    url = reverse('taskflow:full_task_list')
+    while url:
+        resp = client.get(url)
+        assert resp.status_code == 200
+        seen.extend(task.pk for task in resp.context['object_list'])
+        if resp.context['has_next']:
+            url = reverse('taskflow:full_task_list') + '?' + resp.context['next_query']
+        else:
+            url = None
+    expected = list(Task.objects.order_by('-creation', '-id').values_list('pk', flat=True))
+    assert seen == expected
+
+
+@pytest.mark.django_db
+def test_list_filters(client, django_user_model):
+    user = django_user_model.objects.create(username="fred")
+    _run_tickets(user, 2)
+
+    resp = client.get(reverse('taskflow:tickets'), {'workflow': 'multistep'})
+    assert len(resp.context['object_list']) == 2
+    resp = client.get(reverse('taskflow:tickets'), {'workflow': 'simple-steps'})
+    assert len(resp.context['object_list']) == 0
+
+    resp = client.get(reverse('taskflow:full_task_list'), {'status': Task.Status.WAITING})
+    assert resp.context['object_list']
+    assert all(task.status == Task.Status.WAITING for task in resp.context['object_list'])
+
+    resp = client.get(reverse('taskflow:operator_tasks'), {'status': 'open'})
+    assert len(resp.context['object_list']) == OperatorTask.objects.filter(completed__isnull=True).count()
+
+    resp = client.get(reverse('taskflow:full_task_list'), {'since': '2999-01-01'})
+    assert len(resp.context['object_list']) == 0
+
+    for params in ({'after': 'not a cursor'}, {'status': 'x'}, {'until': 'yesterday'}):
+        resp = client.get(reverse('taskflow:full_task_list'), params)
+        assert resp.status_code == 400
+
+
+@pytest.mark.django_db
+def test_create_tickets(client, django_user_model):
+    user = django_user_model.objects.create(username="fred")
+    url = reverse('taskflow:create_tickets')
+    items = [{'workflow': 'simple-steps', 'state': {'n': n}} for n in range(3)]
+    items.append({'workflow': 'multistep', 'state': {}})
+
+    assert client.post(url, items, content_type='application/json').status_code == 403
+
+    client.force_login(user)
+    resp = client.post(url, items, content_type='application/json')
+    assert resp.status_code == 201
+    tickets = [Ticket.objects.get(pk=pk) for pk in resp.json()['tickets']]
+    assert [t.workflow.slug for t in tickets] == ['simple-steps'] * 3 + ['multistep']
+    for n, ticket in enumerate(tickets[:3]):
+        assert ticket.status == Task.Status.NEW
+        assert ticket.current_task.state == {'n': n}
+        assert ticket.current_task.step.element.is_initial
+
+    # The tickets run as if started one by one
+    context = {'user': user,
+               }
+    tickets[0].run_workflow(context)
+    assert tickets[0].current_task.status == Task.Status.FINISHED
+    assert tickets[0].current_task.state == {'n': 0, 'fred': 'jim'}
+
+    resp = client.post(url + '?run=1', items[:1], content_type='application/json')
+    ticket = Ticket.objects.get(pk=resp.json()['tickets'][0])
+    # The initial element has processed the new task
+    assert ticket.status != Task.Status.NEW
+
+    resp = client.post(url, [{'workflow': 'nonesuch', 'state': {}}], content_type='application/json')
+    assert resp.status_code == 400
+    assert 'workflow' in resp.json()[0]
+
+
+@pytest.mark.django_db
+def test_idempotency_keys(client, django_user_model, django_assert_num_queries):
+    user = django_user_model.objects.create(username="fred")
+    other = django_user_model.objects.create(username="jim")
+    wflow = Workflow.objects.get(slug='simple-steps')
+
+    ticket = wflow.create_ticket({'user': user, 'idempotency_key': 'a'})
+    with django_assert_num_queries(1):
+        assert wflow.create_ticket({'user': user, 'idempotency_key': 'a'}) == ticket
+    assert wflow.create_ticket({'user': other, 'idempotency_key': 'a'}) != ticket
+    assert wflow.create_ticket({'user': user}) != wflow.create_ticket({'user': user})
+
+    client.force_login(user)
+    url = reverse('taskflow:initiate_workflow', kwargs={'slug': wflow.slug})
+    first = client.get(url, HTTP_IDEMPOTENCY_KEY='b').json()['ticket']
+    assert client.get(url, HTTP_IDEMPOTENCY_KEY='b').json()['ticket'] == first
+    assert client.get(url, HTTP_IDEMPOTENCY_KEY='a').json()['ticket'] == ticket.pk
+
+    count = Ticket.objects.count()
+    items = [{'workflow': 'simple-steps', 'state': {}, 'idempotency_key': 'a'},
+             {'workflow': 'simple-steps', 'state': {}, 'idempotency_key': 'c'},
+             {'workflow': 'simple-steps', 'state': {}, 'idempotency_key': 'c'},
+             {'workflow': 'simple-steps', 'state': {}},
+             ]
+    ids = client.post(reverse('taskflow:create_tickets'), items, content_type='application/json').json()['tickets']
+    assert ids[0] == ticket.pk
+    assert ids[1] == ids[2]
+    assert Ticket.objects.count() == count + 2
+    again = client.post(reverse('taskflow:create_tickets'), items, content_type='application/json').json()['tickets']
+    assert again[:3] == ids[:3]
+    assert Ticket.objects.count() == count + 3
@@ -0,0 +1,51 @@
+import pytest
+
+from django_taskflow.models import Workflow, Task, OperatorTask
+from django_taskflow.signals import ticket_runnable
+from django_taskflow.worker import TicketWorker, enqueue_ticket
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_operator_task_wakeup(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    woken = []
+    def receiver(sender, ticket_id, **kwargs):
+        woken.append(ticket_id)
+
+    ticket_runnable.connect(receiver)
+    ticket_runnable.connect(enqueue_ticket)
+    try:
+        # Creating a ticket queues it, without running anything
+        ticket = Workflow.objects.get(slug='multistep').create_ticket(context)
+        assert woken == [ticket.pk]
+        assert not Task.objects.filter(step__ticket=ticket).exists()
+        ticket.run_workflow(context)
+        assert woken == [ticket.pk]
+        ticket.refresh_from_db()
+        assert ticket.last_check is not None
+        woken.clear()
+
+        op_task = OperatorTask.objects.get(step__ticket=ticket)
+        op_task.progress_task()
+        # Saving again must not wake the ticket a second time
+        op_task.save()
+        OperatorTask.objects.get(pk=op_task.pk).save()
+    finally:
+        ticket_runnable.disconnect(receiver)
+        ticket_runnable.disconnect(enqueue_ticket)
+
+    assert woken == [ticket.pk]
+
+    # Queued for the workers rather than advanced here
+    ticket.refresh_from_db()
+    assert ticket.status == Task.Status.UPDATED
+    assert ticket.last_check is None
+
+    assert TicketWorker(user=user).process_batch() == 1
+    ticket.refresh_from_db()
+    assert ticket.status == Task.Status.FINISHED
+    assert Task.objects.filter(step__ticket=ticket, status=Task.Status.UPDATED).count() == 1
@@ -0,0 +1,152 @@
+import pytest
+
+from io import StringIO
+
+from django.core.management import call_command
+
+from django_taskflow.models import Workflow, Ticket, Task, Element, Operation, Link
+from django_taskflow.worker import TicketWorker, runnable_tickets
+
+
+@pytest.mark.django_db
+def test_worker_advances_tickets(django_user_model):
+    wf = Workflow.objects.get(slug='multistep')
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+
+    tickets = [wf.create_ticket(context) for _ in range(3)]
+    assert runnable_tickets().filter(pk__in=[t.pk for t in tickets]).count() == 3
+
+    worker = TicketWorker(batch_size=2)
+    assert worker.process_batch() == 2
+    assert worker.process_batch() == 1
+    assert worker.process_batch() == 0
+    assert worker.failures == []
+
+    for t in tickets:
+        t.refresh_from_db()
+        assert t.status == Task.Status.WAITING
+        assert t.current_task.creator == user
+
+    # Completing the operator task makes the ticket runnable again
+    Ticket.objects.get(pk=tickets[0].pk).current_task.step.operatortask_set.get().progress_task()
+    assert list(runnable_tickets()) == [tickets[0]]
+
+    out = StringIO()
+    call_command('taskflow_worker', '--once', stdout=out)
+    assert "Processed 1 tickets" in out.getvalue()
+
+    tickets[0].refresh_from_db()
+    assert tickets[0].status == Task.Status.FINISHED
+    assert runnable_tickets().count() == 0
+
+
+
+script_calls = []
+
+
+def _result(state):
+    # A state that cannot be stored as JSON fails when its task is saved
+    return dict(state, done=object() if state.get('unsaveable') else True)
+
+
+def single_script(element_parameters, source_data):
+    script_calls.append(1)
+    return _result(source_data)
+
+
+def batch_script(element_parameters, source_data):
+    script_calls.append(len(source_data))
+    return [_result(state) for state in source_data]
+
+
+@pytest.mark.django_db
+def test_worker_batches(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    workflow = Workflow.objects.create(name="Batch", slug='batch')
+    start = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='__init'),
+                                   op_params={}, slug_name='start', is_initial=True)
+    script = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='script'),
+                                    op_params={'script_name': 'django_taskflow.tests.test_worker.single_script',
+                                               'batch_script_name': 'django_taskflow.tests.test_worker.batch_script'},
+                                    slug_name='batch')
+    Link.objects.create(source=start, target=script, slug_name='next')
+
+    # The tickets claimed together reach the batch operation together
+    script_calls.clear()
+    tickets = Ticket.create_many([(workflow, {}) for _ in range(4)], context)
+    worker = TicketWorker(batch_size=10)
+    assert worker.process_batch() == 4
+    assert script_calls == [4]
+    assert worker.failures == []
+    assert {t.status for t in Ticket.objects.filter(pk__in=[t.pk for t in tickets])} == {Task.Status.FINISHED}
+
+    # A batch that fails once its operations have run is not run again, which would repeat
+    # them, and all its tickets fail
+    script_calls.clear()
+    tickets = Ticket.create_many([(workflow, {'unsaveable': i == 1}) for i in range(3)], context)
+    assert worker.process_batch() == 3
+    assert script_calls == [3]
+    assert [ticket_id for ticket_id, e in worker.failures] == [t.pk for t in tickets]
+    assert {t.status for t in Ticket.objects.filter(pk__in=[t.pk for t in tickets])} == {Task.Status.NEW}
+    assert worker.process_batch() == 0
+
+    # A batch that fails before any operation has run is run again a ticket at a time, and
+    # only the ticket at fault fails
+    worker.failures.clear()
+    script_calls.clear()
+    init = Operation.objects.get(slug='__init')
+    removed = Operation.objects.create(name="Removed", slug='removed', function=init.function)
+    broken = Workflow.objects.create(name="Broken", slug='broken')
+    Element.objects.create(workflow=broken, operation=removed, op_params={}, slug_name='start', is_initial=True)
+    tickets = Ticket.create_many([(workflow, {}), (broken, {}), (workflow, {})], context)
+    # The broken workflow can no longer be compiled
+    removed.function = 'django_taskflow.tests.test_worker.removed_operation'
+    removed.save()
+    assert worker.process_batch() == 3
+    assert script_calls == [1, 1]
+    assert [ticket_id for ticket_id, e in worker.failures] == [tickets[1].pk]
+    statuses = dict(Ticket.objects.filter(pk__in=[t.pk for t in tickets]).values_list('pk', 'status'))
+    assert statuses == {tickets[0].pk: Task.Status.FINISHED,
+                        tickets[1].pk: Task.Status.NEW,
+                        tickets[2].pk: Task.Status.FINISHED}
+    assert worker.process_batch() == 0
+
+
+side_effects = []
+
+
+def side_effect_script(element_parameters, source_data):
+    side_effects.append(source_data['n'])
+    return _result(source_data)
+
+
+@pytest.mark.django_db
+def test_worker_runs_operations_once(django_user_model):
+    user = django_user_model.objects.create(username="test user",
+                                            password='tupass')
+    context = {'user': user,
+               }
+    workflow = Workflow.objects.create(name="Side effect", slug='side-effect')
+    start = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='__init'),
+                                   op_params={}, slug_name='start', is_initial=True)
+    script = Element.objects.create(workflow=workflow, operation=Operation.objects.get(slug='script'),
+                                    op_params={'script_name': 'django_taskflow.tests.test_worker.side_effect_script'},
+                                    slug_name='script')
+    Link.objects.create(source=start, target=script, slug_name='next')
+
+    # The script has run for every ticket when the result of the second cannot be saved,
+    # and it is not run for any of them again
+    side_effects.clear()
+    tickets = Ticket.create_many([(workflow, {'n': i, 'unsaveable': i == 1}) for i in range(3)], context)
+    worker = TicketWorker(batch_size=10)
+    assert worker.process_batch() == 3
+    assert side_effects == [0, 1, 2]
+    assert [ticket_id for ticket_id, e in worker.failures] == [t.pk for t in tickets]
+    assert worker.process_batch() == 0
+    assert side_effects == [0, 1, 2]
@@ -1,5 +1,5 @@
 from django.urls import path
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, permission_required
 
 from .app_name import app_name
 
@@ -7,12 +7,14 @@ from .views import WorkflowListView, WorkflowDetailView, element_view, TicketLis
 from .views import TaskListView, LiveTaskListView, AllTaskListView
 from .views import OperatorTaskListView
 
-from .views import update_ticket, start_ticket
+from .views import update_ticket, start_ticket, metrics, export
+from .rest_views import create_tickets
 
 urlpatterns = [
     path('workflows/', WorkflowListView.as_view(), name='workflows'),
     path('workflow/detail/<slug>', WorkflowDetailView.as_view(), name="workflow"),
     path('workflow/start/<slug>', login_required(start_ticket), name="initiate_workflow"),
+    path('tickets/create/', create_tickets, name="create_tickets"),
 
     path('element/<slug>/<slug_name>', element_view, name="element"),
 
@@ -26,4 +28,7 @@ urlpatterns = [
     path('live_tasks/', LiveTaskListView.as_view(), name="live_tasks"),
 
     path('operator_tasks/', OperatorTaskListView.as_view(), name="operator_tasks"),
+
+    path('metrics/', metrics, name="metrics"),
+    path('export/', permission_required('django_taskflow.view_ticket', raise_exception=True)(export), name="export"),
 ]
@@ -1,9 +1,16 @@
-from django.http import JsonResponse
+from django.core.exceptions import PermissionDenied, SuspiciousOperation
+from django.db.models import Q
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.crypto import constant_time_compare
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.views.generic import ListView, DetailView
 
 from rest_framework.parsers import JSONParser
 
+from .conf import taskflow_setting
+from .export import parse_moment, export_tickets, ndjson
+from .metrics import metrics_collector
 from .models import Workflow, Element, Ticket, Task, OperatorTask
 
 
@@ -19,16 +26,106 @@ class TicketDetailView(DetailView):
     model = Ticket
 
 
-class TicketListView(ListView):
+class KeysetListView(ListView):
+    """List in pages, newest first, each page continuing from the last row of the previous one.
+
+    Rows are ordered by (date_field, id) and a page is selected by the values of the last
+    row before it, passed as the 'after' parameter, so every page costs the same however
+    far into the list it is. The list can be filtered by workflow slug, status and the
+    'since' and 'until' dates, through the lookups in filter_lookups.
+    """
+    page_size = 50
+    date_field = 'creation'
+    filter_lookups = {}
+    related = []
+
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related(*self.related)
+        params = self.request.GET
+
+        for name, lookup in self.filter_lookups.items():
+            value = params.get(name)
+            if value:
+                queryset = queryset.filter(**{lookup: self.filter_value(name, value)})
+
+        for name, lookup in [('since', 'gte'), ('until', 'lt')]:
+            value = params.get(name)
+            if value:
+                queryset = queryset.filter(**{f"{self.date_field}__{lookup}": self.parse_moment(value)})
+
+        after = params.get('after')
+        if after:
+            moment, pk = self.decode_cursor(after)
+            queryset = queryset.filter(Q(**{f"{self.date_field}__lt": moment}) |
+                                       Q(**{self.date_field: moment, 'id__lt': pk}))
+
+        return queryset.order_by(f"-{self.date_field}", '-id')
+
+    def filter_value(self, name, value):
+        if name == 'status':
+            try:
+                return int(value)
+            except ValueError:
+                raise SuspiciousOperation(f"Invalid status {value}")
+        return value
+
+    @staticmethod
+    def parse_moment(value):
+        moment = parse_moment(value)
+        if moment is None:
+            raise SuspiciousOperation(f"Invalid date {value}")
+        return moment
+
+    @staticmethod
+    def encode_cursor(moment, pk):
+        return urlsafe_base64_encode(f"{moment.isoformat()}|{pk}".encode())
+
+    def decode_cursor(self, cursor):
+        try:
+            moment, pk = urlsafe_base64_decode(cursor).decode().split('|')
+            return self.parse_moment(moment), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise SuspiciousOperation("Invalid page cursor")
+
+    def keyset_page(self, queryset, page_size):
+        """Return the first page_size rows, and whether there are more"""
+        rows = list(queryset[:page_size + 1])
+        return rows[:page_size], len(rows) > page_size
+
+    def get_context_data(self, **kwargs):
+        page, has_next = self.keyset_page(self.object_list, self.page_size)
+
+        next_query = None
+        if has_next:
+            last = page[-1]
+            params = self.request.GET.copy()
+            params['after'] = self.encode_cursor(getattr(last, self.date_field), last.pk)
+            next_query = params.urlencode()
+
+        return super().get_context_data(object_list=page,
+                                        has_next=has_next,
+                                        next_query=next_query,
+                                        **kwargs)
+
+
+class TicketListView(KeysetListView):
     model = Ticket
+    filter_lookups = {'workflow': 'workflow__slug',
+                      'status': 'status',
+                      }
 
 
 class TaskDetailView(DetailView):
     model = Task
 
 
-class TaskListView(ListView):
+class TaskListView(KeysetListView):
     model = Task
+    filter_lookups = {'workflow': 'step__ticket__workflow__slug',
+                      'status': 'status',
+                      }
+    # Everything shown by Task.__str__
+    related = ['step__ticket', 'step__element__workflow', 'creator']
 
 
 class LiveTaskListView(TaskListView):
@@ -68,6 +165,64 @@ def start_ticket(request, slug=None):
                         status=200)
 
 
-class OperatorTaskListView(ListView):
+class OperatorTaskListView(KeysetListView):
 
     model = OperatorTask
+    date_field = 'created'
+    filter_lookups = {'workflow': 'step__ticket__workflow__slug',
+                      'status': 'completed__isnull',
+                      }
+    related = ['step__ticket', 'operator']
+
+    def filter_value(self, name, value):
+        if name == 'status':
+            # Operator tasks are either open or completed
+            if value not in ('open', 'completed'):
+                raise SuspiciousOperation(f"Invalid status {value}")
+            return value == 'open'
+        return super().filter_value(name, value)
+
+
+def metrics_allowed(request):
+    """Whether the request carries TASKFLOW_METRICS_TOKEN, or comes from a user allowed to view tickets"""
+    token = taskflow_setting('METRICS_TOKEN')
+    if token:
+        scheme, _, value = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() == 'bearer' and constant_time_compare(value, token):
+            return True
+    return request.user.has_perm('django_taskflow.view_ticket')
+
+
+def metrics(request):
+    """Engine metrics in the Prometheus text format, if the configured collector provides them"""
+    if not metrics_allowed(request):
+        raise PermissionDenied
+    render = getattr(metrics_collector(), 'render', None)
+    if render is None:
+        raise Http404("No metrics collector with a text format is configured")
+    return HttpResponse(render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def export(request):
+    """Stream the history of tickets as newline delimited JSON.
+
+    Tickets can be filtered by workflow slug, status, and creation 'since' and 'until';
+    'after' resumes the export after the id of the last ticket received.
+    """
+    params = request.GET
+    filters = {}
+    for name, param in [('status', 'status'), ('after_id', 'after')]:
+        if params.get(param):
+            try:
+                filters[name] = int(params[param])
+            except ValueError:
+                raise SuspiciousOperation(f"Invalid {param} {params[param]}")
+    if params.get('workflow'):
+        filters['workflow'] = params['workflow']
+    for name in ('since', 'until'):
+        if params.get(name):
+            filters[name] = KeysetListView.parse_moment(params[name])
+
+    return StreamingHttpResponse(ndjson(export_tickets(**filters)),
+                                 content_type='application/x-ndjson')
@@ -0,0 +1,188 @@
+"""Worker that advances runnable tickets
+
+Tickets are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers, in any number of processes and hosts, can share the load
+without two of them advancing the same ticket.
+"""
+
+
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from . import executors
+from .engine import BatchRun
+from .models import Ticket, Workflow, RUNNABLE_STATUSES
+
+
+def runnable_tickets():
+    """Tickets that are not finished or waiting, and have changed since they were last checked"""
+    return Ticket.objects.filter(Q(status__isnull=True) | Q(status__in=RUNNABLE_STATUSES),
+                                 Q(last_check__isnull=True) | Q(last_check__lt=F('current_task__creation')))
+
+
+def enqueue_ticket(sender, ticket_id, **kwargs):
+    """Receiver for ticket_runnable that puts the ticket at the front of the workers' queue.
+
+    Enable with TASKFLOW_WAKEUP_HANDLER = 'django_taskflow.worker.enqueue_ticket'. Workers
+    claim tickets that have not been checked before any others, so clearing the last
+    check of the ticket has it advanced by the next batch claimed. A ticket already
+    locked by a worker is left for that worker.
+    """
+    with transaction.atomic():
+        if Ticket.objects.select_for_update(skip_locked=True).filter(pk=ticket_id).exists():
+            Ticket.objects.filter(pk=ticket_id).update(last_check=None)
+
+
+class TicketWorker:
+    """Claim and advance batches of runnable tickets"""
+
+    def __init__(self, batch_size=50, poll_interval=1.0, user=None, notifications=None):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.user = user
+        self.notifications = notifications
+        self.stopping = False
+        self.processed = 0
+        self.failures = []
+
+    def claim_batch(self):
+        """Lock a batch of runnable tickets. Must be called inside a transaction."""
+        qs = runnable_tickets().select_for_update(skip_locked=True, of=('self',))
+        qs = qs.select_related('creator').order_by(F('last_check').asc(nulls_first=True), 'pk')
+        return list(qs[:self.batch_size])
+
+    def context_for(self, ticket):
+        return Workflow.user_context(self.user or ticket.creator)
+
+    def collect_results(self):
+        """Record the results of any scripts that have finished in the process pool, and start waiting ones"""
+        with transaction.atomic():
+            if executors.pending_count():
+                executors.collect_results()
+            executors.claim_runs()
+
+    def process_batch(self):
+        """Claim a batch of tickets and run them to quiescence together. Returns the number claimed."""
+        self.collect_results()
+        with transaction.atomic():
+            tickets = self.claim_batch()
+            for group in self.groups(tickets):
+                self.process_group(group)
+        self.processed += len(tickets)
+        return len(tickets)
+
+    def groups(self, tickets):
+        """Split tickets into those that can share a batch run: same user, and same way of saving tasks"""
+        groups = {}
+        for ticket in tickets:
+            user = self.user or ticket.creator
+            groups.setdefault((user.pk, ticket.saves_checkpoints()), []).append(ticket)
+        return list(groups.values())
+
+    def process_group(self, tickets):
+        """Advance tickets in one batch run, so that batch operations are given them together.
+
+        If the run fails it is rolled back. When it failed before any operation was called,
+        the tickets are advanced one at a time so that only those at fault are recorded as
+        failed. Otherwise running them again would repeat the operations that had already
+        run, so every ticket of the group is recorded as failed.
+        """
+        batch_run = BatchRun(self.context_for(tickets[0]), checkpoints=tickets[0].saves_checkpoints())
+        try:
+            batch_run.run(tickets)
+        except Exception as e:
+            if batch_run.operations_started:
+                # Record the check so that the tickets are not reclaimed until they change
+                self.failures.extend((ticket.pk, e) for ticket in tickets)
+                Ticket.objects.filter(pk__in=[t.pk for t in tickets]).update(last_check=now())
+                return
+            for ticket in tickets:
+                ticket.refresh_from_db(fields=['current_task', 'status', 'last_check'])
+                self.process_ticket(ticket)
+
+    def process_ticket(self, ticket):
+        try:
+            with transaction.atomic():
+                ticket.run_workflow(self.context_for(ticket))
+        except Exception as e:
+            # Record the check so that the ticket is not reclaimed until it changes
+            self.failures.append((ticket.pk, e))
+            Ticket.objects.filter(pk=ticket.pk).update(last_check=now())
+
+    def run(self, max_batches=None):
+        """Process batches until stopped, sleeping whenever there is no work"""
+        if self.notifications is not None:
+            self.notifications.listen()
+        batches = 0
+        try:
+            while not self.stopping:
+                if max_batches is not None and batches >= max_batches:
+                    break
+                batches += 1
+                if self.process_batch() == 0:
+                    self.idle()
+        finally:
+            # Release the scripts still running, for another worker to take over
+            executors.shutdown(wait_for_pending=False)
+
+    def idle(self):
+        """Wait for more work, waking early if a ticket is notified as runnable or a pending script finishes"""
+        if executors.pending_count():
+            executors.wait_for_results(self.poll_interval)
+        elif self.notifications is not None:
+            self.notifications.wait(self.poll_interval)
+        else:
+            time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.stopping = True
+
+
+class AsyncTicketWorker(TicketWorker):
+    """Worker that advances the tickets of each batch concurrently on an event loop.
+
+    Operations with async def methods can then wait on external systems for many
+    tickets at once. Each ticket is run in memory, as by engine.BatchRun, and what
+    it wrote is written in a transaction of its own once it has finished, so that a
+    ticket that fails writes nothing and leaves the rest of the batch unaffected.
+    """
+
+    def __init__(self, concurrency=100, **kwargs):
+        super().__init__(**kwargs)
+        self.concurrency = concurrency
+
+    def process_batch(self):
+        self.collect_results()
+        with transaction.atomic():
+            tickets = self.claim_batch()
+            runs = [BatchRun(self.context_for(ticket), checkpoints=ticket.saves_checkpoints())
+                    for ticket in tickets]
+            failed = async_to_sync(self.arun_tickets)(tickets, runs)
+        if failed:
+            # Record the check so that the tickets are not reclaimed until they change
+            Ticket.objects.filter(pk__in=failed).update(last_check=now())
+        self.processed += len(tickets)
+        return len(tickets)
+
+    async def arun_tickets(self, tickets, runs):
+        """Run each ticket concurrently, with its own BatchRun. Returns the primary keys of any that failed."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(ticket, batch_run):
+            async with semaphore:
+                return await batch_run.arun([ticket])
+
+        results = await asyncio.gather(*[run(ticket, batch_run) for ticket, batch_run in zip(tickets, runs)],
+                                       return_exceptions=True)
+        failed = []
+        for ticket, result in zip(tickets, results):
+            if isinstance(result, Exception):
+                self.failures.append((ticket.pk, result))
+                failed.append(ticket.pk)
+        return failed
@@ -20,6 +20,8 @@ setup(
     license='AGPL',
     packages=[
     'django_taskflow',
+    'django_taskflow.management',
+    'django_taskflow.management.commands',
     'django_taskflow.migrations',
     'django_taskflow.templatetags',
     ],